@@ -0,0 +1,327 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from meteostat import Point, Hourly
+try:
+    from scipy.interpolate import CubicSpline
+except ImportError:
+    CubicSpline = None # spline resampling falls back to linear interpolation
+
+RS =  287.1 #J/(kg·K)
+HEKTO = 100
+CELSIUS_IN_KELVIN = 273.15
+
+END = datetime(2022, 12, 31, 23, 59) # End of the climate series
+
+COLUMNS = ["time", "density", "temperature", "windspeed"] # time in seconds since epoch (UTC)
+VARIABLES = ["density", "temperature", "windspeed"]
+RESAMPLE_METHODS = ["linear", "spline"]
+SPLINE_HOURS = 24 # hours of the series on each side of the looked up ticks the spline runs through
+
+def getenv_or_exit(env_name, default="default"):
+    value = os.getenv(env_name, default)
+    if value == default:
+        raise SystemExit(f"Environment variable {env_name} not set")
+    return value
+
+def cache_path(cache_dir, latitude, longitude, altitude, start, end):
+    """
+    Directory of the cached series, one per point and source period (see source_periods).
+    """
+    name = f"{latitude}_{longitude}_{altitude}_{start:%Y%m%d%H%M}_{end:%Y%m%d%H%M}"
+    return os.path.join(cache_dir, name)
+
+def fetch(latitude, longitude, altitude, start, end):
+    """
+    Fetches the hourly meteostat series and calculates the air density.
+    Returns a dict with one numpy array per column.
+    """
+    data = Hourly(Point(latitude, longitude, altitude), start, end).fetch()
+
+    pressure = data['pres'].to_numpy(dtype=np.float64)
+    temperature = data['temp'].to_numpy(dtype=np.float64)
+    return {
+        "time": data.index.values.astype("datetime64[s]").astype(np.int64),
+        "density": np.round((pressure*HEKTO)/(RS*(temperature+CELSIUS_IN_KELVIN)), 2),
+        "temperature": temperature,
+        "windspeed": data['wspd'].to_numpy(dtype=np.float64),
+    }
+
+def save(path, series):
+    """
+    Stores every column as its own .npy file, so the loader can memory-map them.
+    The files are written to a temporary directory first, so a crash never leaves a half written cache.
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for column in COLUMNS:
+        np.save(os.path.join(tmp_path, column + ".npy"), series[column])
+    with open(os.path.join(tmp_path, "meta.json"), "w") as file:
+        json.dump({"columns": COLUMNS, "length": len(series["time"])}, file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+def load(path):
+    """
+    Memory-maps the cached columns. Returns None if there is no complete cache.
+    """
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return {column: np.load(os.path.join(path, column + ".npy"), mmap_mode="r") for column in COLUMNS}
+
+def load_or_prepare(cache_dir, latitude, longitude, altitude, start, end):
+    """
+    Loads the series from the local cache. If there is no cache yet, the series is fetched
+    from meteostat and stored in the cache for the next start.
+    """
+    path = cache_path(cache_dir, latitude, longitude, altitude, start, end)
+    series = load(path)
+    if series is not None:
+        logging.info(f"Loaded climate data from cache {path}")
+        return series
+
+    logging.info(f"No cached climate data in {path}, fetching from meteostat")
+    series = fetch(latitude, longitude, altitude, start, end)
+    try:
+        save(path, series)
+    except OSError as e:
+        logging.warning(f"Could not write climate data cache {path}: {e}")
+    return series
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def source_periods(first, last):
+    """
+    Calendar months (first and last hour) that cover first .. last. The hourly series is fetched and cached
+    per month, so the cache does not depend on the tick start, the tick interval or the chunk size.
+    """
+    periods = []
+    month = datetime(first.year, first.month, 1)
+    while month <= last:
+        following = next_month(month)
+        periods.append((month, following - timedelta(hours=1)))
+        month = following
+    return periods
+
+def epoch_seconds(timestamps):
+    """
+    Converts a datetime, an ISO string or a list of them to seconds since epoch.
+    """
+    return np.asarray(np.array(timestamps, dtype="datetime64[s]").astype(np.int64))
+
+def fill_gaps(values):
+    """
+    Replaces missing samples (NaN) by linear interpolation between the neighbouring samples.
+    """
+    missing = np.isnan(values)
+    if not missing.any() or missing.all():
+        return values
+    index = np.arange(len(values))
+    values = np.array(values)
+    values[missing] = np.interp(index[missing], index[~missing], values[~missing])
+    return values
+
+def resample_method(method):
+    """Checks the resample method, spline needs scipy."""
+    if method not in RESAMPLE_METHODS:
+        raise SystemExit(f"Unknown resample method {method}, use one of {RESAMPLE_METHODS}")
+    if method == "spline" and CubicSpline is None:
+        logging.warning("scipy is not installed, resampling the climate data linear instead of spline")
+        return "linear"
+    return method
+
+def resample(series, ticks, method="linear"):
+    """
+    Interpolates the hourly series at the tick times (seconds since epoch).
+    Returns an array tick x variable (in the order of VARIABLES).
+    Ticks before the first or after the last sample keep the first or last known value.
+    """
+    time = np.asarray(series["time"], dtype=np.float64)
+    ticks = np.clip(ticks, time[0], time[-1])
+    values = np.column_stack([fill_gaps(np.asarray(series[variable], dtype=np.float64)) for variable in VARIABLES])
+    if method == "spline" and len(time) > 1:
+        resampled = CubicSpline(time, values)(ticks) # one spline for all variables
+    else:
+        resampled = np.column_stack([np.interp(ticks, time, column) for column in values.T])
+    resampled = np.round(resampled, 2)
+    # splines can overshoot below zero between calm hours
+    windspeed = VARIABLES.index("windspeed")
+    resampled[:, windspeed] = np.maximum(resampled[:, windspeed], 0.0)
+    return resampled
+
+def to_datetime(seconds):
+    """Converts seconds since epoch to a datetime (UTC)."""
+    return np.datetime64(int(seconds), "s").astype(datetime)
+
+def tick_index(timestamps, start, interval_minutes, length):
+    """
+    Position of the tick timestamp(s) in the resampled arrays, wrapping around at the end of the series.
+    """
+    offset = epoch_seconds(timestamps) - epoch_seconds(start)
+    return (offset // (interval_minutes * 60)) % length
+
+def read_sites():
+    """
+    Names and coordinates of the weather stations.
+    With CLIMATE_GEN_NUMBER_OF_SITES = 0 the single station CLIMATE_GEN_NAME / CLIMATE_GEN_COORDINATES_* is used,
+    otherwise the stations CLIMATE_GEN_SITE_<i>_*.
+    """
+    number_of_sites = int(getenv_or_exit("CLIMATE_GEN_NUMBER_OF_SITES", -1))
+    if number_of_sites == 0:
+        names = [getenv_or_exit("CLIMATE_GEN_NAME", "default")]
+        prefixes = ["CLIMATE_GEN_COORDINATES_"]
+    else:
+        names = [getenv_or_exit(f"CLIMATE_GEN_SITE_{i}_NAME", "default") for i in range(number_of_sites)]
+        prefixes = [f"CLIMATE_GEN_SITE_{i}_COORDINATES_" for i in range(number_of_sites)]
+    points = [(float(getenv_or_exit(prefix + "LATITUDE", -1.0)),
+               float(getenv_or_exit(prefix + "LONGITUDE", -1.0)),
+               int(getenv_or_exit(prefix + "ALTITUDE", -1))) for prefix in prefixes]
+    return names, points
+
+class ClimateData:
+    """
+    Climate series of one or more sites, resampled to the ticks on lookup.
+    The hourly series of every site is cached per calendar month and memory-mapped. The months are loaded
+    chunk by chunk in a background thread, a lookup only reads the hours around its ticks from the maps,
+    so the series is never copied into memory as a whole.
+    Ticks are served from every chunk that is already loaded, lookups into missing chunks return None.
+    """
+
+    def __init__(self, cache_dir, points, start, end, interval_minutes, method, chunk_days):
+        self.lock = threading.Lock()
+        self.cache_dir = cache_dir
+        self.points = points # (latitude, longitude, altitude) per site
+        self.start = start
+        self.end = end
+        self.interval_minutes = interval_minutes
+        self.method = resample_method(method)
+
+        self.step = interval_minutes * 60 # seconds between two ticks
+        self.begin = float(epoch_seconds(start))
+        self.length = int((epoch_seconds(end) - self.begin) // self.step) + 1 # number of ticks
+        self.chunk_ticks = int(chunk_days * 24 * 60 // interval_minutes)
+        self.chunks = -(-self.length // self.chunk_ticks)
+        self.loaded = [False] * self.chunks
+        self.error = None
+        # hours around a tick it is interpolated from, the neighbouring hours or the hours the spline runs through
+        self.margin = timedelta(hours=SPLINE_HOURS if self.method == "spline" else 1)
+        self.months = [{} for _ in points] # per site: first hour of the month -> memory-mapped hourly series
+
+    def chunk_period(self, chunk):
+        """First and last timestamp of the chunk."""
+        first = self.start + timedelta(minutes=chunk * self.chunk_ticks * self.interval_minutes)
+        last = min(first + timedelta(minutes=(self.chunk_ticks - 1) * self.interval_minutes), self.end)
+        return first, last
+
+    def load_chunk(self, chunk):
+        """Loads (or fetches) the months of every site the ticks of the chunk are interpolated from."""
+        first, last = self.chunk_period(chunk)
+        periods = source_periods(max(first - self.margin, self.start), min(last + self.margin, self.end))
+        for site, point in enumerate(self.points):
+            for period in periods:
+                if period[0] not in self.months[site]:
+                    self.months[site][period[0]] = load_or_prepare(self.cache_dir, *point, *period)
+            if chunk == 0 and not any(len(self.months[site][month]["time"]) for month, _ in periods):
+                raise ValueError(f"No climate data of site {site} from {first}")
+
+        with self.lock:
+            self.loaded[chunk] = True
+
+    def hours(self, site, first, last):
+        """
+        Hourly series of the site from first to last (seconds since epoch), sliced from the memory maps.
+        If there is no sample in between (a gap in the data), the closest sample is used.
+        """
+        parts = []
+        for month, _ in source_periods(to_datetime(first), to_datetime(last)):
+            series = self.months[site].get(month)
+            if series is not None:
+                begin, end = np.searchsorted(series["time"], first), np.searchsorted(series["time"], last, side="right")
+                parts.append({column: series[column][begin:end] for column in COLUMNS})
+        if sum(len(part["time"]) for part in parts) == 0:
+            parts = [self.closest(site, first)]
+        return {column: np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+
+    def closest(self, site, time):
+        """The last sample of the site before time, or the first one after it if there is none before."""
+        months = [series for _, series in sorted(self.months[site].items())]
+        for series in reversed(months):
+            i = int(np.searchsorted(series["time"], time))
+            if i > 0:
+                return {column: series[column][i - 1:i] for column in COLUMNS}
+        for series in months:
+            if len(series["time"]) > 0:
+                return {column: series[column][:1] for column in COLUMNS}
+
+    def load(self, on_chunk_loaded=None):
+        """Loads all chunks in chronological order."""
+        try:
+            for chunk in range(self.chunks):
+                self.load_chunk(chunk)
+                if on_chunk_loaded is not None:
+                    on_chunk_loaded(self)
+        except Exception as e:
+            logging.error(f"Loading the climate data failed: {e}")
+            with self.lock:
+                self.error = e
+
+    def start_loading(self, on_chunk_loaded=None):
+        """Loads the chunks in a background thread."""
+        thread = threading.Thread(target=self.load, args=(on_chunk_loaded,), daemon=True)
+        thread.start()
+        return thread
+
+    def loaded_chunks(self):
+        with self.lock:
+            return sum(self.loaded)
+
+    def ready(self):
+        return self.loaded_chunks() == self.chunks
+
+    def lookup(self, timestamps):
+        """
+        Returns the values of the tick timestamp(s): site x variable for one timestamp,
+        site x tick x variable for a list. None if the chunks covering the timestamps are not loaded (yet),
+        the caller retries after the next loaded chunk. Never blocks, so it is safe in the MQTT callbacks.
+        """
+        positions = tick_index(timestamps, self.start, self.interval_minutes, self.length)
+        chunks = set(np.atleast_1d(positions // self.chunk_ticks).tolist())
+        with self.lock:
+            if not all(self.loaded[chunk] for chunk in chunks):
+                return None
+
+        ticks = self.begin + np.atleast_1d(positions) * float(self.step)
+        margin = self.margin.total_seconds()
+        values = np.empty((len(self.points), len(ticks), len(VARIABLES)))
+        for site in range(len(self.points)):
+            values[site] = resample(self.hours(site, ticks.min() - margin, ticks.max() + margin), ticks, self.method)
+        return values if np.ndim(positions) > 0 else values[:, 0]
+
+def main():
+    """
+    Prepare step: materialises the configured series into the cache directory,
+    e.g. before a run without network access.
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    _, points = read_sites()
+    cache_dir = getenv_or_exit("CLIMATE_GEN_CACHE_DIR", "default")
+    start = datetime(int(getenv_or_exit('TICK_GEN_START_YEAR', 0)), int(getenv_or_exit('TICK_GEN_START_MONTH', 0)), int(getenv_or_exit('TICK_GEN_START_DAY', 0)))
+    interval_minutes = int(getenv_or_exit('TICK_GEN_TICK_MINUTES', 0))
+    chunk_days = int(getenv_or_exit("CLIMATE_GEN_CHUNK_DAYS", 0))
+
+    # Loading every chunk once fills the cache
+    climate = ClimateData(cache_dir, points, start, END, interval_minutes, "linear", chunk_days)
+    climate.load()
+    if climate.error is not None:
+        raise SystemExit(f"Preparing the climate data failed: {climate.error}")
+    print(f"Climate data stored in {cache_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
 import sys
-import json
 import logging
+import threading
+from collections import deque
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
 from datetime import datetime
-from meteostat import Point, Daily, Hourly
+from dataset import ClimateData, read_sites, END
+from synthetic import SyntheticClimate
 import os
 
-RS =  287.1 #J/(kg·K)
-HEKTO = 100
-CELSIUS_IN_KELVIN = 273.15
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,  # Set minimum level to log
+    format="%(asctime)s - %(levelname)s - %(message)s",  # Customize the output format
+)
 
 def getenv_or_exit(env_name, default="default"):
     value = os.getenv(env_name, default)
@@ -16,77 +21,149 @@ def getenv_or_exit(env_name, default="default"):
         raise SystemExit(f"Environment variable {env_name} not set")
     return value
 
-LATITUDE = float(getenv_or_exit("CLIMATE_GEN_COORDINATES_LATITUDE", -1.0)) 
-LONGITUDE = float(getenv_or_exit("CLIMATE_GEN_COORDINATES_LONGITUDE", -1.0))
-ALTITUDE = int(getenv_or_exit("CLIMATE_GEN_COORDINATES_ALTITUDE", -1))
-# Create Point for Hamburg Koordinaten: 53° 33′ N, 10° 0′ O 6m
-POINT = Point(LATITUDE, LONGITUDE, ALTITUDE)
+# Weather stations served by this process (one station unless CLIMATE_GEN_NUMBER_OF_SITES > 0)
+NUMBER_OF_SITES = int(getenv_or_exit("CLIMATE_GEN_NUMBER_OF_SITES", -1))
+SITES, POINTS = read_sites()
+SITE_PUBLISH = getenv_or_exit("CLIMATE_GEN_SITE_PUBLISH", "default") # "per_site" or "batched"
+if SITE_PUBLISH not in ["per_site", "batched"]:
+    raise SystemExit(f"Unknown site publish mode {SITE_PUBLISH}, use per_site or batched")
+# Directory with the prepared climate series (see dataset.py)
+CACHE_DIR = getenv_or_exit("CLIMATE_GEN_CACHE_DIR", "default")
 
 START_YEAR = int(getenv_or_exit('TICK_GEN_START_YEAR', 0))
 START_MONTH = int(getenv_or_exit('TICK_GEN_START_MONTH', 0))
 START_DAY = int(getenv_or_exit('TICK_GEN_START_DAY', 0))
+TICK_MINUTES = int(getenv_or_exit('TICK_GEN_TICK_MINUTES', 0)) # simulated minutes between two ticks
+RESAMPLE_METHOD = getenv_or_exit("CLIMATE_GEN_RESAMPLE_METHOD", "default") # "linear" or "spline"
+CHUNK_DAYS = int(getenv_or_exit("CLIMATE_GEN_CHUNK_DAYS", 0)) # days of climate data loaded per chunk
+SOURCE = getenv_or_exit("CLIMATE_GEN_SOURCE", "default") # "meteostat" or "synthetic"
 start = datetime(START_YEAR, START_MONTH, START_DAY)
-end = datetime(2022, 12, 31, 23, 59)
+end = END
 
-# Get daily data for 2018 - 2022
-data = Hourly(POINT, start, end)
-data = data.fetch()
-
-p = data['pres']
-t = data['temp']
-s = data['wspd']
-
-p1 = []
-for i in range(len(p)):
-    p1.append(round((p[i]*HEKTO)/(RS*(t[i]+CELSIUS_IN_KELVIN)), 2))
-
-DATA = [p1,t,s]
-
-LENGTH = len(DATA[0])
-POS = 0
-COUNT = 0
-DIVIDE = 4
+if SOURCE == "synthetic":
+    # Seeded stochastic weather of any length, e.g. for load tests (no download, same values for the same seed)
+    DATA = SyntheticClimate(len(SITES), start, TICK_MINUTES,
+                            int(getenv_or_exit("CLIMATE_GEN_SYNTHETIC_SEED", -1)),
+                            float(getenv_or_exit("CLIMATE_GEN_SYNTHETIC_WEIBULL_SCALE", -1.0)),
+                            float(getenv_or_exit("CLIMATE_GEN_SYNTHETIC_WEIBULL_SHAPE", -1.0)))
+elif SOURCE == "meteostat":
+    # Hourly data for 2018 - 2022, resampled to the ticks on lookup. The chunks are loaded in the background
+    # (memory-mapped from the local cache, fetched from meteostat only if there is no cache yet),
+    # so the service is connected and answers the first ticks while the rest of the series is still loading.
+    DATA = ClimateData(CACHE_DIR, POINTS, start, end, TICK_MINUTES, RESAMPLE_METHOD, CHUNK_DAYS)
+else:
+    raise SystemExit(f"Unknown climate source {SOURCE}, use meteostat or synthetic")
 
 NAME = getenv_or_exit("CLIMATE_GEN_NAME", "default")
 # MQTT topic for publishing sensor data
 CLIMATE_DATA = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA", "default")
+CLIMATE_DATA_WINDOW = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA_WINDOW", "default")
+# MQTT topic for publishing the climate data of all sites in one message
+CLIMATE_DATA_SITES = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA_SITES", "default")
+# MQTT topic for publishing the loading progress of the climate data
+CLIMATE_STATUS = getenv_or_exit("TOPIC_CLIMATE_GEN_STATUS", "default")
 # MQTT topic for receiving tick messages
 TICK_TOPIC = getenv_or_exit("TOPIC_TICK_GEN_TICK", "default")
+TICK_WINDOW_TOPIC = getenv_or_exit("TOPIC_TICK_GEN_TICK_WINDOW", "default")
+WINDOW_SIZE = int(getenv_or_exit("TICK_GEN_WINDOW_SIZE", -1))
+
+# Ticks (or tick windows) whose chunk is not loaded yet wait here in arrival order and are published
+# once it is loaded, the MQTT callbacks never block on the loader
+PENDING = deque()
+PENDING_LOCK = threading.Lock() # the callbacks and the loader thread both flush the queue
+
+def site_topic(topic, site):
+    """
+    Topic of a site. A single station keeps the plain topic, in multi-site mode the site name is appended.
+    """
+    return topic if NUMBER_OF_SITES == 0 else topic + SITES[site]
+
+def publish_tick(client, ts_iso, values):
+    """
+    Publishes the climate data of one tick (values: site x variable).
+    """
+    values = values.tolist()
+    if SITE_PUBLISH == "batched" and NUMBER_OF_SITES > 0:
+        density, temperature, windspeed = zip(*values)
+        data = {"sites": SITES, "density": density, "temperature": temperature, "windspeed": windspeed, "timestamp": ts_iso}
+        client.publish(CLIMATE_DATA_SITES, encode(data))
+        return
+
+    for site, (density, temperature, windspeed) in enumerate(values):
+        data = {"density": density, "temperature": temperature, "windspeed": windspeed, "timestamp": ts_iso}
+        # Publish the data to the chaos sensor topic in JSON format
+        client.publish(site_topic(CLIMATE_DATA, site), encode(data))
+
+def publish_tick_window(client, timestamps, values):
+    """
+    Publishes the climate data for all timestamps of a window in one message per site (values: site x tick x variable).
+    """
+    for site in range(len(SITES)):
+        data = {
+            "density": values[site, :, 0].tolist(),
+            "temperature": values[site, :, 1].tolist(),
+            "windspeed": values[site, :, 2].tolist(),
+            "timestamps": timestamps
+        }
+        client.publish(site_topic(CLIMATE_DATA_WINDOW, site), encode(data))
+
+def flush_pending(client):
+    """
+    Publishes the queued ticks in order, up to the first one whose chunk is not loaded yet.
+    If loading the climate data failed, the queued ticks are dropped.
+    """
+    with PENDING_LOCK:
+        while PENDING:
+            publish, timestamps = PENDING[0]
+            values = DATA.lookup(timestamps)
+            if values is None:
+                if DATA.error is not None:
+                    logging.error(f"Climate data not available ({DATA.error}), dropping {len(PENDING)} ticks")
+                    PENDING.clear()
+                return
+            PENDING.popleft()
+            publish(client, timestamps, values)
 
 def on_message_tick(client, userdata, msg):
     """
     Callback function that processes messages from the tick generator topic.
-    It generates a random sensor value and publishes it along with the tick's timestamp.
+    It publishes the climate data of the tick along with the tick's timestamp.
     
     Parameters:
     client (MQTT client): The MQTT client instance
     userdata: User-defined data (not used here)
     msg (MQTTMessage): The message containing the tick timestamp
     """
-    global DATA, POS, LENGTH, DIVIDE, COUNT
-    
     # Extract the timestamp from the tick message and decode it from UTF-8
     ts_iso = msg.payload.decode("utf-8")
 
     # Important: Always send your data with the timestamp from the Tick message.
     # Node Red is designed for real-time or historical messages, so discrepancies 
     # in timestamps can cause errors in the display.
-    alpha = (COUNT%DIVIDE)/DIVIDE
-    #density = round((DATA[0][POS] * (1 - alpha) + DATA[0][(POS + 1) % LENGTH] * alpha),2)
-    #temperature = round((DATA[1][POS] * (1 - alpha) + DATA[1][(POS + 1) % LENGTH] * alpha),2)
-    #windspeed = round((DATA[2][POS] * (1 - alpha) + DATA[2][(POS + 1) % LENGTH] * alpha),2)
-    
-    density = DATA[0][POS]
-    temperature = DATA[1][POS]
-    windspeed = DATA[2][POS]
-    POS = (POS + 1) % LENGTH
-    data = {"density": density, "temperature": temperature, "windspeed": windspeed, "timestamp": ts_iso}
-    # Publish the data to the chaos sensor topic in JSON format
-    client.publish(CLIMATE_DATA, json.dumps(data))
-    #COUNT += 1
-    #if (COUNT%DIVIDE) == 0:
-    #    POS = (POS + 1) % LENGTH
-    #    COUNT = 0
+    # The tick is queued if its chunk is not loaded yet
+    PENDING.append((publish_tick, ts_iso))
+    flush_pending(client)
+    if PENDING:
+        logging.info(f"Climate data of {ts_iso} not loaded yet, {len(PENDING)} ticks queued")
+
+def on_message_tick_window(client, userdata, msg, payload):
+    """
+    Callback function that processes tick window messages.
+    Publishes the climate data for all timestamps of the window in one message per site.
+    """
+    PENDING.append((publish_tick_window, payload["timestamps"]))
+    flush_pending(client)
+    if PENDING:
+        logging.info(f"Climate data of {payload['timestamps'][0]} not loaded yet, {len(PENDING)} tick windows queued")
+
+def send_status_msg(mqtt, climate):
+    """
+    Publishes the loading progress of the climate data (retained, so late subscribers see it too).
+    """
+    loaded = climate.loaded_chunks()
+    data = {"status": "ready" if loaded == climate.chunks else "loading", "loaded": loaded, "chunks": climate.chunks}
+    mqtt.client.publish(CLIMATE_STATUS, encode(data), retain=True)
+    logging.info(f"Climate data: {loaded}/{climate.chunks} chunks loaded")
 
 def main():
     """
@@ -97,10 +174,23 @@ def main():
     # Initialize the MQTT client and connect to the broker
     mqtt = MQTTWrapper('mqttbroker', 1883, name='climate_gen_'+NAME)
     
-    # Subscribe to the tick topic
-    mqtt.subscribe(TICK_TOPIC)
-    # Subscribe with a callback function to handle incoming tick messages
-    mqtt.subscribe_with_callback(TICK_TOPIC, on_message_tick)
+    if WINDOW_SIZE > 1:
+        # The climate data is calculated for whole tick windows instead of single ticks
+        mqtt.subscribe(TICK_WINDOW_TOPIC)
+        mqtt.subscribe_with_callback(TICK_WINDOW_TOPIC, on_message_tick_window, decode=True)
+    else:
+        # Subscribe to the tick topic
+        mqtt.subscribe(TICK_TOPIC)
+        # Subscribe with a callback function to handle incoming tick messages
+        mqtt.subscribe_with_callback(TICK_TOPIC, on_message_tick)
+
+    def on_chunk_loaded(climate):
+        send_status_msg(mqtt, climate)
+        flush_pending(mqtt.client)
+
+    # Load the climate data in the background, report every loaded chunk and publish the ticks waiting for it
+    send_status_msg(mqtt, DATA)
+    DATA.start_loading(on_chunk_loaded)
     
     try:
         # Start the MQTT loop to process incoming and outgoing messages
@@ -0,0 +1,137 @@
+import threading
+import numpy as np
+from dataset import RS, HEKTO, CELSIUS_IN_KELVIN, VARIABLES, epoch_seconds
+
+BLOCK_TICKS = 4096 # ticks generated at once
+CACHED_BLOCKS = 64
+
+SECONDS_PER_DAY = 86400
+HOURS_PER_DAY = 24
+DAYS_PER_YEAR = 365.2425
+SEASON_PEAK_DAY = 15 # windiest and coldest day of the year (mid January)
+DIURNAL_PEAK_HOUR = 14 # windiest and warmest hour of the day (UTC)
+
+WIND_SEASONAL = 0.2 # relative amplitude of the Weibull scale over the year
+WIND_DIURNAL = 0.1 # relative amplitude of the Weibull scale over the day
+WIND_CORRELATION_HOURS = 6 # the windspeed changes over hours, not from tick to tick
+
+TEMPERATURE_MEAN = 9.5 # °C
+TEMPERATURE_SEASONAL = 8.0
+TEMPERATURE_DIURNAL = 3.0
+TEMPERATURE_NOISE = 2.0
+
+PRESSURE_MEAN = 1013.0 # hPa
+PRESSURE_NOISE = 8.0
+PRESSURE_CORRELATION_HOURS = 24
+
+class SyntheticClimate:
+    """
+    Stochastic climate series of any length, deterministic per seed.
+    The windspeed follows a Weibull distribution whose scale has a seasonal and a diurnal component,
+    temperature and pressure are smooth noise around their seasonal and diurnal means.
+
+    The series is generated in blocks of BLOCK_TICKS ticks. Every block draws its noise from its own
+    generator seeded with (seed, site, block), so a tick has the same value no matter in which order
+    or how far ahead the ticks are requested. Same interface as ClimateData, there is nothing to load.
+    """
+
+    def __init__(self, sites, start, interval_minutes, seed, weibull_scale, weibull_shape):
+        self.lock = threading.Lock()
+        self.sites = sites
+        self.begin = int(epoch_seconds(start))
+        self.step = interval_minutes * 60
+        self.seed = seed
+        self.weibull_scale = weibull_scale # km/h, like the meteostat windspeed
+        self.weibull_shape = weibull_shape
+
+        self.wind_window = min(max(1, WIND_CORRELATION_HOURS * 60 // interval_minutes), BLOCK_TICKS)
+        self.pressure_window = min(max(1, PRESSURE_CORRELATION_HOURS * 60 // interval_minutes), BLOCK_TICKS)
+        self.chunks = 1
+        self.error = None # generating never fails, same interface as ClimateData
+        self.blocks = {} # (site, block) -> generated block
+
+    def noise(self, site, block):
+        """Standard normal noise of a block, one row for each noise source."""
+        # block -1 is the warm-up of the first block, seeds must not be negative
+        return np.random.default_rng([self.seed, site, block + 1]).standard_normal((4, BLOCK_TICKS))
+
+    def smooth(self, noise, previous, window):
+        """
+        Moving average over the last window samples, scaled back to unit variance.
+        The tail of the previous block continues the average across the block border.
+        """
+        samples = np.concatenate([previous[len(previous) - window + 1:], noise])
+        return np.convolve(samples, np.ones(window) / np.sqrt(window), mode="valid")
+
+    def generate_block(self, site, block):
+        """Generates density, temperature and windspeed of a block, shape BLOCK_TICKS x variable."""
+        noise = self.noise(site, block)
+        previous = self.noise(site, block - 1)
+
+        time = self.begin + (block * BLOCK_TICKS + np.arange(BLOCK_TICKS)) * float(self.step)
+        day = time / SECONDS_PER_DAY
+        hour = (time % SECONDS_PER_DAY) / 3600
+        season = np.cos(2 * np.pi * (day % DAYS_PER_YEAR - SEASON_PEAK_DAY) / DAYS_PER_YEAR)
+        diurnal = np.cos(2 * np.pi * (hour - DIURNAL_PEAK_HOUR) / HOURS_PER_DAY)
+
+        # The sum of two squared standard normal samples is exponential, which gives Weibull samples
+        # by the inverse transform, while the smoothing keeps the windspeed correlated over time
+        x1 = self.smooth(noise[0], previous[0], self.wind_window)
+        x2 = self.smooth(noise[1], previous[1], self.wind_window)
+        exponential = (x1**2 + x2**2) / 2
+        scale = self.weibull_scale * (1 + WIND_SEASONAL * season) * (1 + WIND_DIURNAL * diurnal)
+        windspeed = scale * exponential**(1 / self.weibull_shape)
+
+        temperature = (TEMPERATURE_MEAN - TEMPERATURE_SEASONAL * season + TEMPERATURE_DIURNAL * diurnal
+                       + TEMPERATURE_NOISE * self.smooth(noise[2], previous[2], self.wind_window))
+        pressure = PRESSURE_MEAN + PRESSURE_NOISE * self.smooth(noise[3], previous[3], self.pressure_window)
+        density = (pressure*HEKTO)/(RS*(temperature+CELSIUS_IN_KELVIN))
+
+        values = {"density": density, "temperature": temperature, "windspeed": windspeed}
+        return np.round(np.stack([values[variable] for variable in VARIABLES], axis=-1), 2)
+
+    def get_block(self, site, block):
+        with self.lock:
+            values = self.blocks.get((site, block))
+        if values is None:
+            values = self.generate_block(site, block)
+            with self.lock:
+                if len(self.blocks) >= CACHED_BLOCKS:
+                    self.blocks.clear()
+                self.blocks[(site, block)] = values
+        return values
+
+    def values(self, ticks):
+        """Values of the ticks (numbered from start), shape site x tick x variable."""
+        result = np.empty((self.sites, len(ticks), len(VARIABLES)))
+        for block in np.unique(ticks // BLOCK_TICKS).tolist():
+            mask = ticks // BLOCK_TICKS == block
+            for site in range(self.sites):
+                result[site, mask] = self.get_block(site, block)[ticks[mask] % BLOCK_TICKS]
+        return result
+
+    def generate(self, first_tick, count):
+        """Values of count ticks beginning with first_tick, shape site x tick x variable."""
+        return self.values(first_tick + np.arange(count))
+
+    def start_loading(self, on_chunk_loaded=None):
+        """Nothing to load, the blocks are generated on demand."""
+        if on_chunk_loaded is not None:
+            on_chunk_loaded(self)
+
+    def loaded_chunks(self):
+        return self.chunks
+
+    def ready(self):
+        return True
+
+    def lookup(self, timestamps):
+        """
+        Returns the values of the tick timestamp(s): site x variable for one timestamp,
+        site x tick x variable for a list.
+        """
+        ticks = np.atleast_1d((epoch_seconds(timestamps) - self.begin) // self.step)
+        result = self.values(ticks)
+        if np.ndim(timestamps) == 0:
+            return result[:, 0]
+        return result
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("meteostat")
+import dataset
+from dataset import COLUMNS, VARIABLES, ClimateData, cache_path, epoch_seconds, save, source_periods
+
+POINT = (53.55, 9.99, 6)
+START = datetime(2021, 11, 20)
+END = datetime(2022, 1, 10, 23, 59)
+
+def hourly(first, last):
+    time = np.arange(epoch_seconds(first), epoch_seconds(last) + 1, 3600)
+    hours = time / 3600 # the months join into one continuous series
+    return {
+        "time": time,
+        "density": np.round(1.2 + 0.05 * np.sin(hours / 24), 2),
+        "temperature": 5 + 8 * np.sin(hours / 12),
+        "windspeed": 15 + 10 * np.sin(hours / 7),
+    }
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Cache with the months of the test period, nothing is fetched."""
+    for first, last in source_periods(START, END):
+        save(cache_path(str(tmp_path), *POINT, first, last), hourly(first, last))
+
+    def fetch(*args):
+        raise AssertionError(f"climate data fetched instead of cached: {args}")
+    monkeypatch.setattr(dataset, "fetch", fetch)
+    return str(tmp_path)
+
+def loaded(cache, chunk_days, method="linear", interval_minutes=15):
+    climate = ClimateData(cache, [POINT, POINT], START, END, interval_minutes, method, chunk_days)
+    climate.load()
+    assert climate.error is None
+    return climate
+
+def timestamps(interval_minutes=15):
+    ticks = np.arange(epoch_seconds(START), epoch_seconds(END) + 1, interval_minutes * 60)
+    return ticks.astype("datetime64[s]").astype(str).tolist()
+
+def test_source_periods():
+    assert source_periods(datetime(2021, 12, 20, 5), datetime(2022, 1, 1)) == [
+        (datetime(2021, 12, 1), datetime(2021, 12, 31, 23)),
+        (datetime(2022, 1, 1), datetime(2022, 1, 31, 23)),
+    ]
+
+def test_cache_does_not_depend_on_chunks(cache):
+    # the fetch of the fixture fails, every chunk size is served from the same monthly cache
+    values = [loaded(cache, chunk_days).lookup(timestamps()) for chunk_days in [1, 7, 90]]
+    assert np.array_equal(values[0], values[1])
+    assert np.array_equal(values[0], values[2])
+    assert loaded(cache, 7, interval_minutes=60).lookup(timestamps(60)).shape == (2, len(timestamps(60)), 3)
+
+@pytest.mark.parametrize("method", ["linear", "spline"])
+def test_lookup_matches_whole_series(cache, method):
+    if method == "spline":
+        pytest.importorskip("scipy")
+    climate = loaded(cache, 7, method)
+    series = hourly(datetime(2021, 11, 1), datetime(2022, 1, 31, 23))
+    ticks = epoch_seconds(np.array(timestamps(), dtype="datetime64[s]")).astype(np.float64)
+    expected = dataset.resample(series, ticks, method)
+    values = climate.lookup(timestamps())
+    # the spline through the hours around the ticks matches the spline of the whole series up to the rounding
+    assert np.allclose(values[0], expected, atol=0.011 if method == "spline" else 0)
+    assert np.array_equal(values[0], values[1])
+
+def test_single_tick_and_window(cache):
+    climate = loaded(cache, 7)
+    window = climate.lookup(timestamps()[100:110])
+    assert window.shape == (2, 10, 3)
+    assert np.array_equal(climate.lookup(timestamps()[105]), window[:, 5])
+
+def test_lookup_waits_for_the_chunk(cache):
+    climate = ClimateData(cache, [POINT], START, END, 15, "linear", 7)
+    climate.load_chunk(0)
+    assert climate.lookup(timestamps()[0]) is not None
+    assert climate.lookup(timestamps()[-1]) is None
+
+def test_gap_keeps_the_last_value(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "fetch", lambda *args: {column: np.zeros(0) for column in COLUMNS})
+    first, last = source_periods(START, START)[0]
+    series = hourly(first, last)
+    save(cache_path(str(tmp_path), *POINT, first, last), series)
+    # December and January have no samples
+    climate = ClimateData(str(tmp_path), [POINT], START, END, 15, "linear", 7)
+    climate.load()
+    assert climate.error is None
+    values = climate.lookup(timestamps()[-1])
+    assert values[0].tolist() == [round(series[variable][-1], 2) for variable in VARIABLES]
+
+def test_no_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(dataset, "fetch", lambda *args: {column: np.zeros(0) for column in COLUMNS})
+    climate = ClimateData(str(tmp_path), [POINT], START, END, 15, "linear", 7)
+    climate.load()
+    assert isinstance(climate.error, ValueError)
+    assert climate.lookup(timestamps()[0]) is None
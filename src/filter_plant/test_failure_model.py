@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from failure_model import MINIMAL_FAILURE_POSIBILITY_CHANGE, FailureModel
+
+PLANTS = 20000
+
+def model(posibility, outage=10.0, plants=PLANTS, seed=42):
+    return FailureModel(np.full(plants, posibility), np.full(plants, outage), np.random.default_rng(seed))
+
+@pytest.mark.parametrize("posibility", [0.002, 0.01, 0.1])
+def test_failure_rate_matches_hazard(posibility):
+    # healthy plants fail in every tick with the posibility p, the time to the failure is geometric
+    failures = model(posibility, outage=1e9)
+    first = np.full(PLANTS, -1)
+    healthy_per_tick, failed_per_tick = [], []
+    for tick in range(int(3 / posibility)):
+        healthy_per_tick.append(np.count_nonzero(~failures.failed))
+        failed, _ = failures.step()
+        failed_per_tick.append(np.count_nonzero(failed))
+        first[failed] = tick
+    rate = sum(failed_per_tick) / sum(healthy_per_tick)
+    assert rate == pytest.approx(posibility, rel=0.03)
+    assert failed_per_tick[0] / PLANTS == pytest.approx(posibility, rel=0.2, abs=0.002)
+    ticks = first[first >= 0] + 1
+    # the share of the plants that failed within k ticks is 1 - (1 - p)^k
+    for k in [1 / posibility, 2 / posibility]:
+        assert np.count_nonzero(ticks <= k) / PLANTS == pytest.approx(1 - (1 - posibility) ** int(k), rel=0.03)
+
+def test_drift_changes_the_hazard():
+    failures = model(0.002, outage=1e9)
+    expected = observed = 0.0
+    for _ in range(400):
+        healthy = ~failures.failed
+        expected += failures.posibility[healthy].sum()
+        failed, _ = failures.step()
+        observed += np.count_nonzero(failed)
+        failures.drift(np.ones(PLANTS, dtype=bool))
+    assert observed == pytest.approx(expected, rel=0.03)
+    running = ~failures.failed
+    assert np.allclose(failures.posibility[running], 0.002 + 400 * MINIMAL_FAILURE_POSIBILITY_CHANGE)
+    # back down to the standart posibility without overproduction
+    for _ in range(500):
+        failures.step()
+        failures.drift(np.zeros(PLANTS, dtype=bool))
+    running = ~failures.failed
+    assert np.allclose(failures.posibility[running], 0.002)
+
+def test_outage_duration():
+    posibility = 0.01
+    failures = model(posibility, outage=10.0, plants=2000)
+    started = {}
+    durations = []
+    for tick in range(3000):
+        failed, recovered = failures.step()
+        for plant in np.flatnonzero(recovered):
+            durations.append(tick - started.pop(plant))
+        for plant in np.flatnonzero(failed):
+            started[plant] = tick
+            assert failures.failure_tick_count()[plant] == 0
+    durations = np.array(durations)
+    # out for the failure tick plus MINIMAL_OUTAGE_DURATION + 0 .. int(p * 1000) ticks, back in the next tick
+    assert durations.min() == 10 + 1
+    assert durations.max() == 10 + int(posibility * 1000) + 1
+    assert failures.failed[list(started)].all()
+
+def test_fast_forward_matches_steps():
+    posibility, ticks = 0.01, 5000
+    stepped = model(posibility, plants=4000, seed=1)
+    counted = np.zeros(4000, dtype=int)
+    for _ in range(ticks):
+        failed, _ = stepped.step()
+        counted += failed
+    forwarded = model(posibility, plants=4000, seed=2).fast_forward(ticks)
+    # a failure every 1/p ticks of operation plus the mean outage of 10 + 5 ticks and the tick of the recovery
+    expected = ticks / (1 / posibility + 15 + 1)
+    assert counted.mean() == pytest.approx(expected, rel=0.03)
+    assert forwarded.mean() == pytest.approx(expected, rel=0.03)
+
+def test_no_failures_without_posibility():
+    failures = model(0.0, plants=10)
+    for _ in range(100):
+        failed, _ = failures.step()
+        assert not failed.any()
+    assert failures.fast_forward(10000).sum() == 0
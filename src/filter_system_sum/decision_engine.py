@@ -0,0 +1,117 @@
+import csv
+import time
+import numpy as np
+
+KPIS = ["soproduction", "failure", "prod", "ploss"] # kpis the rules decide on
+COLUMNS = ["name", "mode", "multiplier"] + [f"{kpi}_{bound}" for kpi in KPIS for bound in ["above", "below"]]
+MODES = ["cap", "floor"] # cap: at most multiplier * namount, floor: at least multiplier * namount
+
+def load_rules(path):
+    """
+    Reads the rule table (csv with the header COLUMNS, one row per rule, the first matching rule applies).
+    A rule matches a plant if every kpi lies strictly between its _above and _below bound, empty bounds are open.
+    Returns a dict with one numpy array per column, the bounds as (rules x KPIS) arrays.
+    """
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    if not rows:
+        raise SystemExit(f"Decision rule table {path} is empty")
+    missing = [column for column in COLUMNS if column not in rows[0]]
+    if missing:
+        raise SystemExit(f"Decision rule table {path} misses the columns {missing}")
+    modes = [row["mode"].strip() for row in rows]
+    if any(mode not in MODES for mode in modes):
+        raise SystemExit(f"Decision rule table {path} has an unknown mode, use one of {MODES}")
+
+    def bound(row, column, default):
+        value = row[column].strip()
+        return float(value) if value else default
+
+    return {
+        "name": [row["name"].strip() for row in rows],
+        "cap": np.array([mode == "cap" for mode in modes]),
+        "multiplier": np.array([float(row["multiplier"]) for row in rows]),
+        "above": np.array([[bound(row, f"{kpi}_above", -np.inf) for kpi in KPIS] for row in rows]),
+        "below": np.array([[bound(row, f"{kpi}_below", np.inf) for kpi in KPIS] for row in rows])
+    }
+
+class DecisionEngine:
+    """
+    Plans the requests of the adaptive mode (MAPE loop) for the whole fleet at once.
+
+    Every plant gets the first rule of the table its kpis match. The rule turns the equal share of the demand
+    into a request of at most (cap) or at least (floor) multiplier * namount. The requests are then normalised
+    to the demand: a surplus is taken from all plants in proportion, a shortfall is spread over the floor plants.
+    Plants that match no rule get the equal share.
+    """
+
+    def __init__(self, path):
+        self.rules = load_rules(path)
+        # only the bounds a rule sets are checked, as (kpi, is lower bound, bound)
+        self.conditions = [[(kpi, lower, bound) for i, kpi in enumerate(KPIS)
+                            for lower, bound in [(True, above[i]), (False, below[i])] if np.isfinite(bound)]
+                           for above, below in zip(self.rules["above"], self.rules["below"])]
+
+    def classify(self, kpis):
+        """Index of the first matching rule per plant, -1 if no rule matches."""
+        rule = np.full(len(kpis["namount"]), -1)
+        # the rules are applied from the last to the first, so the first match wins
+        for index in range(len(self.conditions) - 1, -1, -1):
+            match = True
+            for kpi, lower, bound in self.conditions[index]:
+                match = match & (kpis[kpi] > bound if lower else kpis[kpi] < bound)
+            rule[match] = index
+        return rule
+
+    def plan(self, demand, kpis, active):
+        """
+        Requests of all plants for the demand of the tick. kpis holds one array per kpi (and namount),
+        active masks the plants that can produce, the others get 0.
+        """
+        requests = np.zeros(len(active))
+        count = int(np.count_nonzero(active))
+        if count == 0 or demand <= 0:
+            return requests
+        share = demand / count
+        rule = self.classify(kpis)
+        matched = rule >= 0
+        nominal = np.where(matched, np.asarray(kpis["namount"], dtype=np.float64) * self.rules["multiplier"][rule], share)
+        cap = matched & self.rules["cap"][rule]
+        requests = np.where(cap, np.minimum(share, nominal), np.maximum(share, nominal))
+        requests[~active] = 0
+        return np.round(self.normalise(requests, demand, active & ~cap), 4)
+
+    @staticmethod
+    def normalise(requests, demand, floor):
+        total = requests.sum()
+        if total <= 0:
+            return requests
+        if total > demand or not requests[floor].any():
+            return requests * (demand / total)
+        # the capped plants keep their requests, the floor plants take the rest of the demand
+        requests = requests.copy()
+        requests[floor] *= 1 + (demand - total) / requests[floor].sum()
+        return requests
+
+if __name__ == '__main__':
+    # Benchmark: planning the requests of 1000 plants
+    rng = np.random.default_rng(42)
+    plants = 1000
+    kpis = {
+        "soproduction": rng.integers(0, 12, plants),
+        "failure": rng.uniform(0, 0.12, plants),
+        "prod": rng.uniform(0.5, 1.5, plants),
+        "ploss": rng.uniform(0, 0.4, plants),
+        "namount": rng.uniform(5, 15, plants)
+    }
+    active = rng.random(plants) > 0.1
+    engine = DecisionEngine("decision_rules.csv")
+    demand = kpis["namount"].sum()
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        requests = engine.plan(demand, kpis, active)
+    elapsed = (time.perf_counter() - start) / runs
+    counts = np.bincount(engine.classify(kpis) + 1, minlength=len(engine.rules["name"]) + 1)
+    print(f"{elapsed*1e6:.1f} us per plan, {requests.sum():.2f} of {demand:.2f} requested")
+    print(dict(zip(["none"] + engine.rules["name"], counts.tolist())))
@@ -0,0 +1,59 @@
+import logging
+import numpy as np
+from collections import namedtuple
+
+KPI_CLASS = namedtuple("KPI", ["plant_id", "status", "eff", "prod", "cper", "soproduction", "failure", "ploss", "namount"]) # A data structure for kpis
+FIELDS = ["eff", "prod", "cper", "soproduction", "failure", "ploss", "namount"] # numeric kpis, one array each
+
+class KpiRegistry:
+    """
+    Last known KPI of every plant, keyed by plant id.
+
+    The KPIs live in preallocated arrays with one entry per plant, so a lookup is O(1) and the
+    planner can work on whole arrays. A KPI is kept until the plant sends the next one; its age
+    counts the ticks since it arrived and KPIs older than max_age ticks count as missing.
+    """
+
+    def __init__(self, plant_ids, max_age):
+        self.plant_ids = list(plant_ids)
+        self.index = {plant_id: i for i, plant_id in enumerate(self.plant_ids)}
+        self.max_age = max_age
+        size = len(self.plant_ids)
+        self.values = {field: np.zeros(size) for field in FIELDS}
+        self.status = ["offline"] * size
+        self.offline = np.ones(size, dtype=bool)
+        self.tick = 0
+        self.received = np.full(size, -np.inf) # tick in which the last KPI arrived
+
+    def next_tick(self):
+        self.tick += 1
+
+    def update(self, plant_id, status, **kpis):
+        i = self.index.get(plant_id)
+        if i is None:
+            logging.warning(f"Received KPI of unknown plant {plant_id}")
+            return
+        for field in FIELDS:
+            self.values[field][i] = kpis[field]
+        self.status[i] = status
+        self.offline[i] = status == "offline"
+        self.received[i] = self.tick
+
+    def age(self):
+        """Ticks since the last KPI of every plant (inf if none arrived yet)."""
+        return self.tick - self.received
+
+    def fresh(self):
+        """Mask of the plants with a KPI not older than max_age ticks."""
+        return self.age() <= self.max_age
+
+    def online(self):
+        """Mask of the plants with a fresh KPI that are not offline."""
+        return self.fresh() & ~self.offline
+
+    def get(self, plant_id):
+        """KPI of the plant, None if it is missing or too old."""
+        i = self.index[plant_id]
+        if self.tick - self.received[i] > self.max_age:
+            return None
+        return KPI_CLASS(plant_id, self.status[i], *(self.values[field][i].item() for field in FIELDS))
@@ -0,0 +1,112 @@
+from collections import deque
+
+def parse_windows(spec):
+    """
+    Parses a window specification like "day:96,week:672" (name:number of ticks).
+    """
+    windows = {}
+    for entry in spec.split(","):
+        name, size = entry.split(":")
+        windows[name.strip()] = int(size)
+    return windows
+
+class RollingWindow:
+    """
+    Statistics over the last size values, every update is O(1) (amortized for min/max).
+    A ring buffer holds the values, mean and variance are updated incrementally (Welford)
+    and monotonic deques keep the minimum and maximum of the window.
+    The sum and count of the positive values are kept as well, for means that skip empty ticks.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = [0.0] * size # ring buffer
+        self.index = 0 # number of values added so far
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the mean
+        self.positive_sum = 0.0
+        self.positive_count = 0
+        self.minimum = deque() # (index, value), increasing values
+        self.maximum = deque() # (index, value), decreasing values
+
+    def update(self, value):
+        if self.count == self.size:
+            self.remove(self.values[self.index % self.size])
+        self.values[self.index % self.size] = value
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value > 0:
+            self.positive_sum += value
+            self.positive_count += 1
+
+        while self.minimum and self.minimum[-1][1] >= value:
+            self.minimum.pop()
+        self.minimum.append((self.index, value))
+        while self.maximum and self.maximum[-1][1] <= value:
+            self.maximum.pop()
+        self.maximum.append((self.index, value))
+        # drop the values that left the window
+        oldest = self.index - self.size + 1
+        if self.minimum[0][0] < oldest:
+            self.minimum.popleft()
+        if self.maximum[0][0] < oldest:
+            self.maximum.popleft()
+        self.index += 1
+
+    def remove(self, value):
+        if value > 0:
+            self.positive_count -= 1
+            self.positive_sum = self.positive_sum - value if self.positive_count > 0 else 0.0
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (value - self.mean), 0.0)
+
+    def sum(self):
+        return self.mean * self.count
+
+    def positive_mean(self):
+        return self.positive_sum / self.positive_count if self.positive_count > 0 else 0.0
+
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else 0.0
+
+    def stats(self, digits=4):
+        if self.count == 0:
+            return {"mean": 0, "min": 0, "max": 0, "std": 0, "count": 0}
+        return {
+            "mean": round(self.mean, digits),
+            "min": round(self.minimum[0][1], digits),
+            "max": round(self.maximum[0][1], digits),
+            "std": round(self.variance() ** 0.5, digits),
+            "count": self.count,
+        }
+
+class RollingStats:
+    """
+    Several rolling windows (e.g. day and week) over the same series of tick values.
+    """
+
+    def __init__(self, windows):
+        self.windows = {name: RollingWindow(size) for name, size in windows.items()}
+
+    def update(self, value):
+        for window in self.windows.values():
+            window.update(value)
+
+    def mean(self, name, digits=4, positive=False):
+        """
+        Mean of the window name, with positive=True only over the ticks with a value > 0.
+        """
+        window = self.windows[name]
+        return round(window.positive_mean() if positive else window.mean, digits)
+
+    def stats(self, digits=4):
+        return {name: window.stats(digits) for name, window in self.windows.items()}
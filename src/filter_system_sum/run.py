@@ -1,10 +1,15 @@
 import sys
-import json
 import logging
 from random import seed, randint
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
+from rolling_stats import RollingStats, parse_windows
 import os
+import threading
 from collections import namedtuple
+from stage_deadline import StageDeadline
+from kpi_registry import KpiRegistry
+from decision_engine import DecisionEngine
 
 # Configure the logger
 logging.basicConfig(
@@ -19,6 +24,7 @@ def getenv_or_exit(env_name, default="default"):
     return value
 
 PLANTS_NUMBER = int(getenv_or_exit("NUMBER_OF_FILTER_PLANTS", 0))
+CONSUMERS_NUMBER = int(getenv_or_exit("NUMBER_OF_HYDROGEN_PLANTS", 0)) # hydrogen plants requesting filtered water
 
 TICK = getenv_or_exit('TOPIC_TICK_GEN_TICK', 'default')
 TOPIC_REQUEST = getenv_or_exit("TOPIC_FILTER_SUM_FILTERED_WATER_REQUEST", "default") # Topic to receive requests for filtered water from hydrogen plants
@@ -29,6 +35,14 @@ TOPIC_ADAPTIVE_MODE = getenv_or_exit('TOPIC_ADAPTIVE_MODE', 'default') # Topic t
 TOPIC_FILTER_SYSTEM_SUM_DATA = getenv_or_exit("TOPIC_FILTER_SUM_FILTER_SUM_DATA", "default") # Topic to send production data for the dashboard 
 
 TOPIC_HYDROGEN_DAILY_DEMAND = getenv_or_exit("TOPIC_HYDROGEN_DEMAND_GEN_HYDROGEN_DEMAND", 'default')
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+TOPIC_STAGE_METRICS = getenv_or_exit('TOPIC_STAGE_METRICS', 'default') # Topic for late and missing plants of a stage
+SERVICE_NAME = "filter_system"
+REQUEST_DEADLINE = float(getenv_or_exit("FILTER_SUM_REQUEST_DEADLINE", -1.0)) # Seconds after the tick to wait for the requests
+SUPPLY_DEADLINE = float(getenv_or_exit("FILTER_SUM_SUPPLY_DEADLINE", -1.0)) # Seconds after the tick to wait for the supplies
+KPI_MAX_AGE = int(getenv_or_exit("FILTER_SUM_KPI_MAX_AGE", -1)) # Ticks the last KPI of a plant is used for
+DECISION_RULES = getenv_or_exit("FILTER_SUM_DECISION_RULES", "default") # Rule table of the adaptive mode
 
 TOPIC_SUPPLY_LIST = []
 TOPIC_KPI_LIST = []
@@ -37,34 +51,75 @@ for i in range(PLANTS_NUMBER):
     TOPIC_FILTERED_WATER_REQEUST_LIST.append(TOPIC_FILTERED_WATER_REQEUST+str(i))
     TOPIC_SUPPLY_LIST.append(TOPIC_SUPPLY+str(i)) # list with all supply topics
     TOPIC_KPI_LIST.append(TOPIC_KPI+str(i)) # list with all kpi topics
+PLANT_IDS = [str(i) for i in range(PLANTS_NUMBER)]
+SUPPLY_TOPIC_IDS = dict(zip(TOPIC_SUPPLY_LIST, PLANT_IDS)) # plant id of each supply topic
+CONSUMER_IDS = [str(i) for i in range(CONSUMERS_NUMBER)] # ids of the hydrogen plants sending requests
 
 ADAPTABLE = False
 TIMESTAMP = 0
 TICK_COUNT = 0
 RECEIVED_REQUESTS = 0
 RECEIVED_SUPPLIES = 0
-RECEIVED_KPI = 0
 
 AVAILABLE_WATER = 0 # total volume of water that can be supplied each tick
 TOTAL_FILTERED_WATER_PRODUCED = 0 # The total amount of water already produced during current day
 
 REQUEST_LIST = [] # A list to hold all requests
 SUPPLY_LIST = [] # A list to hold all supplies
-KPI_LIST = [] # A list to hold all kpis
+KPI_REGISTRY = KpiRegistry(PLANT_IDS, KPI_MAX_AGE) # last known kpis of the plants
+DECISION_ENGINE = DecisionEngine(DECISION_RULES) # plans the requests of the adaptive mode
 
 REQUEST_CLASS = namedtuple("Request", ["plant_id", "reply_topic", "demand"]) # A data structure for requests
 SUPPLY_CLASS = namedtuple("Supply", ["supply"]) # A data structure for supplies
-KPI_CLASS = namedtuple("KPI", ["plant_id", "status", "eff", "prod", "cper", "soproduction", "failure", "ploss", "namount"]) # A data structure for kpis TODO: Erweitern um neue KPIs
 
 
 TICKS_IN_DAY = 96
+STATS_WINDOWS = parse_windows(getenv_or_exit("ROLLING_STATS_WINDOWS", "default")) # name:ticks, the first window gives the mean
+FILTERED_WATER_STATS = RollingStats(STATS_WINDOWS) # rolling statistics of the filtered water produced per tick
+MEAN_WINDOW = next(iter(STATS_WINDOWS))
+
+LOCK = threading.RLock() # callbacks and the stage deadlines run in different threads
 
 def send_msg(client, topic, timestamp, amount):
     data = {
         "timestamp": timestamp,  
         "amount": amount
     }
-    client.publish(topic, json.dumps(data))
+    client.publish(topic, encode(data))
+
+def send_ack_msg(client, timestamp):
+    """
+    Acknowledges the completion of the tick to the tick generator (lockstep mode only).
+    """
+    if LOCKSTEP:
+        client.publish(TOPIC_TICK_ACK, encode({"service": SERVICE_NAME, "timestamp": timestamp}))
+
+def send_stage_metric(client, stage):
+    """
+    Publishes the late and missing plants of the stage, if there are any.
+    """
+    data = stage.metric(SERVICE_NAME)
+    if data is not None:
+        client.publish(TOPIC_STAGE_METRICS, encode(data))
+
+def complete_requests(client):
+    """
+    Completes the request stage of the tick, either by the last request or by the deadline.
+    """
+    if REQUEST_STAGE.complete():
+        send_stage_metric(client, REQUEST_STAGE)
+        calculate_and_publish_filtered_water_requests(client)
+
+def complete_supplies(client):
+    """
+    Completes the supply stage of the tick, either by the last supply or by the deadline.
+    """
+    if SUPPLY_STAGE.complete():
+        send_stage_metric(client, SUPPLY_STAGE)
+        calculate_and_publish_filtered_water_replies(client)
+
+REQUEST_STAGE = StageDeadline("filtered_water_requests", REQUEST_DEADLINE, CONSUMER_IDS, complete_requests, LOCK)
+SUPPLY_STAGE = StageDeadline("filtered_water_supplies", SUPPLY_DEADLINE, PLANT_IDS, complete_supplies, LOCK)
 
 def default_supply_function(total_demand):
     """
@@ -96,6 +151,7 @@ def calculate_and_publish_filtered_water_replies(client, supply_function=default
 
     if not REQUEST_LIST:
         print("No requests to process.")
+        send_ack_msg(client, TIMESTAMP)
         return
     #logging.debug(f"Request list at replies distribution: {REQUEST_LIST}")
 
@@ -121,6 +177,8 @@ def calculate_and_publish_filtered_water_replies(client, supply_function=default
     REQUEST_LIST.clear()
     RECEIVED_REQUESTS = 0
 
+    send_ack_msg(client, TIMESTAMP)
+
 def calculate_supply(client):
     global AVAILABLE_WATER, SUPPLY_LIST, RECEIVED_SUPPLIES, TOTAL_FILTERED_WATER_PRODUCED
 
@@ -131,73 +189,20 @@ def calculate_supply(client):
 
     # Publish the data for the dashboard
     # Maybe delete later
-    global TIMESTAMP, TOPIC_FILTER_SYSTEM_SUM_DATA, TICK_COUNT, TICKS_IN_DAY
-    tick = TICK_COUNT % TICKS_IN_DAY
-    if tick == 0: tick = TICKS_IN_DAY
-    data = {"fwater": TOTAL_FILTERED_WATER_PRODUCED, "mean_fwater": round(TOTAL_FILTERED_WATER_PRODUCED/tick,4), "timestamp": TIMESTAMP}
-    client.publish(TOPIC_FILTER_SYSTEM_SUM_DATA, json.dumps(data))
+    global TIMESTAMP, TOPIC_FILTER_SYSTEM_SUM_DATA, FILTERED_WATER_STATS
+    FILTERED_WATER_STATS.update(AVAILABLE_WATER)
+    data = {"fwater": TOTAL_FILTERED_WATER_PRODUCED, "mean_fwater": FILTERED_WATER_STATS.mean(MEAN_WINDOW), "stats": FILTERED_WATER_STATS.stats(), "timestamp": TIMESTAMP}
+    client.publish(TOPIC_FILTER_SYSTEM_SUM_DATA, encode(data))
 
 
     SUPPLY_LIST.clear()
     RECEIVED_SUPPLIES = 0
 
-def decision_kpi(corresponding_kpi, plants_left, demand_need):
-
-    if(corresponding_kpi.soproduction > 8 or (corresponding_kpi.failure > 0.05 and corresponding_kpi.prod > 1.0)):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 0.8)):
-            request_amount = corresponding_kpi.namount * 0.8
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-                
-    elif(corresponding_kpi.soproduction < 2 and corresponding_kpi.ploss < 0.3 and corresponding_kpi.failure < 0.02):         #bei zu hoher production loss lohnt sich keine starke Überlast
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.5)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.5
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-
-    elif(corresponding_kpi.soproduction < 4 and corresponding_kpi.ploss < 0.1 and corresponding_kpi.failure < 0.1):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.3)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.3
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    elif(corresponding_kpi.soproduction < 6):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.1)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.1
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    else:
-        if(round(demand_need/plants_left, 4) > corresponding_kpi.namount ):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    return request_amount, plants_left, demand_need
-
 def calculate_and_publish_filtered_water_requests(client):
     """
         This defenitely needs refactoring
     """
     global TIMESTAMP, REQUEST_LIST, ADAPTABLE, PLANTS_NUMBER, TOPIC_FILTERED_WATER_REQEUST_LIST, RECEIVED_REQUESTS
-    global KPI_LIST, RECEIVED_KPI
 
     if not REQUEST_LIST:
         logging.warning("No requests to process.")
@@ -206,7 +211,7 @@ def calculate_and_publish_filtered_water_requests(client):
     total_demand = sum(request.demand for request in REQUEST_LIST)
 
     # Handling for the initial loop where no kpi is present
-    if not KPI_LIST:
+    if not KPI_REGISTRY.fresh().any():
         logging.debug("Warning. No kpi list. Using default mean allocation")
         for request_topic in TOPIC_FILTERED_WATER_REQEUST_LIST:
             request_amount = round(total_demand/PLANTS_NUMBER, 4)
@@ -221,27 +226,22 @@ def calculate_and_publish_filtered_water_requests(client):
             logging.debug(f"Sending request filtered water message to filter plant: timestamp: {TIMESTAMP}, topic: {request_topic}, request_amount: {request_amount}")
 
         RECEIVED_REQUESTS = 0
-        RECEIVED_KPI = 0
         return
 
     if ADAPTABLE:
-        # Place for everything that MAPE loop has to do before the iterating trough and publishing requests to filter plants
-        n = 0
-        total_demand = sum(request.demand for request in REQUEST_LIST)
-        plants_left = PLANTS_NUMBER
-        demand_need = total_demand
+        # MAPE loop: the decision rules plan the requests of all plants at once
+        requests = DECISION_ENGINE.plan(total_demand, KPI_REGISTRY.values, KPI_REGISTRY.online())
     else:
-        online_count = sum(1 for kpi in KPI_LIST if kpi.status != "offline")
+        online_count = int(KPI_REGISTRY.online().sum())
 
-    for request_topic in TOPIC_FILTERED_WATER_REQEUST_LIST:
+    for i, (request_plant_id, request_topic) in enumerate(zip(PLANT_IDS, TOPIC_FILTERED_WATER_REQEUST_LIST)):
         # extract corresponding kpi
-        request_plant_id = request_topic.split('/')[-1]
-        corresponding_kpi = next((kpi for kpi in KPI_LIST if kpi.plant_id == request_plant_id), None)
+        corresponding_kpi = KPI_REGISTRY.get(request_plant_id)
         logging.debug(f"Plant id: {request_plant_id}")
 
         if not corresponding_kpi:
             # No kpi corresponding for plant id in the request 
-            logging.debug(f"Filter plant with id {request_plant_id} and request topic: {request_topic} has no corresponding KPI.")
+            logging.debug(f"Filter plant with id {request_plant_id} and request topic: {request_topic} has no recent KPI.")
             request_amount = 0
         elif corresponding_kpi.status == "offline" :
             # Offline plants receive 0 allocation
@@ -250,8 +250,7 @@ def calculate_and_publish_filtered_water_requests(client):
         else:
             # Calculate allocation for active plants
             if ADAPTABLE:
-                request_amount, plants_left, demand_need = decision_kpi(corresponding_kpi=corresponding_kpi, plants_left=plants_left, demand_need=demand_need)
-
+                request_amount = float(requests[i])
             else:
                 request_amount = round(total_demand/online_count, 4)
             
@@ -265,8 +264,6 @@ def calculate_and_publish_filtered_water_requests(client):
         logging.debug(f"Sending filtered water request message to filter plant with id {request_plant_id}: timestamp: {TIMESTAMP}, msg topic: {request_topic}, requested amount: {request_amount}")
 
     RECEIVED_REQUESTS = 0
-    RECEIVED_KPI = 0
-    KPI_LIST.clear()
 
 def add_request(plant_id, reply_topic, demand):
     global RECEIVED_REQUESTS, REQUEST_LIST, REQUEST_CLASS
@@ -281,52 +278,64 @@ def add_supply(supply):
     RECEIVED_SUPPLIES += 1
 
 def add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount):
-    global RECEIVED_KPI, KPI_LIST, KPI_CLASS
-
-    KPI_LIST.append(KPI_CLASS(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount))
-    RECEIVED_KPI += 1
+    KPI_REGISTRY.update(plant_id, status, eff=eff, prod=prod, cper=cper, soproduction=soproduction, failure=failure, ploss=ploss, namount=namount)
 
 def on_message_tick(client, userdata, msg):
-    global TIMESTAMP, RECEIVED_REQUESTS, RECEIVED_SUPPLIES, RECEIVED_KPI, AVAILABLE_WATER, TICK_COUNT
+    global TIMESTAMP, RECEIVED_REQUESTS, RECEIVED_SUPPLIES, AVAILABLE_WATER, TICK_COUNT
      
-    TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp
-    RECEIVED_REQUESTS = 0 # update request number
-    RECEIVED_SUPPLIES = 0
-    RECEIVED_KPI = 0
-    AVAILABLE_WATER = 0 # reset the available water amount
-    TICK_COUNT += 1
+    with LOCK:
+        TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp
+        RECEIVED_REQUESTS = 0 # update request number
+        RECEIVED_SUPPLIES = 0
+        KPI_REGISTRY.next_tick() # the kpis get one tick older
+        AVAILABLE_WATER = 0 # reset the available water amount
+        TICK_COUNT += 1
+        # drop what is left over from a tick that was never completed
+        REQUEST_LIST.clear()
+        SUPPLY_LIST.clear()
+        REQUEST_STAGE.start(TIMESTAMP, client)
+        SUPPLY_STAGE.start(TIMESTAMP, client)
     logging.debug(f"Received tick message, timestamp: {TIMESTAMP}")
 
-def on_message_request(client, userdata, msg):
+def on_message_request(client, userdata, msg, payload):
     """
     Callback function that processes messages from the request topic.
     """
     
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     plant_id = payload["plant_id"]
     reply_topic = payload["reply_topic"] # topic to publish the supplied water to
     demand = payload["amount"]
     logging.debug(f"Received message with request: timestamp: {timestamp}, topic: {msg.topic}, plant_id: {plant_id}, reply_topic: {reply_topic}, demand: {demand}")
 
-    add_request(plant_id, reply_topic, demand)
+    with LOCK:
+        if not REQUEST_STAGE.report(timestamp, plant_id):
+            return
+        add_request(plant_id, reply_topic, demand)
+        # the last expected request triggers the requests to the filter plants, otherwise the deadline does
+        if RECEIVED_REQUESTS >= CONSUMERS_NUMBER:
+            complete_requests(client)
 
-def on_message_supply(client, userdata, msg):
+def on_message_supply(client, userdata, msg, payload):
     """
     Callback function that processes messages from the request topic.
     """
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     supply = payload["amount"]
     logging.debug(f"Received message with filtered water supply. timestamp: {timestamp}, msg topic: {msg.topic}, supply: {supply}")
 
-    add_supply(supply)
+    with LOCK:
+        if not SUPPLY_STAGE.report(timestamp, SUPPLY_TOPIC_IDS.get(msg.topic)):
+            return
+        add_supply(supply)
+        # the last expected supply triggers the replies to the hydrogen plants, otherwise the deadline does
+        if RECEIVED_SUPPLIES >= PLANTS_NUMBER:
+            complete_supplies(client)
 
-def on_message_kpi(client, userdata, msg):
+def on_message_kpi(client, userdata, msg, payload):
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     plant_id = payload["plant_id"]
     status = payload["status"]
@@ -339,23 +348,22 @@ def on_message_kpi(client, userdata, msg):
     namount = payload["namount"]
     logging.debug(f"Received message with KPI: timestamp. {timestamp}, msg topic: {msg.topic}, plant_id: {plant_id}, status: {status}, eff: {eff}, prod: {prod}, cper: {cper}, soproduction: {soproduction}, failure: {failure}, ploss: {ploss}, namount: {namount}")
     
-    add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount)
+    with LOCK:
+        add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount)
     
-def on_message_daily_need(client, userdata, msg):
+def on_message_daily_need(client, userdata, msg, payload):
     global TOTAL_FILTERED_WATER_PRODUCED, TICK_COUNT
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
-    TOTAL_FILTERED_WATER_PRODUCED = 0
-    TICK_COUNT = 1
+    with LOCK:
+        TOTAL_FILTERED_WATER_PRODUCED = 0
+        TICK_COUNT = 1
     logging.debug(f"Received message with daily request, counters reset. timestamp: {timestamp}")
 
 def on_message_adaptive_mode(client, userdata, msg):
     global ADAPTABLE
     boolean = msg.payload.decode("utf-8")
-    if boolean == "true" or boolean == "1" or boolean == "I love Python" or boolean == "True":
-        ADAPTABLE = True
-    else:
-        ADAPTABLE = False
+    with LOCK:
+        ADAPTABLE = boolean == "true" or boolean == "1" or boolean == "I love Python" or boolean == "True"
     logging.info(f"Received message with to change mode, adaptable mode is {ADAPTABLE}")
 
 def main():
@@ -369,31 +377,25 @@ def main():
 
     for topic in TOPIC_SUPPLY_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_supply)
+        mqtt.subscribe_with_callback(topic, on_message_supply, decode=True)
 
     for topic in TOPIC_KPI_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_kpi)
+        mqtt.subscribe_with_callback(topic, on_message_kpi, decode=True)
 
     mqtt.subscribe(TICK)
     mqtt.subscribe(TOPIC_REQUEST)
     mqtt.subscribe(TOPIC_ADAPTIVE_MODE)
     mqtt.subscribe(TOPIC_HYDROGEN_DAILY_DEMAND)
     mqtt.subscribe_with_callback(TICK, on_message_tick)
-    mqtt.subscribe_with_callback(TOPIC_REQUEST, on_message_request)
+    mqtt.subscribe_with_callback(TOPIC_REQUEST, on_message_request, decode=True)
     mqtt.subscribe_with_callback(TOPIC_ADAPTIVE_MODE, on_message_adaptive_mode)
-    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_DAILY_DEMAND, on_message_daily_need)
+    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_DAILY_DEMAND, on_message_daily_need, decode=True)
 
     try:
-        # Start the MQTT loop to process incoming and outgoing messages
-        while True:
-            if RECEIVED_REQUESTS >= PLANTS_NUMBER:
-                calculate_and_publish_filtered_water_requests(mqtt)
-
-            if RECEIVED_SUPPLIES >= PLANTS_NUMBER:
-                calculate_and_publish_filtered_water_replies(mqtt)
-            
-            mqtt.loop(0.05) # loop every 50ms
+        # Start the MQTT loop to process incoming and outgoing messages,
+        # requests and replies are sent from the callbacks that receive the last expected message
+        mqtt.loop_forever()
     except (KeyboardInterrupt, SystemExit):
         # Gracefully stop the MQTT client and exit the program on interrupt
         mqtt.stop()
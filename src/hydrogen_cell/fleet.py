@@ -0,0 +1,352 @@
+import sys
+import os
+import logging
+import threading
+import numpy as np
+from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
+from failure_model import FailureModel
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,  # Set minimum level to log (one plant per message would be too much on DEBUG)
+    format="%(asctime)s - %(levelname)s - %(message)s",  # Customize the output format
+)
+
+def getenv_or_exit(env_name, default="default"):
+    value = os.getenv(env_name, default)
+    if value == default:
+        raise SystemExit(f"Environment variable {env_name} not set")
+    return value
+
+# Fleet mode: the plants ID .. ID+FLEET_SIZE-1 in one process (python fleet.py instead of python run.py)
+FIRST_ID = int(getenv_or_exit("ID", "default"))
+FLEET_SIZE = int(getenv_or_exit("FLEET_SIZE", "default"))
+IDS = [str(i) for i in range(FIRST_ID, FIRST_ID + FLEET_SIZE)]
+INDEX = {plant_id: i for i, plant_id in enumerate(IDS)}
+
+def plant_parameter(name):
+    """
+    Parameter of every plant of the fleet: HYDROGEN_CELL_<ID>_<name>,
+    or HYDROGEN_CELL_DEFAULT_<name> for the plants without an own configuration.
+    """
+    values = []
+    for plant_id in IDS:
+        value = os.getenv("HYDROGEN_CELL_" + plant_id + "_" + name)
+        if value is None:
+            value = getenv_or_exit("HYDROGEN_CELL_DEFAULT_" + name, "default")
+        values.append(float(value))
+    return np.array(values)
+
+NOMINAL_FILTERED_WATER_DEMAND = plant_parameter("NOMINAL_FILTERED_WATER_DEMAND") # Filtered water demand at 100% Perfomance (in m^3)
+NOMINAL_POWER_DEMAND = plant_parameter("NOMINAL_POWER_DEMAND") # Power demand at 100% Perfomance (in kW)
+NOMINAL_HYDROGEN_SUPPLY = plant_parameter("NOMINAL_HYDROGEN_SUPPLY") # Hydrogen supply at 100% Perfomance (in kg)
+MINIMAL_HYDROGEN_SUPPLY = plant_parameter("MINIMAL_HYDROGEN_SUPPLY") # Hydrogen supply at minimal Perfomance (in kg)
+MAXIMAL_HYDROGEN_SUPPLY = plant_parameter("MAXIMAL_HYDROGEN_SUPPLY") # Hydrogen supply at maximal Perfomance (in kg)
+PRODUCTION_LOSSES = plant_parameter("PRODUCTION_LOSSES") # Percent of ressources lost during proccesing
+STANDART_FAILURE_POSIBILITY = plant_parameter("FAILURE_POSIBILITY") # Posibility of the outage
+MINIMAL_OUTAGE_DURATION = plant_parameter("MINIMAL_OUTAGE_DURATION") # Minimal outage duration
+
+TICK = getenv_or_exit("TOPIC_TICK_GEN_TICK", "default")
+TOPIC_FILTERED_WATER_REQUEST = getenv_or_exit("TOPIC_FILTER_SUM_FILTERED_WATER_REQUEST", "default") # topic to request filtered water
+TOPIC_FILTERED_WATER_RECEIVE = getenv_or_exit("TOPIC_HYDROGEN_CELL_FILTERED_WATER_RECEIVE", "default") # must be followed by hydrogen plant id
+TOPIC_POWER_REQUEST = getenv_or_exit("TOPIC_POWER_HYDROGEN_POWER_DATA", "default") # topic to request power (explicit for hydrogen, must be followed by hydrogen plant id)
+TOPIC_POWER_RECEIVE = getenv_or_exit("TOPIC_HYDROGEN_CELL_POWER_RECEIVE", "default") # must be followed by hydrogen plant id
+TOPIC_HYDROGEN_SUPPLY = getenv_or_exit("TOPIC_HYDROGEN_CELL_HYDROGEN_SUPPLY", "default") # must be followed by hydrogen plant id
+TOPIC_KPI = getenv_or_exit("TOPIC_HYDROGEN_CELL_KPI", "default") # Topic to post kpis (must be followed by hydrogen plant id)
+TOPIC_HYDROGEN_REQUEST = getenv_or_exit("TOPIC_HYDROGEN_CELL_HYDROGEN_REQUEST", "default") # topic to receive requests from hydrogen pipe (must be followed by hydrogen plant id)
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+STAGE_TIMEOUT = float(getenv_or_exit("HYDROGEN_CELL_FLEET_STAGE_TIMEOUT", -1.0)) # seconds a stage waits for the rest of the fleet after its first message
+
+NOMINAL_PERFORMANCE = NOMINAL_POWER_DEMAND / NOMINAL_HYDROGEN_SUPPLY # Performance: kW production per kg (in kW/kg)
+
+# State of all plants, one entry per plant
+PLANED_POWER_DEMAND = NOMINAL_POWER_DEMAND.copy()
+PLANED_FILTERED_WATER_DEMAND = NOMINAL_FILTERED_WATER_DEMAND.copy()
+PLANED_HYDROGEN_SUPPLY = NOMINAL_HYDROGEN_SUPPLY.copy()
+
+POWER_SUPPLIED = np.zeros(FLEET_SIZE)
+FILTERED_WATER_SUPPLIED = np.zeros(FLEET_SIZE)
+HYDROGEN_PRODUCED = np.zeros(FLEET_SIZE)
+TIMESTAMP = 0
+
+STATUS_NAMES = np.array(["online", "power not received", "ressource not received", "offline"])
+STATUS = np.zeros(FLEET_SIZE, dtype=int) # index into STATUS_NAMES
+EFFICIENCY = np.zeros(FLEET_SIZE)
+PRODUCTION = np.zeros(FLEET_SIZE)
+CURRENT_PERFORMANCE = np.zeros(FLEET_SIZE)
+
+# failure and outage schedule of the plants, see failure_model.py
+FAILURE_MODEL = FailureModel(STANDART_FAILURE_POSIBILITY, MINIMAL_OUTAGE_DURATION)
+FAILURE_TICK_COUNT = np.zeros(FLEET_SIZE, dtype=int)
+FAILURE_TIMEOUT = FAILURE_MODEL.timeout
+STATUS_POWER_NOT_RECEIVED = np.ones(FLEET_SIZE, dtype=bool)
+STATUS_FILTERED_WATER_NOT_RECEIVED = np.ones(FLEET_SIZE, dtype=bool)
+STATUS_FAILURE = FAILURE_MODEL.failed
+CURRENT_FAILURE_POSIBILITY = FAILURE_MODEL.posibility
+OVERPRODUCTION_MODE = np.zeros(FLEET_SIZE, dtype=bool)
+
+# The messages of a stage are collected until every plant of the fleet received its one, then the stage runs once
+# for all of them. A stage that is still incomplete STAGE_TIMEOUT seconds after its first message runs with the
+# plants it has, so one missing reply does not hold back the fleet; the plants arriving later run in a next batch.
+STAGES = ["hydrogen_request", "power", "filtered_water"]
+RECEIVED = {stage: np.zeros(FLEET_SIZE, dtype=bool) for stage in STAGES} # plants waiting for the next run of the stage
+DONE = {stage: np.zeros(FLEET_SIZE, dtype=bool) for stage in STAGES} # plants the stage already ran for in this tick
+STAGE_TIMERS = {stage: None for stage in STAGES}
+LOCK = threading.RLock() # callbacks and the stage timers run in different threads
+
+def send_request_msg(client, request_topic, timestamp, plant_id, reply_topic, amount):
+    data = {
+        "timestamp": timestamp,
+        "plant_id": plant_id,
+        "reply_topic": reply_topic,
+        "amount": amount
+    }
+    client.publish(request_topic, encode(data))
+
+def send_supply_msg(client, supply_topic, timestamp, amount):
+    data = {
+        "timestamp": timestamp,
+        "amount": amount
+    }
+    client.publish(supply_topic, encode(data))
+
+def send_kpi_msg(client, kpi_topic, timestamp, plant_id, status, eff, prod, cper, npower, namount, soproduction, failure, ploss):
+    data_KPI = {
+        "timestamp": timestamp,
+        "plant_id": plant_id,
+        "status": status,
+        "eff": eff,
+        "prod": prod,
+        "cper": cper,
+        "npower": npower,
+        "namount": namount,
+        "soproduction": soproduction,
+        "failure": failure,
+        "ploss": ploss
+    }
+    client.publish(kpi_topic, encode(data_KPI))
+
+def send_ack_msg(client, timestamp, plant_id):
+    """
+    Acknowledges the completion of the tick to the tick generator (lockstep mode only), once per plant.
+    """
+    if LOCKSTEP:
+        client.publish(TOPIC_TICK_ACK, encode({"service": "hydrogen_cell_" + plant_id, "timestamp": timestamp}))
+
+def divide(numerator, denominator):
+    """numerator / denominator, 0 where the denominator is 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator != 0, numerator / denominator, 0.0)
+
+def round4(values):
+    """
+    Rounds to 4 digits like round() in the single plant. np.round scales by 10**4 first and can round
+    values next to a tie the other way, these few values are rounded with round().
+    """
+    rounded = np.round(values, 4)
+    scaled = values * 1e4
+    tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if tie.any():
+        rounded[tie] = [round(value, 4) for value in values[tie].tolist()]
+    return rounded
+
+def ratio(numerator, denominator):
+    """numerator / denominator rounded like the single plant does, 0 where the denominator is 0."""
+    return round4(divide(numerator, denominator))
+
+def filtered_water_demand_on_supplied_power(mask):
+    filtered_water_demand = np.where(
+        POWER_SUPPLIED >= PLANED_POWER_DEMAND, PLANED_FILTERED_WATER_DEMAND,
+        np.where(PLANED_POWER_DEMAND <= 0, 0.0, round4(divide(POWER_SUPPLIED, PLANED_POWER_DEMAND) * PLANED_FILTERED_WATER_DEMAND)))
+
+    # Power outage status
+    STATUS_POWER_NOT_RECEIVED[mask & ((POWER_SUPPLIED != 0) | (PLANED_POWER_DEMAND == 0))] = False
+    return filtered_water_demand
+
+def produce_on_supplied_filtered_water(mask):
+    hydrogen = np.where(
+        FILTERED_WATER_SUPPLIED < PLANED_FILTERED_WATER_DEMAND,
+        round4(FILTERED_WATER_SUPPLIED * (NOMINAL_HYDROGEN_SUPPLY / NOMINAL_FILTERED_WATER_DEMAND) / PRODUCTION_LOSSES),
+        PLANED_HYDROGEN_SUPPLY)
+
+    # Filtered water outage status
+    STATUS_FILTERED_WATER_NOT_RECEIVED[mask & ((FILTERED_WATER_SUPPLIED != 0) | (PLANED_HYDROGEN_SUPPLY == 0))] = False
+    return hydrogen
+
+def calculate_kpis(mask):
+    EFFICIENCY[mask] = ratio(HYDROGEN_PRODUCED, POWER_SUPPLIED)[mask]
+    PRODUCTION[mask] = ratio(HYDROGEN_PRODUCED, FILTERED_WATER_SUPPLIED)[mask]
+    CURRENT_PERFORMANCE[mask] = round4(HYDROGEN_PRODUCED / NOMINAL_HYDROGEN_SUPPLY)[mask]
+    OVERPRODUCTION_MODE[mask] = CURRENT_PERFORMANCE[mask] > 1.0
+
+    # Decide status (The order matters!)
+    status = np.select([STATUS_FAILURE, STATUS_POWER_NOT_RECEIVED, STATUS_FILTERED_WATER_NOT_RECEIVED], [3, 1, 2], 0)
+    STATUS[mask] = status[mask]
+
+def calculate_demands(mask):
+    below = mask & (PLANED_HYDROGEN_SUPPLY < MINIMAL_HYDROGEN_SUPPLY)
+    above = mask & (PLANED_HYDROGEN_SUPPLY > MAXIMAL_HYDROGEN_SUPPLY)
+    PLANED_HYDROGEN_SUPPLY[above] = MAXIMAL_HYDROGEN_SUPPLY[above]
+    PLANED_FILTERED_WATER_DEMAND[mask] = round4(PLANED_HYDROGEN_SUPPLY / (NOMINAL_HYDROGEN_SUPPLY / NOMINAL_FILTERED_WATER_DEMAND) * PRODUCTION_LOSSES)[mask]
+    PLANED_POWER_DEMAND[mask] = round4(NOMINAL_PERFORMANCE * PLANED_HYDROGEN_SUPPLY)[mask]
+    PLANED_FILTERED_WATER_DEMAND[below] = 0
+    PLANED_POWER_DEMAND[below] = 0
+    PLANED_HYDROGEN_SUPPLY[below] = 0
+
+def calculate_outage_risk(mask):
+    # the failure posibility rises in overproduction mode and falls back afterwards
+    FAILURE_MODEL.drift(OVERPRODUCTION_MODE, mask)
+
+def failure_check():
+    # the failures are scheduled in advance, no random draw per tick
+    failed, recovered = FAILURE_MODEL.step()
+    FAILURE_TICK_COUNT[:] = FAILURE_MODEL.failure_tick_count()
+
+    if recovered.any():
+        logging.info(f"{TIMESTAMP} Hydrogen plants back online: {[IDS[i] for i in np.flatnonzero(recovered)]}")
+    for i in np.flatnonzero(failed):
+        logging.info(f"{TIMESTAMP} Hydrogen plant {IDS[i]} experienced Failure and will be out for {FAILURE_TIMEOUT[i]} ticks")
+
+def run_hydrogen_request_stage(client, mask):
+    calculate_demands(mask)
+    power = PLANED_POWER_DEMAND.tolist()
+    for i in np.flatnonzero(mask):
+        plant_id = IDS[i]
+        send_request_msg(client, TOPIC_POWER_REQUEST + plant_id, TIMESTAMP, plant_id, TOPIC_POWER_RECEIVE + plant_id, power[i])
+
+def run_power_stage(client, mask):
+    filtered_water_demand = filtered_water_demand_on_supplied_power(mask).tolist()
+    for i in np.flatnonzero(mask):
+        plant_id = IDS[i]
+        send_request_msg(client, TOPIC_FILTERED_WATER_REQUEST, TIMESTAMP, plant_id, TOPIC_FILTERED_WATER_RECEIVE + plant_id, filtered_water_demand[i])
+
+def run_filtered_water_stage(client, mask):
+    HYDROGEN_PRODUCED[mask] = produce_on_supplied_filtered_water(mask)[mask]
+    calculate_kpis(mask)
+
+    produced = HYDROGEN_PRODUCED.tolist()
+    status = STATUS_NAMES[STATUS].tolist()
+    efficiency, production, performance = EFFICIENCY.tolist(), PRODUCTION.tolist(), CURRENT_PERFORMANCE.tolist()
+    npower, namount, ploss = NOMINAL_POWER_DEMAND.tolist(), NOMINAL_HYDROGEN_SUPPLY.tolist(), PRODUCTION_LOSSES.tolist()
+    soproduction, failure = FAILURE_TICK_COUNT.tolist(), CURRENT_FAILURE_POSIBILITY.tolist()
+    for i in np.flatnonzero(mask):
+        plant_id = IDS[i]
+        send_supply_msg(client, TOPIC_HYDROGEN_SUPPLY + plant_id, TIMESTAMP, produced[i])
+        send_kpi_msg(client, TOPIC_KPI + plant_id, TIMESTAMP, plant_id, status[i], efficiency[i], production[i], performance[i],
+                     npower[i], namount[i], soproduction[i], failure[i], ploss[i])
+
+    # Calculate outage risk for the next tick
+    calculate_outage_risk(mask)
+
+    for i in np.flatnonzero(mask):
+        send_ack_msg(client, TIMESTAMP, IDS[i])
+
+STAGE_FUNCTIONS = {"hydrogen_request": run_hydrogen_request_stage, "power": run_power_stage, "filtered_water": run_filtered_water_stage}
+
+def run_stage(client, stage):
+    cancel_stage_timer(stage)
+    mask = RECEIVED[stage]
+    if mask.any():
+        STAGE_FUNCTIONS[stage](client, mask)
+        logging.debug(f"Stage {stage} done for {int(mask.sum())} plants, timestamp: {TIMESTAMP}")
+    DONE[stage] |= mask
+    RECEIVED[stage] = np.zeros(FLEET_SIZE, dtype=bool)
+
+def cancel_stage_timer(stage):
+    if STAGE_TIMERS[stage] is not None:
+        STAGE_TIMERS[stage].cancel()
+        STAGE_TIMERS[stage] = None
+
+def expire_stage(client, stage, timestamp):
+    """
+    Runs the stage with the plants it has once its timeout passed.
+    """
+    with LOCK:
+        if timestamp != TIMESTAMP or not RECEIVED[stage].any():
+            return
+        logging.warning(f"Stage {stage} of tick {TIMESTAMP} ran with {int(RECEIVED[stage].sum())} of {int((~DONE[stage]).sum())} waiting plants after {STAGE_TIMEOUT}s")
+        run_stage(client, stage)
+
+def receive(client, stage, topic, array, value):
+    """
+    Stores the value of the plant the topic belongs to, the stage runs once every plant received its message
+    or the timeout of the stage passed.
+    """
+    i = INDEX.get(topic.split("/")[-1])
+    if i is None:
+        return # plant of another fleet
+    with LOCK:
+        array[i] = value
+        RECEIVED[stage][i] = True
+        if (RECEIVED[stage] | DONE[stage]).all():
+            run_stage(client, stage)
+        elif STAGE_TIMEOUT > 0 and STAGE_TIMERS[stage] is None:
+            timer = threading.Timer(STAGE_TIMEOUT, expire_stage, args=(client, stage, TIMESTAMP))
+            timer.daemon = True
+            timer.start()
+            STAGE_TIMERS[stage] = timer
+
+def on_message_tick(client, userdata, msg):
+    """
+    Callback function that processes messages from the tick topic.
+    """
+    global TIMESTAMP
+
+    with LOCK:
+        # stages of the previous tick that did not get all messages
+        for stage in STAGES:
+            if RECEIVED[stage].any():
+                logging.warning(f"Stage {stage} of tick {TIMESTAMP} ran with {int(RECEIVED[stage].sum())} of {int((~DONE[stage]).sum())} waiting plants")
+                run_stage(client, stage)
+            DONE[stage] = np.zeros(FLEET_SIZE, dtype=bool)
+
+        TIMESTAMP = msg.payload.decode("utf-8")
+
+        # reset the status variables
+        STATUS_POWER_NOT_RECEIVED.fill(True)
+        STATUS_FILTERED_WATER_NOT_RECEIVED.fill(True)
+
+        failure_check()
+
+        logging.debug(f"Received tick message, timestamp: {TIMESTAMP}")
+
+def on_message_hydrogen_request(client, userdata, msg, payload):
+    receive(client, "hydrogen_request", msg.topic, PLANED_HYDROGEN_SUPPLY, payload["amount"])
+
+def on_message_power_received(client, userdata, msg, payload):
+    receive(client, "power", msg.topic, POWER_SUPPLIED, payload["amount"])
+
+def on_message_water_received(client, userdata, msg, payload):
+    receive(client, "filtered_water", msg.topic, FILTERED_WATER_SUPPLIED, payload["amount"])
+
+def main():
+    """
+    Main function to initialize the MQTT client, set up subscriptions,
+    and start the message loop.
+    """
+
+    # Initialize the MQTT client and connect to the broker
+    mqtt = MQTTWrapper('mqttbroker', 1883, name='hydrogen_plant_fleet_' + IDS[0])
+
+    # one wildcard subscription per topic for the whole fleet
+    mqtt.subscribe(TICK)
+    mqtt.subscribe(TOPIC_POWER_RECEIVE + "+")
+    mqtt.subscribe(TOPIC_FILTERED_WATER_RECEIVE + "+")
+    mqtt.subscribe(TOPIC_HYDROGEN_REQUEST + "+")
+    mqtt.subscribe_with_callback(TICK, on_message_tick)
+    mqtt.subscribe_with_callback(TOPIC_FILTERED_WATER_RECEIVE + "+", on_message_water_received, decode=True)
+    mqtt.subscribe_with_callback(TOPIC_POWER_RECEIVE + "+", on_message_power_received, decode=True)
+    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_REQUEST + "+", on_message_hydrogen_request, decode=True)
+
+    try:
+        # Start the MQTT loop to process incoming and outgoing messages
+        mqtt.loop_forever()
+    except (KeyboardInterrupt, SystemExit):
+        mqtt.stop()
+        sys.exit("KeyboardInterrupt -- shutdown gracefully.")
+
+if __name__ == '__main__':
+    # Entry point for the script
+    main()
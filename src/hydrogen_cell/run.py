@@ -1,9 +1,10 @@
 import sys
-import json
 import os
-import random
 import logging
+import numpy as np
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
+from failure_model import FailureModel
 
 # Configure the logger
 logging.basicConfig(
@@ -36,6 +37,9 @@ TOPIC_HYDROGEN_SUPPLY = getenv_or_exit("TOPIC_HYDROGEN_CELL_HYDROGEN_SUPPLY", "d
 TOPIC_KPI = getenv_or_exit("TOPIC_HYDROGEN_CELL_KPI", "default") + ID #topic to post kpis
 
 TOPIC_HYDROGEN_REQUEST = getenv_or_exit("TOPIC_HYDROGEN_CELL_HYDROGEN_REQUEST", "default") + ID # topic to receive requests from hydrogen pipe (must be followed by filter plant id)
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+SERVICE_NAME = "hydrogen_cell_" + ID
 
 NOMINAL_PERFORMANCE = NOMINAL_POWER_DEMAND / NOMINAL_HYDROGEN_SUPPLY
 
@@ -59,8 +63,9 @@ STATUS_POWER_NOT_RECEIVED = True
 STATUS_FILTERED_WATER_NOT_RECEIVED = True
 STATUS_FAILURE = False
 CURRENT_FAILURE_POSIBILITY = STANDART_FAILURE_POSIBILITY
-MINIMAL_FAILURE_POSIBILITY_CHANGE = 0.0005
 OVERPRODUCTION_MODE = False
+# failure and outage schedule of the plant, see failure_model.py
+FAILURE_MODEL = FailureModel(np.array([STANDART_FAILURE_POSIBILITY]), np.array([MINIMAL_OUTAGE_DURATION]))
 
 COUNTER_ALLTICKS = 0
 
@@ -71,14 +76,14 @@ def send_request_msg(client, request_topic, timestamp, plant_id, reply_topic, am
         "reply_topic": reply_topic, 
         "amount": amount
     }
-    client.publish(request_topic, json.dumps(data))
+    client.publish(request_topic, encode(data))
 
 def send_supply_msg(client, supply_topic, timestamp, amount):
     data = {
         "timestamp": timestamp,  
         "amount": amount
     }
-    client.publish(supply_topic, json.dumps(data))
+    client.publish(supply_topic, encode(data))
 
 def send_kpi_msg(client, kpi_topic, timestamp, plant_id, status, eff, prod, cper, npower, namount, soproduction, failure, ploss):
     data = {
@@ -94,7 +99,14 @@ def send_kpi_msg(client, kpi_topic, timestamp, plant_id, status, eff, prod, cper
         "failure": failure,
         "ploss": ploss
     }
-    client.publish(kpi_topic, json.dumps(data))
+    client.publish(kpi_topic, encode(data))
+
+def send_ack_msg(client, timestamp):
+    """
+    Acknowledges the completion of the tick to the tick generator (lockstep mode only).
+    """
+    if LOCKSTEP:
+        client.publish(TOPIC_TICK_ACK, encode({"service": SERVICE_NAME, "timestamp": timestamp}))
 
 def filtered_water_demand_on_supplied_power():
     global POWER_SUPPLIED, PLANED_POWER_DEMAND, PLANED_FILTERED_WATER_DEMAND
@@ -184,38 +196,26 @@ def calculate_demands():
     logging.debug(f"PLANED_HYDROGEN_SUPPLY :{PLANED_HYDROGEN_SUPPLY}, PLANED_FILTERED_WATER_DEMAND {PLANED_FILTERED_WATER_DEMAND}, PLANED_WATER_DEMAND: {PLANED_POWER_DEMAND}")
 
 def calculate_outage_risk():
-    global CURRENT_FAILURE_POSIBILITY, STANDART_FAILURE_POSIBILITY, STATUS_FAILURE, MINIMAL_FAILURE_POSIBILITY_CHANGE
-    global OVERPRODUCTION_MODE
+    global CURRENT_FAILURE_POSIBILITY, OVERPRODUCTION_MODE
 
-    if not STATUS_FAILURE:
-        # check wether the plant is in overproduction mode
-        if OVERPRODUCTION_MODE:
-            CURRENT_FAILURE_POSIBILITY += MINIMAL_FAILURE_POSIBILITY_CHANGE
-        elif CURRENT_FAILURE_POSIBILITY > STANDART_FAILURE_POSIBILITY:
-            CURRENT_FAILURE_POSIBILITY -= MINIMAL_FAILURE_POSIBILITY_CHANGE 
+    # the failure posibility rises in overproduction mode and falls back afterwards
+    FAILURE_MODEL.drift(np.array([OVERPRODUCTION_MODE]))
+    CURRENT_FAILURE_POSIBILITY = float(FAILURE_MODEL.posibility[0])
 
 def failure_check():
-    global STATUS_FAILURE, STANDART_FAILURE_POSIBILITY, CURRENT_FAILURE_POSIBILITY, FAILURE_TICK_COUNT, FAILURE_TIMEOUT
+    global STATUS_FAILURE, CURRENT_FAILURE_POSIBILITY, FAILURE_TICK_COUNT, FAILURE_TIMEOUT
     global TIMESTAMP
 
-    if STATUS_FAILURE:
-        # each tick increase outage tick count
-        if FAILURE_TICK_COUNT < FAILURE_TIMEOUT:
-            FAILURE_TICK_COUNT += 1
-        else:
-            FAILURE_TICK_COUNT = 0
-            CURRENT_FAILURE_POSIBILITY = STANDART_FAILURE_POSIBILITY
-            STATUS_FAILURE = False
-            logging.info(f"{TIMESTAMP} The hydrogen plant is back online")
-    else:
-        # decide if the plant is experiencing outage
-        rng_value = random.random()
-        if rng_value <= CURRENT_FAILURE_POSIBILITY:
-            # calculate the time the plant will be out
-            FAILURE_TICK_COUNT = 0
-            FAILURE_TIMEOUT = MINIMAL_OUTAGE_DURATION + int(rng_value * 1000) 
-            STATUS_FAILURE = True
-            logging.info(f"{TIMESTAMP} The hydrogen plant experienced Failure and will be out for {FAILURE_TIMEOUT} ticks")
+    # the failures are scheduled in advance, no random draw per tick
+    failed, recovered = FAILURE_MODEL.step()
+    STATUS_FAILURE = bool(FAILURE_MODEL.failed[0])
+    FAILURE_TICK_COUNT = int(FAILURE_MODEL.failure_tick_count()[0])
+    FAILURE_TIMEOUT = float(FAILURE_MODEL.timeout[0])
+    CURRENT_FAILURE_POSIBILITY = float(FAILURE_MODEL.posibility[0])
+    if recovered[0]:
+        logging.info(f"{TIMESTAMP} The hydrogen plant is back online")
+    if failed[0]:
+        logging.info(f"{TIMESTAMP} The hydrogen plant experienced Failure and will be out for {FAILURE_TIMEOUT} ticks")
 
 def on_message_tick(client, userdata, msg):
     """
@@ -239,7 +239,7 @@ def on_message_tick(client, userdata, msg):
 
     logging.debug(f"Received tick message, timestamp: {TIMESTAMP}")
 
-def on_message_power_received(client, userdata, msg):
+def on_message_power_received(client, userdata, msg, payload):
     """
     Callback function that processes messages from the power received topic.
     It processes how much power is received from power plant and calculates the coresponding volume of water,
@@ -249,7 +249,6 @@ def on_message_power_received(client, userdata, msg):
     global TIMESTAMP
     global TOPIC_FILTERED_WATER_REQUEST, ID, TOPIC_FILTERED_WATER_RECEIVE, POWER_SUPPLIED, STATUS_POWER_NOT_RECEIVED, PLANED_POWER_DEMAND
 
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     POWER_SUPPLIED = payload["amount"]
     
@@ -266,7 +265,7 @@ def on_message_power_received(client, userdata, msg):
     send_request_msg(client, TOPIC_FILTERED_WATER_REQUEST, TIMESTAMP, ID, TOPIC_FILTERED_WATER_RECEIVE, filtered_water_demand)
     logging.debug(f"Sending filtered water request message to filter system. timestamp: {TIMESTAMP}, msg topic: {TOPIC_FILTERED_WATER_REQUEST}, plant id: {ID}, reply topic: {TOPIC_FILTERED_WATER_RECEIVE}, demand: {filtered_water_demand}")
 
-def on_message_water_received(client, userdata, msg):
+def on_message_water_received(client, userdata, msg, payload):
     """
     Callback function that processes messages from the water received topic.
     It processes how much water is received from water pipe and generates the coresponding volume of filtered volume.
@@ -275,7 +274,6 @@ def on_message_water_received(client, userdata, msg):
     global TIMESTAMP, FILTERED_WATER_SUPPLIED, TOPIC_HYDROGEN_SUPPLY, TOPIC_KPI, ID, HYDROGEN_PRODUCED
     global STATUS, EFFICIENCY, PRODUCTION, CURRENT_PERFORMANCE, NOMINAL_POWER_DEMAND, NOMINAL_HYDROGEN_SUPPLY, COUNTER_ALLTICKS, PRODUCTION_LOSSES
     global FAILURE_TICK_COUNT, CURRENT_FAILURE_POSIBILITY
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     FILTERED_WATER_SUPPLIED = payload["amount"]
     logging.debug(f"Received filtered water message. timestamp: {timestamp}, msg topic: {msg.topic}, supplied filtered water: {FILTERED_WATER_SUPPLIED}")
@@ -308,10 +306,11 @@ def on_message_water_received(client, userdata, msg):
     calculate_outage_risk()
     logging.debug(f"Current outage risk: {CURRENT_FAILURE_POSIBILITY}")
 
-def on_message_hydrogen_request(client, userdata, msg):
+    send_ack_msg(client, TIMESTAMP)
+
+def on_message_hydrogen_request(client, userdata, msg, payload):
     global TIMESTAMP, TOPIC_POWER_REQUEST, ID, TOPIC_POWER_RECEIVE, PLANED_POWER_DEMAND, PLANED_HYDROGEN_SUPPLY
 
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     PLANED_HYDROGEN_SUPPLY = payload["amount"]
     logging.debug(f"Received hydrogen request message. timestamp: {timestamp}, msg topic: {msg.topic}, requested amount: {PLANED_HYDROGEN_SUPPLY}")
@@ -334,9 +333,9 @@ def main():
     mqtt.subscribe(TOPIC_POWER_RECEIVE)
     mqtt.subscribe(TOPIC_HYDROGEN_REQUEST)
     mqtt.subscribe_with_callback(TICK, on_message_tick)
-    mqtt.subscribe_with_callback(TOPIC_FILTERED_WATER_RECEIVE, on_message_water_received)
-    mqtt.subscribe_with_callback(TOPIC_POWER_RECEIVE, on_message_power_received)
-    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_REQUEST, on_message_hydrogen_request)
+    mqtt.subscribe_with_callback(TOPIC_FILTERED_WATER_RECEIVE, on_message_water_received, decode=True)
+    mqtt.subscribe_with_callback(TOPIC_POWER_RECEIVE, on_message_power_received, decode=True)
+    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_REQUEST, on_message_hydrogen_request, decode=True)
     
     try:
         # Start the MQTT loop to process incoming and outgoing messages
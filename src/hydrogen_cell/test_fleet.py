@@ -0,0 +1,74 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from mqtt.codec import decode
+
+SERVICE = os.path.dirname(os.path.abspath(__file__))
+ENV = os.path.join(SERVICE, "..", ".env")
+TICKS = 400
+
+def load_env(monkeypatch):
+    with open(ENV) as file:
+        for line in file:
+            line = line.split(" #")[0].strip()
+            if "=" in line and not line.startswith("#"):
+                name, value = line.split("=", 1)
+                monkeypatch.setenv(name.strip(), value.strip())
+    monkeypatch.setenv("ID", "0")
+    monkeypatch.setenv("FLEET_SIZE", "1")
+    monkeypatch.setenv("TICK_GEN_MODE", "lockstep")
+    monkeypatch.setenv("HYDROGEN_CELL_0_FAILURE_POSIBILITY", "0.02") # some outages within the test
+
+def load(name):
+    spec = importlib.util.spec_from_file_location(f"{name}_under_test", os.path.join(SERVICE, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # the same failures in both services
+    module.FAILURE_MODEL.rng = np.random.default_rng(7)
+    module.FAILURE_MODEL.schedule(np.ones(1, dtype=bool), 0)
+    return module
+
+class Client:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic, payload):
+        self.messages.append((topic, decode(payload)))
+
+def simulate(service, inputs):
+    client = Client()
+    for timestamp, request, power, water in inputs:
+        service.on_message_tick(client, None, SimpleNamespace(topic=service.TICK, payload=timestamp.encode("utf-8")))
+        service.on_message_hydrogen_request(client, None, SimpleNamespace(topic=os.environ["TOPIC_HYDROGEN_CELL_HYDROGEN_REQUEST"] + "0"),
+                                                  {"timestamp": timestamp, "amount": request})
+        service.on_message_power_received(client, None, SimpleNamespace(topic=os.environ["TOPIC_HYDROGEN_CELL_POWER_RECEIVE"] + "0"),
+                                          {"timestamp": timestamp, "amount": power})
+        service.on_message_water_received(client, None, SimpleNamespace(topic=os.environ["TOPIC_HYDROGEN_CELL_FILTERED_WATER_RECEIVE"] + "0"),
+                                          {"timestamp": timestamp, "amount": water})
+    return client.messages
+
+def test_fleet_matches_single_plant(monkeypatch):
+    load_env(monkeypatch)
+    rng = np.random.default_rng(1)
+    inputs = []
+    for tick in range(TICKS):
+        # requests below the minimal and above the maximal supply, missing and partial power and water
+        request = round(float(rng.uniform(0, 10)), 4)
+        power = 0.0 if rng.random() < 0.1 else round(float(rng.uniform(0, 10000)), 4)
+        water = 0.0 if rng.random() < 0.1 else round(float(rng.uniform(0, 4)), 4)
+        inputs.append((f"2024-01-01T{tick // 4:03d}:{tick % 4 * 15:02d}", request, power, water))
+
+    single = simulate(load("run"), inputs)
+    fleet = simulate(load("fleet"), inputs)
+    assert len(fleet) == len(single)
+    for expected, message in zip(single, fleet):
+        assert message == expected
+
+    kpis = [payload for topic, payload in single if topic.startswith(os.environ["TOPIC_HYDROGEN_CELL_KPI"])]
+    statuses = {kpi["status"] for kpi in kpis}
+    # the inputs reach every status
+    assert statuses == {"online", "power not received", "ressource not received", "offline"}
@@ -0,0 +1,92 @@
+import time
+import numpy as np
+
+def water_fill(total, capacity, weights):
+    """
+    Weighted water-filling: every slot gets min(capacity, weight * level), with the level chosen so that
+    the total is used up. If the total exceeds the capacity of all slots, every slot gets its capacity.
+    """
+    capacity = np.minimum(capacity, total) # no slot takes more than the total, also bounds infinite capacities
+    if total >= capacity.sum():
+        return capacity
+    weights = np.maximum(weights, 1e-9)
+    ratio = capacity / weights # level at which a slot is full
+    order = np.argsort(ratio)
+    ratio = ratio[order]
+    ordered_capacity = capacity[order]
+    filled = np.cumsum(ordered_capacity) - ordered_capacity # capacity of the slots that are full below each level
+    rest = np.cumsum(weights[order][::-1])[::-1] # weight of the slots not yet full
+    needed = filled + ratio * rest # total needed to raise the level up to each ratio
+    k = int(np.searchsorted(needed, total))
+    level = (total - filled[k]) / rest[k]
+    return np.minimum(capacity, weights * level)
+
+class HydrogenPlanner:
+    """
+    Plans the hydrogen production of the remaining ticks of the day along a forecast of the available power.
+    The production of the slots follows the forecast (water-filling up to the capacity of the hydrogen plants),
+    so it is shifted into the windy ticks of the day instead of spread evenly.
+
+    The plan is kept from tick to tick and only solved again when the forecast of the remaining ticks,
+    the hydrogen still to produce or the capacity differ from the planned ones by more than the tolerance.
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance # relative deviation that triggers a new plan
+        self.schedule = np.zeros(0) # planned production of the remaining ticks, the first one is the current tick
+        self.forecast = np.zeros(0) # forecast the schedule was planned with
+        self.replans = 0
+
+    def demand_for_tick(self, remaining_demand, forecast, capacity=np.inf):
+        """
+        Hydrogen to produce in the current tick. forecast holds the available power of the current and all
+        remaining ticks of the day, capacity is the most hydrogen the plants can produce in one tick.
+        """
+        forecast = np.maximum(np.asarray(forecast, dtype=np.float64), 0)
+        remaining_demand = max(remaining_demand, 0)
+        # the current tick of the last plan is over
+        self.schedule, self.forecast = self.schedule[1:], self.forecast[1:]
+        if not self.valid(remaining_demand, forecast, capacity):
+            self.plan(remaining_demand, forecast, capacity)
+        return float(self.schedule[0])
+
+    def valid(self, remaining_demand, forecast, capacity):
+        """Whether the cached plan still fits the forecast, the remaining demand and the capacity."""
+        if len(self.schedule) != len(forecast) or len(forecast) == 0:
+            return False
+        if abs(self.schedule.sum() - remaining_demand) > self.tolerance * max(remaining_demand, 1e-9):
+            return False
+        if np.abs(forecast - self.forecast).sum() > self.tolerance * max(self.forecast.sum(), 1e-9):
+            return False
+        return not (self.schedule > capacity * (1 + self.tolerance)).any()
+
+    def plan(self, remaining_demand, forecast, capacity):
+        # without wind in the forecast the demand is spread evenly
+        weights = forecast if forecast.sum() > 0 else np.ones(len(forecast))
+        self.schedule = water_fill(remaining_demand, np.full(len(forecast), float(capacity)), weights)
+        self.forecast = forecast
+        self.replans += 1
+
+if __name__ == '__main__':
+    # Benchmark: planning one day of 96 ticks, with and without a changed forecast
+    rng = np.random.default_rng(42)
+    ticks = 96
+    forecast = np.clip(np.sin(np.linspace(0, 3 * np.pi, ticks)) * 800 + 1000 + rng.normal(0, 100, ticks), 0, None)
+    demand = 500.0
+    capacity = 10.0
+
+    planner = HydrogenPlanner(0.1)
+    start = time.perf_counter()
+    produced = 0.0
+    for tick in range(ticks):
+        noisy = forecast[tick:] * rng.normal(1, 0.02, ticks - tick) # the forecast changes a little every tick
+        produced += planner.demand_for_tick(demand - produced, noisy, capacity)
+    elapsed = (time.perf_counter() - start) / ticks
+    print(f"{elapsed*1e6:.1f} us per tick, {planner.replans} plans for {ticks} ticks, {produced:.2f} of {demand:.2f} produced")
+
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        schedule = water_fill(demand, np.full(ticks, capacity), forecast)
+    elapsed = (time.perf_counter() - start) / runs
+    print(f"{elapsed*1e6:.1f} us per plan of {ticks} ticks, windiest tick {schedule.max():.2f}, calmest tick {schedule.min():.2f}")
@@ -1,10 +1,18 @@
 import sys
-import json
 import logging
 from random import seed, randint
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
+from rolling_stats import RollingStats, parse_windows
 import os
+import threading
+import numpy as np
 from collections import namedtuple
+from stage_deadline import StageDeadline
+from kpi_registry import KpiRegistry
+from decision_engine import DecisionEngine
+from hydrogen_planner import HydrogenPlanner
+from hydrogen_allocator import HydrogenAllocator, POLICIES
 
 # Configure the logger
 logging.basicConfig(
@@ -27,6 +35,23 @@ TOPIC_SUPPLY = getenv_or_exit("TOPIC_HYDROGEN_CELL_HYDROGEN_SUPPLY", "default")
 TOPIC_KPI = getenv_or_exit("TOPIC_HYDROGEN_CELL_KPI", "default") # Base topic to receive kpis from filter plants (must be followed by Plant ID)
 TOPIC_ADAPTIVE_MODE = getenv_or_exit('TOPIC_ADAPTIVE_MODE', 'default')# Topic to change work modes 
 TOPIC_HYDROGEN_SUPPLY_SUM = getenv_or_exit("TOPIC_HYDROGEN_SUM_DATA", 'default') # Topic to send production data for the dashboard
+TOPIC_POWER_SUM = getenv_or_exit('TOPIC_POWER_SUM_POWER_SUM_DATA', 'default') # Topic to receive the summed power of a tick
+TOPIC_POWER_SUM_WINDOW = getenv_or_exit('TOPIC_POWER_SUM_POWER_SUM_DATA_WINDOW', 'default') # Topic to receive the summed power of a tick window
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+TOPIC_STAGE_METRICS = getenv_or_exit('TOPIC_STAGE_METRICS', 'default') # Topic for late and missing plants of a stage
+SERVICE_NAME = "hydrogen_system"
+SUPPLY_DEADLINE = float(getenv_or_exit("HYDROGEN_SUM_SUPPLY_DEADLINE", -1.0)) # Seconds after the tick to wait for the supplies
+KPI_MAX_AGE = int(getenv_or_exit("HYDROGEN_SUM_KPI_MAX_AGE", -1)) # Ticks the last KPI of a plant is used for
+DECISION_RULES = getenv_or_exit("HYDROGEN_SUM_DECISION_RULES", "default") # Rule table of the adaptive mode
+PLAN_MODE = getenv_or_exit("HYDROGEN_SUM_PLAN_MODE", "default") # even or forecast
+WINDOW_SIZE = int(getenv_or_exit("TICK_GEN_WINDOW_SIZE", -1)) # the forecast mode needs tick windows (> 1)
+PLAN_TOLERANCE = float(getenv_or_exit("HYDROGEN_SUM_PLAN_TOLERANCE", -1.0)) # Relative deviation of forecast or production that triggers a new plan
+PLAN_MAX_LOAD = float(getenv_or_exit("HYDROGEN_SUM_PLAN_MAX_LOAD", -1.0)) # Most hydrogen a plant is planned for in one tick, as share of its nominal amount
+ALLOCATION_POLICY = getenv_or_exit("HYDROGEN_SUM_ALLOCATION_POLICY", "default") # Split of the demand outside the adaptive mode, one of POLICIES
+OUTAGE_TICKS = float(getenv_or_exit("HYDROGEN_SUM_OUTAGE_TICKS", -1.0)) # Expected length of an outage, weighs the outage risk against the production loss
+if ALLOCATION_POLICY not in POLICIES:
+    raise SystemExit(f"Unknown allocation policy {ALLOCATION_POLICY}, use one of {POLICIES}")
 
 TOPIC_KPI_LIST = []
 TOPIC_SUPPLY_LIST = []
@@ -35,37 +60,100 @@ for i in range(PLANTS_NUMBER):
     TOPIC_HYDROGEN_REQEUST_LIST.append(TOPIC_HYDROGEN_REQEUST+str(i))
     TOPIC_SUPPLY_LIST.append(TOPIC_SUPPLY+str(i)) # list with all supply topics
     TOPIC_KPI_LIST.append(TOPIC_KPI+str(i)) # list with all kpi topics
+PLANT_IDS = [str(i) for i in range(PLANTS_NUMBER)]
+SUPPLY_TOPIC_IDS = dict(zip(TOPIC_SUPPLY_LIST, PLANT_IDS)) # plant id of each supply topic
 
 ADAPTABLE = False
 TIMESTAMP = 0
 TICK_COUNT = 0
 RECEIVED_SUPPLIES = 0
-RECEIVED_KPI = 0
 
 HYDROGEN_DAILY_DEMAND = 0
 TOTAL_HYDROGEN_PRODUCED = 0
+FORECAST_POWER = {} # timestamp -> summed power of the announced ticks (tick windows)
+MEAN_POWER = 0 # rolling mean of the summed power, forecast for the ticks beyond the windows
+FLAT_FORECAST = False # the forecast is only the mean power (no tick window known), warned once per change
 
 SUPPLY_LIST = [] # A list to hold all supplies
-KPI_LIST = [] # A list to hold all requests
+KPI_REGISTRY = KpiRegistry(PLANT_IDS, KPI_MAX_AGE) # last known kpis of the plants
+DECISION_ENGINE = DecisionEngine(DECISION_RULES) # plans the requests of the adaptive mode
+PLANNER = HydrogenPlanner(PLAN_TOLERANCE) # plans the hydrogen of the day along the power forecast
+ALLOCATOR = HydrogenAllocator(OUTAGE_TICKS, PLAN_MAX_LOAD) # splits the demand at minimal loss and outage risk
 
 SUPPLY_CLASS = namedtuple("Supply", ["supply"]) # A data structure for supplies
-KPI_CLASS = namedtuple("KPI", ["plant_id", "status", "eff", "prod", "cper", "soproduction", "failure", "ploss", "namount"]) # A data structure for requests
 
 TICKS_IN_DAY = 96
+STATS_WINDOWS = parse_windows(getenv_or_exit("ROLLING_STATS_WINDOWS", "default")) # name:ticks, the first window gives the mean
+HYDROGEN_STATS = RollingStats(STATS_WINDOWS) # rolling statistics of the hydrogen produced per tick
+MEAN_WINDOW = next(iter(STATS_WINDOWS))
+
+LOCK = threading.RLock() # callbacks and the stage deadline run in different threads
 
 def send_msg(client, topic, timestamp, amount):
     data = {
         "timestamp": timestamp,  
         "amount": amount
     }
-    client.publish(topic, json.dumps(data))
+    client.publish(topic, encode(data))
+
+def send_ack_msg(client, timestamp):
+    """
+    Acknowledges the completion of the tick to the tick generator (lockstep mode only).
+    """
+    if LOCKSTEP:
+        client.publish(TOPIC_TICK_ACK, encode({"service": SERVICE_NAME, "timestamp": timestamp}))
+
+def send_stage_metric(client, stage):
+    """
+    Publishes the late and missing plants of the stage, if there are any.
+    """
+    data = stage.metric(SERVICE_NAME)
+    if data is not None:
+        client.publish(TOPIC_STAGE_METRICS, encode(data))
+
+def complete_supplies(client):
+    """
+    Completes the supply stage of the tick, either by the last supply or by the deadline.
+    """
+    if SUPPLY_STAGE.complete():
+        send_stage_metric(client, SUPPLY_STAGE)
+        calculate_total_supply(client)
+
+SUPPLY_STAGE = StageDeadline("hydrogen_supplies", SUPPLY_DEADLINE, PLANT_IDS, complete_supplies, LOCK)
+
+def power_forecast(ticks):
+    """
+    Forecast of the available power for the current and the next ticks: the summed power
+    of the announced tick windows where known, the rolling mean power beyond.
+    """
+    global FLAT_FORECAST
+
+    known = [power for timestamp, power in FORECAST_POWER.items() if timestamp >= TIMESTAMP][:ticks]
+    flat = ticks > 0 and not known
+    if flat and not FLAT_FORECAST:
+        logging.warning(f"{TIMESTAMP} No tick window power known, the forecast is the mean power and the plan is spread evenly")
+    FLAT_FORECAST = flat
+    return known + [MEAN_POWER] * (ticks - len(known))
+
+def hydrogen_capacity():
+    """
+    Most hydrogen the online plants can produce in one tick, unlimited before their first kpis.
+    """
+    online = KPI_REGISTRY.online()
+    if not online.any():
+        return np.inf
+    return float(KPI_REGISTRY.values["namount"][online].sum()) * PLAN_MAX_LOAD
 
 def calculate_hydrogen_demand_for_tick():
     global HYDROGEN_DAILY_DEMAND, TOTAL_HYDROGEN_PRODUCED, TICK_COUNT
 
     # avoid division by 0
     mod = TICK_COUNT % 96 
-    if  mod > 0:
+    if PLAN_MODE == "forecast":
+        # the rest of the daily demand follows the power forecast of the remaining ticks
+        ticks = TICKS_IN_DAY - mod if mod > 0 else 1
+        plan = round(PLANNER.demand_for_tick(HYDROGEN_DAILY_DEMAND - TOTAL_HYDROGEN_PRODUCED, power_forecast(ticks), hydrogen_capacity()), 2)
+    elif  mod > 0:
         plan = round((HYDROGEN_DAILY_DEMAND - TOTAL_HYDROGEN_PRODUCED) / (TICKS_IN_DAY-mod), 2)
     else:
         plan = HYDROGEN_DAILY_DEMAND - TOTAL_HYDROGEN_PRODUCED
@@ -78,67 +166,14 @@ def calculate_hydrogen_demand_for_tick():
 
     return demand_for_tick
 
-def decision_kpi(corresponding_kpi, plants_left, demand_need):
-
-    if(corresponding_kpi.soproduction > 8 or (corresponding_kpi.failure > 0.05 and corresponding_kpi.prod > 1.0)):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 0.8)):
-            request_amount = corresponding_kpi.namount * 0.8
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-                
-    elif(corresponding_kpi.soproduction < 2 and corresponding_kpi.ploss < 0.3 and corresponding_kpi.failure < 0.02):         #bei zu hoher production loss lohnt sich keine starke Überlast
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.5)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.5
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-
-    elif(corresponding_kpi.soproduction < 4 and corresponding_kpi.ploss < 0.1 and corresponding_kpi.failure < 0.1):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.3)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.3
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    elif(corresponding_kpi.soproduction < 6):
-        if(round(demand_need/plants_left, 4) > (corresponding_kpi.namount * 1.1)):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount * 1.1
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    else:
-        if(round(demand_need/plants_left, 4) > corresponding_kpi.namount):
-            request_amount = round(demand_need/plants_left, 4)
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-        else:
-            request_amount = corresponding_kpi.namount
-            demand_need = demand_need - request_amount
-            plants_left = plants_left - 1
-    return request_amount, plants_left, demand_need
-
-
 def calculate_and_publish_hydrogen_requests(client):
-    global TIMESTAMP, ADAPTABLE, PLANTS_NUMBER, TOPIC_HYDROGEN_REQEUST_LIST, HYDROGEN_DAILY_DEMAND, RECEIVED_KPI
-    global KPI_LIST
+    global TIMESTAMP, ADAPTABLE, PLANTS_NUMBER, TOPIC_HYDROGEN_REQEUST_LIST, HYDROGEN_DAILY_DEMAND
 
     # Calculate the total demand for this tick
     total_demand = calculate_hydrogen_demand_for_tick()
 
     # Handling for the initial loop where no kpi is present
-    if not KPI_LIST:
+    if not KPI_REGISTRY.fresh().any():
         logging.debug("Warning. No kpi list. Using default mean allocation")
         for request_topic in TOPIC_HYDROGEN_REQEUST_LIST:
             request_amount = round(total_demand/PLANTS_NUMBER, 4)
@@ -152,26 +187,26 @@ def calculate_and_publish_hydrogen_requests(client):
             )
             logging.debug(f"Sending  hydrogen request message to hydrogen plant. Timestamp: {TIMESTAMP}, msg topic: {request_topic}, requested amount: {request_amount}")
 
-        RECEIVED_KPI = 0
         return
 
     if ADAPTABLE:
-        # Place for everything that MAPE loop has to do before the iterating trough and publishing requests to filter plants
-        n = 0
-        plants_left = PLANTS_NUMBER
-        demand_need = total_demand
+        # MAPE loop: the decision rules plan the requests of all plants at once
+        requests = DECISION_ENGINE.plan(total_demand, KPI_REGISTRY.values, KPI_REGISTRY.online())
+    elif ALLOCATION_POLICY == "risk":
+        # one solve for all plants, see hydrogen_allocator.py
+        kpis = KPI_REGISTRY.values
+        requests = ALLOCATOR.allocate(total_demand, kpis["namount"], kpis["failure"], kpis["ploss"], kpis["soproduction"], KPI_REGISTRY.online())
     else:
-        online_count = sum(1 for kpi in KPI_LIST if kpi.status != "offline")
+        online_count = int(KPI_REGISTRY.online().sum())
 
-    for request_topic in TOPIC_HYDROGEN_REQEUST_LIST:
+    for i, (request_plant_id, request_topic) in enumerate(zip(PLANT_IDS, TOPIC_HYDROGEN_REQEUST_LIST)):
         # extract corresponding kpi
-        request_plant_id = request_topic.split('/')[-1]
-        corresponding_kpi = next((kpi for kpi in KPI_LIST if kpi.plant_id == request_plant_id), None)
+        corresponding_kpi = KPI_REGISTRY.get(request_plant_id)
         logging.debug(f"Plant id: {request_plant_id}")
 
         if not corresponding_kpi:
             # No kpi corresponding for plant id in the request 
-            logging.debug(f"Hydrogen plant with id {request_plant_id} and request topic: {request_topic} has no corresponding KPI.")
+            logging.debug(f"Hydrogen plant with id {request_plant_id} and request topic: {request_topic} has no recent KPI.")
             request_amount = 0
         elif corresponding_kpi.status == "offline" :
             # Offline plants receive 0 allocation
@@ -179,9 +214,8 @@ def calculate_and_publish_hydrogen_requests(client):
             request_amount = 0
         else:
             # Calculate allocation for active plants
-            if ADAPTABLE:
-                # Iterations of the MAPE loop
-                request_amount, plants_left, demand_need = decision_kpi(corresponding_kpi=corresponding_kpi, plants_left=plants_left, demand_need=demand_need)
+            if ADAPTABLE or ALLOCATION_POLICY == "risk":
+                request_amount = round(float(requests[i]), 4)
             else:
                 request_amount = round(total_demand/online_count, 4)
             
@@ -194,8 +228,6 @@ def calculate_and_publish_hydrogen_requests(client):
         )
         logging.debug(f"Sending hydrogen request message to hydrogen plant with id {request_plant_id}. timestamp: {TIMESTAMP}, msg topic: {request_topic}, requested amount: {request_amount}")
 
-    RECEIVED_KPI = 0
-    KPI_LIST.clear()
 
 def calculate_total_supply(client):
     global TOTAL_HYDROGEN_PRODUCED, SUPPLY_LIST, RECEIVED_SUPPLIES
@@ -207,16 +239,17 @@ def calculate_total_supply(client):
 
     # Publish the data for the dashboard
     # Maybe delete later
-    global TIMESTAMP, TOPIC_HYDROGEN_SUPPLY_SUM, TICK_COUNT, TICKS_IN_DAY
-    tick = TICK_COUNT % TICKS_IN_DAY
-    if tick == 0: tick = TICKS_IN_DAY
-    data = {"hydrogen": TOTAL_HYDROGEN_PRODUCED, "mean_hydrogen": round(TOTAL_HYDROGEN_PRODUCED/tick , 4), "timestamp": TIMESTAMP}
-    client.publish(TOPIC_HYDROGEN_SUPPLY_SUM, json.dumps(data))
+    global TIMESTAMP, TOPIC_HYDROGEN_SUPPLY_SUM, HYDROGEN_STATS
+    HYDROGEN_STATS.update(hydrogen_produced_current_tick)
+    data = {"hydrogen": TOTAL_HYDROGEN_PRODUCED, "mean_hydrogen": HYDROGEN_STATS.mean(MEAN_WINDOW), "stats": HYDROGEN_STATS.stats(), "timestamp": TIMESTAMP}
+    client.publish(TOPIC_HYDROGEN_SUPPLY_SUM, encode(data))
 
 
     SUPPLY_LIST.clear()
     RECEIVED_SUPPLIES = 0
 
+    send_ack_msg(client, TIMESTAMP)
+
 def add_supply(supply):
     global RECEIVED_SUPPLIES, SUPPLY_LIST, SUPPLY_CLASS
 
@@ -224,57 +257,72 @@ def add_supply(supply):
     RECEIVED_SUPPLIES += 1
 
 def add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount):
-    global RECEIVED_KPI, KPI_LIST, KPI_CLASS
-
-    KPI_LIST.append(KPI_CLASS(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount))
-    RECEIVED_KPI += 1
+    KPI_REGISTRY.update(plant_id, status, eff=eff, prod=prod, cper=cper, soproduction=soproduction, failure=failure, ploss=ploss, namount=namount)
 
 def on_message_tick(client, userdata, msg):
-    global TIMESTAMP, RECEIVED_KPI, RECEIVED_SUPPLIES, TICK_COUNT
+    global TIMESTAMP, RECEIVED_SUPPLIES, TICK_COUNT
      
-    TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp
-    RECEIVED_SUPPLIES = 0
-    RECEIVED_KPI = 0
-    TICK_COUNT += 1
-    logging.debug(f"Received tick message, timestamp: {TIMESTAMP}")
-
-    calculate_and_publish_hydrogen_requests(client)
-
-def on_message_daily_hydrogen_amount(client, userdata, msg):
+    with LOCK:
+        TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp
+        RECEIVED_SUPPLIES = 0
+        KPI_REGISTRY.next_tick() # the kpis get one tick older
+        TICK_COUNT += 1
+        # forget the forecast of the past ticks
+        for timestamp in [timestamp for timestamp in FORECAST_POWER if timestamp < TIMESTAMP]:
+            del FORECAST_POWER[timestamp]
+        SUPPLY_LIST.clear() # drop what is left over from a tick that was never completed
+        SUPPLY_STAGE.start(TIMESTAMP, client)
+        logging.debug(f"Received tick message, timestamp: {TIMESTAMP}")
+
+        calculate_and_publish_hydrogen_requests(client)
+
+def on_message_daily_hydrogen_amount(client, userdata, msg, payload):
     """
     Callback function that processes messages from the daily hydrogen amount topic.
     """
     global HYDROGEN_DAILY_DEMAND, TOTAL_HYDROGEN_PRODUCED
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
-    HYDROGEN_DAILY_DEMAND = payload["hydrogen"]
-    TOTAL_HYDROGEN_PRODUCED = 0
+    with LOCK:
+        HYDROGEN_DAILY_DEMAND = payload["hydrogen"]
+        TOTAL_HYDROGEN_PRODUCED = 0
     logging.debug(f"Received message with daily hydrogen request: timestamp: {timestamp}, daily demand: {HYDROGEN_DAILY_DEMAND}")
 
+def on_message_power_sum(client, userdata, msg, payload):
+    global MEAN_POWER
+    with LOCK:
+        MEAN_POWER = payload["mean_power"]
+
+def on_message_power_sum_window(client, userdata, msg, payload):
+    with LOCK:
+        FORECAST_POWER.update(zip(payload["timestamps"], payload["power"]))
+    logging.debug(f"Received power forecast for {len(payload['timestamps'])} ticks from {payload['timestamps'][0]}")
+
 def on_message_adaptive_mode(client, userdata, msg):
     global ADAPTABLE
     boolean = msg.payload.decode("utf-8")
-    if boolean == "true" or boolean == "1" or boolean == "I love Python" or boolean == "True":
-        ADAPTABLE = True
-    else:
-        ADAPTABLE = False
+    with LOCK:
+        ADAPTABLE = boolean == "true" or boolean == "1" or boolean == "I love Python" or boolean == "True"
     logging.info(f"Received message with to change mode, adaptable mode is {ADAPTABLE}")
 
-def on_message_supply(client, userdata, msg):
+def on_message_supply(client, userdata, msg, payload):
     """
     Callback function that processes messages from the request topic.
     """
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     supply = payload["amount"]
     logging.debug(f"Received message with hydrogen water supply. timestamp: {timestamp}, msg topic: {msg.topic}, supply: {supply}")
 
-    add_supply(supply)
+    with LOCK:
+        if not SUPPLY_STAGE.report(timestamp, SUPPLY_TOPIC_IDS.get(msg.topic)):
+            return
+        add_supply(supply)
+        # the last expected supply completes the tick, otherwise the deadline does
+        if RECEIVED_SUPPLIES >= PLANTS_NUMBER:
+            complete_supplies(client)
 
-def on_message_kpi(client, userdata, msg):
+def on_message_kpi(client, userdata, msg, payload):
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
     plant_id = payload["plant_id"]
     status = payload["status"]
@@ -287,7 +335,8 @@ def on_message_kpi(client, userdata, msg):
     namount = payload["namount"] #TODO kann raus
     logging.debug(f"Received message with KPI: timestamp. {timestamp}, msg topic: {msg.topic}, plant_id: {plant_id}, status: {status}, eff: {eff}, prod: {prod}, cper: {cper}, soproduction: {soproduction}, failure: {failure}, ploss: {ploss}, namount: {namount}")
 
-    add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount)
+    with LOCK:
+        add_kpi(plant_id, status, eff, prod, cper, soproduction, failure, ploss, namount)
 
 def main():
     """
@@ -300,26 +349,30 @@ def main():
     
     for topic in TOPIC_SUPPLY_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_supply)
+        mqtt.subscribe_with_callback(topic, on_message_supply, decode=True)
         
     for topic in TOPIC_KPI_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_kpi)
+        mqtt.subscribe_with_callback(topic, on_message_kpi, decode=True)
 
     mqtt.subscribe(TICK)
     mqtt.subscribe(TOPIC_HYDROGEN_DAILY_DEMAND)
     mqtt.subscribe(TOPIC_ADAPTIVE_MODE)
     mqtt.subscribe_with_callback(TICK, on_message_tick)
-    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_DAILY_DEMAND, on_message_daily_hydrogen_amount)
+    mqtt.subscribe_with_callback(TOPIC_HYDROGEN_DAILY_DEMAND, on_message_daily_hydrogen_amount, decode=True)
     mqtt.subscribe_with_callback(TOPIC_ADAPTIVE_MODE, on_message_adaptive_mode)
+    if PLAN_MODE == "forecast":
+        if WINDOW_SIZE <= 1:
+            logging.warning("HYDROGEN_SUM_PLAN_MODE = forecast without tick windows (TICK_GEN_WINDOW_SIZE <= 1), the plan follows the mean power only")
+        mqtt.subscribe(TOPIC_POWER_SUM)
+        mqtt.subscribe(TOPIC_POWER_SUM_WINDOW)
+        mqtt.subscribe_with_callback(TOPIC_POWER_SUM, on_message_power_sum, decode=True)
+        mqtt.subscribe_with_callback(TOPIC_POWER_SUM_WINDOW, on_message_power_sum_window, decode=True)
 
     try:
-        # Start the MQTT loop to process incoming and outgoing messages
-        while True:
-            if RECEIVED_SUPPLIES >= PLANTS_NUMBER:
-                calculate_total_supply(mqtt)
-                
-            mqtt.loop(0.05) # loop every 50ms
+        # Start the MQTT loop to process incoming and outgoing messages,
+        # the tick is completed in the callback that receives the last supply
+        mqtt.loop_forever()
     except (KeyboardInterrupt, SystemExit):
         # Gracefully stop the MQTT client and exit the program on interrupt
         mqtt.stop()
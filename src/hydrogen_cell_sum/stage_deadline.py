@@ -0,0 +1,85 @@
+import threading
+import logging
+
+class StageDeadline:
+    """
+    Deadline of a processing stage, relative to the publication of the tick.
+    The stage completes when the last expected report arrives or when the deadline passes,
+    whatever comes first. Plants that did not report until then are left out (zero demand or
+    supply) and listed in the late/missing metric, their reports arriving afterwards are dropped.
+
+    The deadline fires in a timer thread while reports arrive in the MQTT thread,
+    both hold the lock of the service while they touch the stage.
+    """
+
+    def __init__(self, name, timeout, expected, on_expire, lock):
+        self.name = name
+        self.timeout = timeout # seconds after the tick, 0 waits for all reports
+        self.expected = expected # ids of the plants that report in this stage
+        self.on_expire = on_expire # completes the stage, called with the arguments of start()
+        self.lock = lock
+        self.timestamp = None
+        self.reported = set()
+        self.late = 0 # reports dropped since the last metric
+        self.done = True
+        self.timer = None
+
+    def start(self, timestamp, *args):
+        """Opens the stage for the tick and arms its deadline."""
+        self.cancel()
+        self.timestamp = timestamp
+        self.reported = set()
+        self.done = False
+        if self.timeout > 0:
+            self.timer = threading.Timer(self.timeout, self.expire, args=(timestamp, args))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def report(self, timestamp, plant_id):
+        """Records the report of a plant. Returns False for reports the stage does not take anymore."""
+        if self.done or timestamp != self.timestamp:
+            self.late += 1
+            logging.warning(f"Dropped late report of plant {plant_id} for tick {timestamp} in stage {self.name}")
+            return False
+        self.reported.add(plant_id)
+        return True
+
+    def complete(self):
+        """Closes the stage. Returns False if it was closed already (by the deadline or the last report)."""
+        if self.done:
+            return False
+        self.done = True
+        self.cancel()
+        return True
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def expire(self, timestamp, args):
+        with self.lock:
+            if self.done or timestamp != self.timestamp:
+                return
+            logging.warning(f"Deadline of stage {self.name} passed for tick {timestamp}, missing plants: {self.missing()}")
+            self.on_expire(*args)
+
+    def missing(self):
+        return [plant_id for plant_id in self.expected if plant_id not in self.reported]
+
+    def metric(self, service):
+        """Late/missing metric of the stage, None if every plant reported in time."""
+        missing = self.missing()
+        if not missing and self.late == 0:
+            return None
+        data = {
+            "service": service,
+            "stage": self.name,
+            "timestamp": self.timestamp,
+            "expected": len(self.expected),
+            "received": len(self.reported),
+            "missing": missing,
+            "late": self.late
+        }
+        self.late = 0
+        return data
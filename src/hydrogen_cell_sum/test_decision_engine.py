@@ -0,0 +1,96 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from decision_engine import KPIS, DecisionEngine
+
+RULES = os.path.join(os.path.dirname(__file__), "decision_rules.csv")
+
+def old_decision(kpi, share):
+    """Request of the old decision_kpi cascade for a plant that gets the share of the remaining demand."""
+    if kpi.soproduction > 8 or (kpi.failure > 0.05 and kpi.prod > 1.0):
+        return min(share, kpi.namount * 0.8)
+    if kpi.soproduction < 2 and kpi.ploss < 0.3 and kpi.failure < 0.02:
+        return max(share, kpi.namount * 1.5)
+    if kpi.soproduction < 4 and kpi.ploss < 0.1 and kpi.failure < 0.1:
+        return max(share, kpi.namount * 1.3)
+    if kpi.soproduction < 6:
+        return max(share, kpi.namount * 1.1)
+    return max(share, kpi.namount)
+
+def fleet(seed, plants=400):
+    rng = np.random.default_rng(seed)
+    return {
+        "soproduction": rng.integers(0, 12, plants),
+        "failure": rng.choice([0, 0.01, 0.02, 0.05, 0.08, 0.1, 0.12], plants), # includes the bounds
+        "prod": rng.choice([0.8, 1.0, 1.2], plants),
+        "ploss": rng.choice([0, 0.05, 0.1, 0.2, 0.3, 0.4], plants),
+        "namount": rng.uniform(5, 15, plants)
+    }
+
+@pytest.fixture
+def engine():
+    return DecisionEngine(RULES)
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("factor", [0.5, 1.0, 2.0])
+def test_rules_match_old_cascade(engine, monkeypatch, seed, factor):
+    kpis = fleet(seed)
+    plants = len(kpis["namount"])
+    demand = kpis["namount"].sum() * factor
+    share = demand / plants
+    # compare the requests before they are normalised to the demand
+    monkeypatch.setattr(DecisionEngine, "normalise", staticmethod(lambda requests, demand, floor: requests))
+    requests = engine.plan(demand, kpis, np.ones(plants, dtype=bool))
+    for i in range(plants):
+        kpi = SimpleNamespace(**{name: kpis[name][i] for name in KPIS + ["namount"]})
+        assert requests[i] == pytest.approx(old_decision(kpi, share), abs=1e-4)
+
+def test_classify_first_match(engine):
+    kpis = {
+        "soproduction": np.array([9, 1, 1, 3, 5, 7, 1]),
+        "failure": np.array([0, 0.06, 0.01, 0.05, 0, 0, 0.01]),
+        "prod": np.array([1, 1.1, 1, 1, 1, 1, 1]),
+        "ploss": np.array([0, 0, 0.2, 0.05, 0.5, 0, 0.3]),
+        "namount": np.ones(7)
+    }
+    names = [engine.rules["name"][rule] for rule in engine.classify(kpis)]
+    assert names == ["long_outage", "failure_risk", "healthy", "good", "fair", "default", "fair"]
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("factor", [0.5, 1.0, 2.0])
+def test_plan_meets_demand(engine, seed, factor):
+    kpis = fleet(seed)
+    plants = len(kpis["namount"])
+    active = np.random.default_rng(seed).random(plants) > 0.2
+    demand = kpis["namount"].sum() * factor
+    requests = engine.plan(demand, kpis, active)
+    assert np.all(requests[~active] == 0)
+    assert np.all(requests >= 0)
+    assert requests.sum() == pytest.approx(demand, rel=1e-5)
+
+def test_capped_plants_keep_their_request(engine):
+    # the surplus of the demand goes to the floor plants, the capped plant stays at 0.8 * namount
+    kpis = {
+        "soproduction": np.array([9, 0, 0]),
+        "failure": np.zeros(3),
+        "prod": np.ones(3),
+        "ploss": np.zeros(3),
+        "namount": np.array([10.0, 10.0, 10.0])
+    }
+    requests = engine.plan(60, kpis, np.ones(3, dtype=bool))
+    assert requests.tolist() == [8, 26, 26]
+
+def test_no_active_plants(engine):
+    kpis = fleet(0, 3)
+    assert engine.plan(30, kpis, np.zeros(3, dtype=bool)).tolist() == [0, 0, 0]
+    assert engine.plan(0, kpis, np.ones(3, dtype=bool)).tolist() == [0, 0, 0]
+
+def test_unknown_mode(tmp_path):
+    path = tmp_path / "rules.csv"
+    with open(RULES) as file:
+        path.write_text(file.read().replace("cap", "limit"))
+    with pytest.raises(SystemExit):
+        DecisionEngine(str(path))
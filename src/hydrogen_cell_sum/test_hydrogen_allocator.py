@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from hydrogen_allocator import HydrogenAllocator
+
+def fleet(rng, plants):
+    return {
+        "namount": rng.uniform(5, 15, plants),
+        "failure": rng.uniform(0.001, 0.05, plants),
+        "ploss": rng.uniform(0, 0.3, plants),
+        "soproduction": np.where(rng.random(plants) < 0.1, 3, 0),
+        "active": rng.random(plants) > 0.1,
+    }
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("share", [0.05, 0.5, 0.9, 1.4])
+@pytest.mark.parametrize("iterations", [2, 40]) # a coarse bisection leaves a rest that must stay within the bounds
+def test_requests_meet_the_demand_within_the_bounds(seed, share, iterations):
+    rng = np.random.default_rng(seed)
+    kpis = fleet(rng, 50)
+    allocator = HydrogenAllocator(outage_ticks=10, max_load=1.5, iterations=iterations)
+    upper = np.where(kpis["active"] & (kpis["soproduction"] <= 0), kpis["namount"] * 1.5, 0)
+    demand = upper.sum() * share / 1.5
+    x = allocator.allocate(demand, **kpis)
+    assert x.sum() == pytest.approx(demand)
+    assert (x >= 0).all()
+    assert (x <= upper + 1e-9).all()
+
+def test_demand_above_the_capacity_gives_every_plant_its_bound():
+    allocator = HydrogenAllocator(outage_ticks=10, max_load=1.5)
+    x = allocator.allocate(100.0, [10.0, 10.0], [0.01, 0.01], [0.1, 0.1], [0, 0], np.array([True, True]))
+    assert x.tolist() == [15.0, 15.0]
+
+def test_unusable_plants_get_nothing():
+    allocator = HydrogenAllocator(outage_ticks=10, max_load=1.5)
+    x = allocator.allocate(5.0, [10.0, 10.0, 10.0], [0.01] * 3, [0.1] * 3, [0, 2, 0], np.array([True, True, False]))
+    assert x.tolist() == [5.0, 0.0, 0.0]
+
+def test_split_has_equal_marginal_costs_and_beats_the_equal_split():
+    rng = np.random.default_rng(1)
+    kpis = fleet(rng, 200)
+    allocator = HydrogenAllocator(outage_ticks=10, max_load=1.5)
+    demand = kpis["namount"].sum() * 0.6
+    x = allocator.allocate(demand, **kpis)
+    curvature = 2 * kpis["failure"] * 10 / kpis["namount"]
+    marginal = kpis["ploss"] + curvature * x
+    upper = np.where(kpis["active"] & (kpis["soproduction"] <= 0), kpis["namount"] * 1.5, 0)
+    free = (x > 1e-9) & (x < upper - 1e-9)
+    assert np.ptp(marginal[free]) < 1e-6 # KKT: the same marginal cost for every plant between its bounds
+
+    def cost(x):
+        return (kpis["ploss"] * x + kpis["failure"] * 10 * x**2 / kpis["namount"]).sum()
+
+    usable = upper > 0
+    equal = np.where(usable, demand / usable.sum(), 0)
+    assert cost(x) <= cost(equal)
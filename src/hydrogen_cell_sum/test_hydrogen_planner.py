@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from hydrogen_planner import HydrogenPlanner, water_fill
+
+TICKS = 96
+
+def forecast(seed=0):
+    rng = np.random.default_rng(seed)
+    return np.clip(np.sin(np.linspace(0, 3 * np.pi, TICKS)) * 800 + 1000 + rng.normal(0, 100, TICKS), 0, None)
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("total", [0, 50, 500, 2000])
+def test_water_fill_conservation(seed, total):
+    rng = np.random.default_rng(seed)
+    capacity = rng.uniform(0, 20, TICKS)
+    weights = rng.uniform(0, 1, TICKS)
+    filled = water_fill(total, capacity, weights)
+    assert np.all(filled >= 0)
+    assert np.all(filled <= capacity + 1e-9)
+    assert filled.sum() == pytest.approx(min(total, capacity.sum()))
+    # the slots that are not full share one level in proportion to their weight
+    open_slots = filled < capacity - 1e-9
+    if total < capacity.sum() and open_slots.any():
+        levels = filled[open_slots] / weights[open_slots]
+        assert np.allclose(levels, levels[0])
+
+def test_water_fill_infinite_capacity():
+    filled = water_fill(90, np.full(3, np.inf), np.array([1.0, 2.0, 6.0]))
+    assert filled.tolist() == [10, 20, 60]
+
+def test_plan_follows_forecast():
+    planner = HydrogenPlanner(0.1)
+    power = forecast()
+    planner.demand_for_tick(500, power, 10)
+    schedule = planner.schedule
+    assert schedule.sum() == pytest.approx(500)
+    assert schedule.max() <= 10
+    # more hydrogen in the windy ticks
+    assert schedule[np.argmax(power)] >= schedule[np.argmin(power)]
+
+def test_flat_forecast_is_spread_evenly():
+    planner = HydrogenPlanner(0.1)
+    assert planner.demand_for_tick(96, np.zeros(TICKS)) == pytest.approx(1)
+
+def test_plan_is_kept_while_it_fits():
+    planner = HydrogenPlanner(0.1)
+    power = forecast()
+    demand = 500.0
+    produced = 0.0
+    for tick in range(TICKS):
+        produced += planner.demand_for_tick(demand - produced, power[tick:], 10)
+    assert planner.replans == 1
+    assert produced == pytest.approx(demand)
+
+@pytest.mark.parametrize("factor, replans", [(1.099, 1), (1.101, 2), (0.901, 1), (0.899, 2)])
+def test_replan_at_forecast_tolerance(factor, replans):
+    planner = HydrogenPlanner(0.1)
+    power = forecast()
+    first = planner.demand_for_tick(500, power, 10)
+    planner.demand_for_tick(500 - first, power[1:] * factor, 10)
+    assert planner.replans == replans
+
+@pytest.mark.parametrize("factor, replans", [(1.099, 1), (1.101, 2), (0.901, 1), (0.899, 2)])
+def test_replan_at_demand_tolerance(factor, replans):
+    planner = HydrogenPlanner(0.1)
+    power = forecast()
+    first = planner.demand_for_tick(500, power, 10)
+    # the planned production deviates by factor from the remaining demand
+    planner.demand_for_tick((500 - first) / factor, power[1:], 10)
+    assert planner.replans == replans
+
+def test_replan_when_capacity_drops():
+    planner = HydrogenPlanner(0.1)
+    power = forecast()
+    first = planner.demand_for_tick(500, power, 10)
+    peak = planner.schedule[1:].max()
+    planner.demand_for_tick(500 - first, power[1:], peak / 1.05)
+    assert planner.replans == 1
+    planner.demand_for_tick(500 - first - planner.schedule[0], power[2:], peak / 1.2)
+    assert planner.replans == 2
+    assert planner.schedule.max() <= peak / 1.2 + 1e-9
@@ -1,8 +1,8 @@
 import sys
-import json
 import logging
 from random import seed, randint
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
 import os
 
 def getenv_or_exit(env_name, default="default"):
@@ -35,7 +35,7 @@ def on_message_tick(client, userdata, msg):
         ts_iso = msg.payload.decode("utf-8")
         data = {"hydrogen": hydrogen, "timestamp": ts_iso}  
         # Publish the data to the chaos sensor topic in JSON format
-        client.publish(HYDROGEN_REQUEST, json.dumps(data))
+        client.publish(HYDROGEN_REQUEST, encode(data))
     COUNT = (COUNT + 1) % LIMIT
 
 def main():
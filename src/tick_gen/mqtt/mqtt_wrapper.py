@@ -1,6 +1,7 @@
 import paho.mqtt.client as mqtt
 import logging
 import sys
+from . import codec
 
 
 class MQTTWrapper:
@@ -30,15 +31,25 @@ class MQTTWrapper:
         self.client.loop_start()
 
     def publish(self, topic, message):
-        self.log.debug('publish ' + str(message) + ' to topic ' + topic)
-        self.client.publish(topic, str(message))
+        # the debug string is only formatted if it is logged
+        self.log.debug('publish %s to topic %s', message, topic)
+        if not isinstance(message, (bytes, bytearray)):
+            message = str(message)
+        self.client.publish(topic, message)
+
+    def publish_json(self, topic, data):
+        self.publish(topic, codec.encode(data))
 
     def subscribe(self, topic):
         self.log.debug('subscribe to  ' + topic)
         self.client.subscribe(topic)
 
-    def subscribe_with_callback(self, sub, callback):
-        self.client.message_callback_add(sub, callback)
+    def subscribe_with_callback(self, sub, callback, decode=False):
+        # with decode the callback gets the decoded json payload as fourth argument
+        if decode:
+            self.client.message_callback_add(sub, lambda client, userdata, msg: callback(client, userdata, msg, codec.decode(msg.payload)))
+        else:
+            self.client.message_callback_add(sub, callback)
 
     # The callback for when the client receives a CONNACK response from the server.
     def on_connect(self, client, userdata, flags, rc):
@@ -54,7 +65,7 @@ class MQTTWrapper:
     def on_message(self, client, userdata, msg):
         if self.on_message_callback is not None:
             self.on_message_callback(userdata, msg)
-        else:
+        elif self.log.isEnabledFor(logging.DEBUG):
             self.log.debug(str(userdata) + ' - ' + msg.topic + ':'
                 + msg.payload.decode("utf-8"))
 
@@ -1,9 +1,10 @@
 import sys
-import json
 import time
 import logging
+import threading
 from datetime import datetime, timedelta
 from mqtt.mqtt_wrapper import MQTTWrapper
+from scheduler import DeadlineScheduler
 import os
 
 def getenv_or_exit(env_name, default="default"):
@@ -14,6 +15,21 @@ def getenv_or_exit(env_name, default="default"):
 
 TICK_TOPIC = getenv_or_exit('TOPIC_TICK_GEN_TICK', 'default')
 SPEEDFACTOR_TOPIC = getenv_or_exit('TOPIC_TICK_GEN_SPEED_FACTOR', 'default')
+ACK_TOPIC = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default')
+TELEMETRY_TOPIC = getenv_or_exit('TOPIC_TICK_GEN_TELEMETRY', 'default')
+TICK_WINDOW_TOPIC = getenv_or_exit('TOPIC_TICK_GEN_TICK_WINDOW', 'default')
+
+MODE = getenv_or_exit('TICK_GEN_MODE', 'default') # "realtime" or "lockstep"
+LOCKSTEP_TIMEOUT = float(getenv_or_exit('TICK_GEN_LOCKSTEP_TIMEOUT', 0.0)) # seconds to wait for missing acknowledgements
+LATE_POLICY = getenv_or_exit('TICK_GEN_LATE_POLICY', 'default') # "catchup" or "skip" missed deadlines in realtime mode
+WINDOW_SIZE = int(getenv_or_exit('TICK_GEN_WINDOW_SIZE', -1)) # number of ticks announced in one tick window message (0 or 1 disables windows)
+
+# Services that have to acknowledge every tick in lockstep mode
+LOCKSTEP_SERVICES = [service.strip() for service in getenv_or_exit('TICK_GEN_LOCKSTEP_SERVICES', 'default').split(",") if service.strip()]
+for j in range(int(getenv_or_exit('NUMBER_OF_FILTER_PLANTS', 0))):
+    LOCKSTEP_SERVICES.append("filter_plant_" + str(j))
+for j in range(int(getenv_or_exit('NUMBER_OF_HYDROGEN_PLANTS', 0))):
+    LOCKSTEP_SERVICES.append("hydrogen_cell_" + str(j))
 
 START_YEAR = int(getenv_or_exit('TICK_GEN_START_YEAR', 0))
 START_MONTH = int(getenv_or_exit('TICK_GEN_START_MONTH', 0))
@@ -22,15 +38,72 @@ START_DAY = int(getenv_or_exit('TICK_GEN_START_DAY', 0))
 #START_SECOND = int(getenv_or_exit('TICK_GEN_START_SECOND', 0))
 #START_MICROSECOND = int(getenv_or_exit('TICK_GEN_START_MICROSECOND', 0))
 START_DATE = datetime(START_YEAR, START_MONTH, START_DAY)
+TICK_MINUTES = int(getenv_or_exit('TICK_GEN_TICK_MINUTES', 0)) # simulated minutes between two ticks
 
 interval_sec = 30
 speed_factor = 30
 
+CURRENT_TICK = None # timestamp of the tick that is waiting for acknowledgements
+PENDING_ACKS = set() # services that did not acknowledge the current tick yet
+ACK_CONDITION = threading.Condition()
+
+SCHEDULER = DeadlineScheduler(interval_sec, speed_factor, LATE_POLICY)
+
 def on_message_speedfactor(client, userdata, msg):
     global speed_factor
     new_speed_factor = float(msg.payload.decode("utf-8"))
     if speed_factor >= 1:
         speed_factor = new_speed_factor
+        SCHEDULER.set_speed_factor(speed_factor)
+
+def send_telemetry_msg(mqtt, tick, ts_iso, lag, missed):
+    data = {
+        "tick": tick, # index of the published tick, the first tick is 0
+        "timestamp": ts_iso,
+        "lag": round(lag, 6), # seconds between scheduled and actual publish time
+        "missed": missed, # deadlines the generator is behind (catchup) or has skipped (skip)
+        "speed_factor": speed_factor
+    }
+    mqtt.publish_json(TELEMETRY_TOPIC, data)
+
+def send_tick_window_msg(mqtt, tick_minutes):
+    """
+    Announces the timestamps of the next WINDOW_SIZE ticks in one message,
+    so the weather and power chain can calculate the whole window at once.
+    """
+    timestamps = [(START_DATE + timedelta(minutes=tick_minutes + TICK_MINUTES * i)).isoformat() for i in range(WINDOW_SIZE)]
+    mqtt.publish_json(TICK_WINDOW_TOPIC, {"timestamps": timestamps})
+
+def on_message_ack(client, userdata, msg, payload):
+    """
+    Callback function that processes the acknowledgements of the services.
+    Wakes up the main loop as soon as the last expected service has acknowledged the current tick.
+    """
+    with ACK_CONDITION:
+        # Acknowledgements for older ticks (e.g. after a timeout) are ignored
+        if payload["timestamp"] != CURRENT_TICK:
+            return
+        PENDING_ACKS.discard(payload["service"])
+        if not PENDING_ACKS:
+            ACK_CONDITION.notify_all()
+
+def publish_tick_and_wait(mqtt, ts_iso):
+    """
+    Publishes the tick and blocks until every registered service has acknowledged it
+    or the lockstep timeout passed.
+    """
+    global CURRENT_TICK, PENDING_ACKS
+
+    # Register the expected acknowledgements before publishing, so fast replies are not lost
+    with ACK_CONDITION:
+        CURRENT_TICK = ts_iso
+        PENDING_ACKS = set(LOCKSTEP_SERVICES)
+
+    mqtt.publish(TICK_TOPIC, ts_iso)
+
+    with ACK_CONDITION:
+        if not ACK_CONDITION.wait_for(lambda: not PENDING_ACKS, timeout=LOCKSTEP_TIMEOUT):
+            logging.warning(f"{ts_iso} Lockstep timeout, missing acknowledgements from: {sorted(PENDING_ACKS)}")
 
 def main():
     tick_sec = 0
@@ -40,17 +113,33 @@ def main():
     mqtt.publish(SPEEDFACTOR_TOPIC, speed_factor)
     mqtt.subscribe(SPEEDFACTOR_TOPIC)
     mqtt.subscribe_with_callback(SPEEDFACTOR_TOPIC, on_message_speedfactor)
+    mqtt.subscribe(ACK_TOPIC)
+    mqtt.subscribe_with_callback(ACK_TOPIC, on_message_ack, decode=True)
 
+    SCHEDULER.start()
     try:
         while True:
             ts = START_DATE + timedelta(minutes=tick_minutes)
             print(ts)
             ts_iso = ts.isoformat()
 
+            if WINDOW_SIZE > 1 and (tick_minutes // TICK_MINUTES) % WINDOW_SIZE == 0:
+                send_tick_window_msg(mqtt, tick_minutes)
+
+            if MODE == "lockstep":
+                # Next tick is published as soon as all services finished the current one
+                publish_tick_and_wait(mqtt, ts_iso)
+                tick_minutes = tick_minutes + TICK_MINUTES
+                continue
+
+            # Wait for the absolute deadline of the tick instead of sleeping a fixed interval
+            scheduled, missed = SCHEDULER.wait_next()
             mqtt.publish(TICK_TOPIC, ts_iso)
+            tick = SCHEDULER.tick # tick_published moves on to the next tick
+            lag = SCHEDULER.tick_published(scheduled)
+            send_telemetry_msg(mqtt, tick, ts_iso, lag, missed)
             #tick_sec = tick_sec + 30
-            tick_minutes = tick_minutes + 15
-            time.sleep(interval_sec * (1.0 / speed_factor))
+            tick_minutes = tick_minutes + TICK_MINUTES
     except(KeyboardInterrupt, SystemExit):
         mqtt.stop()
         sys.exit("KeyboardInterrupt -- shutdown gracefully.")
@@ -0,0 +1,79 @@
+import threading
+import time
+
+class DeadlineScheduler:
+    """
+    Schedules ticks on absolute deadlines of the monotonic clock.
+    The time spent on publishing does not add up to drift, because every deadline
+    is calculated from the anchor and not from the end of the previous tick.
+    """
+    POLICIES = ['catchup', 'skip']
+
+    def __init__(self, interval_sec, speed_factor, policy='catchup'):
+        if policy not in self.POLICIES:
+            raise SystemExit(f"Unknown late tick policy {policy}, use one of {self.POLICIES}")
+        self.lock = threading.Lock()
+        self.changed = threading.Event() # set when the schedule was rebased
+
+        self.interval_sec = interval_sec
+        self.speed_factor = speed_factor
+        self.policy = policy
+
+        self.tick = 0 # index of the next tick
+        self.anchor_tick = 0
+        self.anchor_time = time.monotonic()
+
+    def period(self):
+        """Real time between two ticks in seconds."""
+        return self.interval_sec / self.speed_factor
+
+    def deadline(self, tick):
+        """Absolute monotonic time the tick is scheduled for."""
+        return self.anchor_time + (tick - self.anchor_tick) * self.period()
+
+    def start(self):
+        """Schedules the first tick for now."""
+        with self.lock:
+            self.anchor_tick = self.tick
+            self.anchor_time = time.monotonic()
+
+    def set_speed_factor(self, speed_factor):
+        """Rebases the schedule on the last tick, so the new speed factor applies to the next deadline."""
+        with self.lock:
+            last_deadline = self.deadline(self.tick - 1)
+            self.speed_factor = speed_factor
+            self.anchor_tick = self.tick - 1
+            self.anchor_time = last_deadline
+        self.changed.set()
+
+    def wait_next(self):
+        """
+        Blocks until the deadline of the next tick.
+        Returns the deadline the tick was scheduled for and the number of deadlines that were missed.
+        """
+        while True:
+            with self.lock:
+                scheduled = self.deadline(self.tick)
+            now = time.monotonic()
+            if now >= scheduled:
+                break
+            # wakes up early if the speed factor changes while waiting
+            self.changed.wait(scheduled - now)
+            self.changed.clear()
+
+        with self.lock:
+            period = self.period()
+            missed = int((now - scheduled) // period)
+            if missed > 0 and self.policy == 'skip':
+                # drop the missed deadlines and continue the schedule from now on
+                self.anchor_tick = self.tick
+                self.anchor_time = now
+                scheduled = now
+        return scheduled, missed
+
+    def tick_published(self, scheduled):
+        """Moves on to the next tick and returns the lag between scheduled and actual publish time in seconds."""
+        lag = time.monotonic() - scheduled
+        with self.lock:
+            self.tick += 1
+        return lag
@@ -0,0 +1,45 @@
+"""
+JSON codec of the MQTT payloads. Uses orjson or ujson if one of them is installed and the json module
+of the standard library otherwise. Data the fast library can not encode (e.g. numpy integers for ujson)
+falls back to the standard library, so every codec gives the same messages.
+"""
+import json
+
+try:
+    import orjson
+
+    NAME = "orjson"
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def encode(data):
+        try:
+            return orjson.dumps(data, option=OPTIONS)
+        except TypeError:
+            return json.dumps(data)
+
+    def decode(payload):
+        return orjson.loads(payload)
+
+except ImportError:
+    try:
+        import ujson
+
+        NAME = "ujson"
+
+        def encode(data):
+            try:
+                return ujson.dumps(data)
+            except (TypeError, OverflowError):
+                return json.dumps(data)
+
+        def decode(payload):
+            return ujson.loads(payload)
+
+    except ImportError:
+        NAME = "json"
+
+        def encode(data):
+            return json.dumps(data)
+
+        def decode(payload):
+            return json.loads(payload)
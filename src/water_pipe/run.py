@@ -1,10 +1,13 @@
 import sys
-import json
 import logging
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
 import math
 import os
-from collections import namedtuple
+import threading
+import numpy as np
+from stage_deadline import StageDeadline
+from allocator import Allocator
 
 def getenv_or_exit(env_name, default="default"):
     value = os.getenv(env_name, default)
@@ -14,93 +17,131 @@ def getenv_or_exit(env_name, default="default"):
 
 TICK = getenv_or_exit('TOPIC_TICK_GEN_TICK', 'default')
 TOPIC_REQUEST = getenv_or_exit('TOPIC_WATER_PIPE_WATER_REQUEST', "default") # Topic to request water from water pipe with
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+TOPIC_STAGE_METRICS = getenv_or_exit('TOPIC_STAGE_METRICS', 'default') # Topic for late and missing plants of a stage
+SERVICE_NAME = "water_pipe"
 
 WATER_SUPPLY = float(getenv_or_exit('WATER_PIPE_SUPPLY', 0.0)) # Water volume (in m^3) that can be supplied by the pipe
 PLANTS_NUMBER = int(getenv_or_exit('NUMBER_OF_FILTER_PLANTS', 0))
+REQUEST_DEADLINE = float(getenv_or_exit('WATER_PIPE_REQUEST_DEADLINE', -1.0)) # Seconds after the tick to wait for the requests
+ALLOCATOR = Allocator(getenv_or_exit('WATER_PIPE_ALLOCATION_POLICY', 'default')) # proportional, maxmin or weighted
 
 TIMESTAMP = 0
 AVAILABLE_WATER = 0 # total volume of water that can be supplied
 RECEIVED_REQUESTS = 0
 
-REQUEST_LIST = [] # A list to hold all requests
-REQUEST_CLASS = namedtuple("Request", ["plant_id", "reply_topic", "demand"]) # A data structure for requests
+# Requests of the tick, indexed by plant id (the arrays are reused every tick)
+PLANT_INDEX = {str(i): i for i in range(PLANTS_NUMBER)} # plant id -> index, requests of other ids are dropped
+DEMAND = np.zeros(PLANTS_NUMBER)
+PRIORITY = np.ones(PLANTS_NUMBER) # weight of the plant in the weighted policy
+REQUESTED = np.zeros(PLANTS_NUMBER, dtype=bool)
+REPLY_TOPICS = [""] * PLANTS_NUMBER
+
+LOCK = threading.RLock() # callbacks and the stage deadline run in different threads
 
 def send_reply_msg(client, reply_topic, timestamp, amount):
     data = {
         "timestamp": timestamp,  
         "amount": amount
     }
-    client.publish(reply_topic, json.dumps(data))
+    client.publish(reply_topic, encode(data))
+
+def send_ack_msg(client, timestamp):
+    """
+    Acknowledges the completion of the tick to the tick generator (lockstep mode only).
+    """
+    if LOCKSTEP:
+        client.publish(TOPIC_TICK_ACK, encode({"service": SERVICE_NAME, "timestamp": timestamp}))
 
-def default_supply_function(available_supply, total_demand, requests):
+def send_stage_metric(client, stage):
     """
-    Default function to calculate supply distribution.
+    Publishes the late and missing plants of the stage, if there are any.
     """
-    allocation = {}
-    if total_demand <= available_supply:
-        # If total demand can be satisfied, give everyone what they requested
-        for request in requests:
-            allocation[request.plant_id] = request.demand
-    else:
-        # Otherwise, distribute water proportionally to demands
-        for request in requests:
-            share = (request.demand / total_demand) * available_supply
-            allocation[request.plant_id] = round(share, 2)  # Round for simplicity
-    return allocation
-
-
-def calculate_and_publish_replies(client, supply_function=default_supply_function):
+    data = stage.metric(SERVICE_NAME)
+    if data is not None:
+        client.publish(TOPIC_STAGE_METRICS, encode(data))
+
+def complete_requests(client):
+    """
+    Completes the request stage of the tick, either by the last request or by the deadline.
+    """
+    if REQUEST_STAGE.complete():
+        send_stage_metric(client, REQUEST_STAGE)
+        calculate_and_publish_replies(client)
+
+REQUEST_STAGE = StageDeadline("water_requests", REQUEST_DEADLINE, [str(i) for i in range(PLANTS_NUMBER)], complete_requests, LOCK)
+
+def reset_requests():
+    global RECEIVED_REQUESTS
+
+    DEMAND.fill(0)
+    REQUESTED.fill(False)
+    RECEIVED_REQUESTS = 0
+
+def calculate_and_publish_replies(client, allocator=ALLOCATOR):
     """
     Calculates the supply for each requester and publishes the replies.
+    Plants without a request have no demand and get no reply.
     """
-    global REQUEST_LIST, RECEIVED_REQUESTS, AVAILABLE_WATER, TIMESTAMP
+    global AVAILABLE_WATER, TIMESTAMP
 
-    if not REQUEST_LIST:
+    if not REQUESTED.any():
         print("No requests to process.")
+        send_ack_msg(client, TIMESTAMP)
         return
 
-    # Calculate the total demand
-    total_demand = sum(request.demand for request in REQUEST_LIST)
+    allocation = allocator.allocate(AVAILABLE_WATER, DEMAND, PRIORITY)
 
-    # Use the supplied supply function to calculate allocation
-    allocation = supply_function(AVAILABLE_WATER, total_demand, REQUEST_LIST)
+    for i in np.flatnonzero(REQUESTED):
+        send_reply_msg(client, REPLY_TOPICS[i], TIMESTAMP, round(float(allocation[i]), 2))
 
-    # Publish replies (simulate publishing with print statements for now)
-    for request in REQUEST_LIST:
-        supply = allocation.get(request.plant_id, 0)
+    reset_requests()
 
-        send_reply_msg(client, request.reply_topic, TIMESTAMP, supply)
+    send_ack_msg(client, TIMESTAMP)
 
-    # Clear the REQUESTS list after processing
-    REQUEST_LIST.clear()
-    RECEIVED_REQUESTS = 0
-
-def add_request(plant_id, reply_topic, demand):
-    global RECEIVED_REQUESTS, REQUEST_LIST, REQUEST_CLASS
+def add_request(plant_id, reply_topic, demand, priority=1.0):
+    global RECEIVED_REQUESTS
 
-    REQUEST_LIST.append(REQUEST_CLASS(plant_id, reply_topic, demand))
-    RECEIVED_REQUESTS += 1
+    i = PLANT_INDEX[plant_id]
+    if not REQUESTED[i]:
+        RECEIVED_REQUESTS += 1
+    DEMAND[i] = demand
+    PRIORITY[i] = priority
+    REQUESTED[i] = True
+    REPLY_TOPICS[i] = reply_topic
 
 def on_message_tick(client, userdata, msg):
     global TIMESTAMP, WATER_SUPPLY, AVAILABLE_WATER, RECEIVED_REQUESTS
      
-    TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp 
-    AVAILABLE_WATER = WATER_SUPPLY # update available water
-    RECEIVED_REQUESTS = 0 # update reqeust number
+    with LOCK:
+        TIMESTAMP = msg.payload.decode("utf-8") # extract the timestamp 
+        AVAILABLE_WATER = WATER_SUPPLY # update available water
+        reset_requests() # requests left over from a tick whose replies were never sent
+        REQUEST_STAGE.start(TIMESTAMP, client)
 
-def on_message_request(client, userdata, msg):
+def on_message_request(client, userdata, msg, payload):
     """
     Callback function that processes messages from the request topic.
     """
     
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
     timestamp = payload["timestamp"]
-    plant_id = payload["plant_id"]
+    plant_id = str(payload["plant_id"])
     reply_topic = payload["reply_topic"] # topic to publish the supplied water to
     demand = payload["amount"]
+    priority = payload.get("priority", 1.0) # optional weight for the weighted policy
+    if plant_id not in PLANT_INDEX:
+        logging.warning(f"Dropped water request of unknown plant {plant_id!r}, expected the ids 0 .. {PLANTS_NUMBER - 1}")
+        return
 
-    add_request(plant_id, reply_topic, demand)
+    with LOCK:
+        if not REQUEST_STAGE.report(timestamp, plant_id):
+            return
+        add_request(plant_id, reply_topic, demand, priority)
+        # the last expected request completes the tick, otherwise the deadline does
+        if RECEIVED_REQUESTS >= PLANTS_NUMBER:
+            complete_requests(client)
 
 def main():
     """
@@ -114,15 +155,12 @@ def main():
     mqtt.subscribe(TICK)
     mqtt.subscribe(TOPIC_REQUEST)
     mqtt.subscribe_with_callback(TICK, on_message_tick)
-    mqtt.subscribe_with_callback(TOPIC_REQUEST, on_message_request)
+    mqtt.subscribe_with_callback(TOPIC_REQUEST, on_message_request, decode=True)
     
     try:
-        # Start the MQTT loop to process incoming and outgoing messages
-        while True:
-            if RECEIVED_REQUESTS >= PLANTS_NUMBER:
-                calculate_and_publish_replies(mqtt)
-            
-            mqtt.loop(0.05) # loop every 50ms
+        # Start the MQTT loop to process incoming and outgoing messages,
+        # the replies are sent from the callback that receives the last request
+        mqtt.loop_forever()
     except (KeyboardInterrupt, SystemExit):
         # Gracefully stop the MQTT client and exit the program on interrupt
         mqtt.stop()
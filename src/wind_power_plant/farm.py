@@ -0,0 +1,31 @@
+import csv
+import numpy as np
+from power_curve import PowerCurve
+
+COLUMNS = ["id", "name", "model", "rated_power", "rotor_diameter", "upper_cut_out_wind_speed", "lower_cut_out_wind_speed"]
+NUMERIC_COLUMNS = ["rated_power", "rotor_diameter", "upper_cut_out_wind_speed", "lower_cut_out_wind_speed"]
+
+def load_turbines(path):
+    """
+    Reads the turbine table (csv with the header COLUMNS, one row per turbine).
+    Returns a dict with one numpy array per column.
+    """
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    if not rows:
+        raise SystemExit(f"Turbine table {path} is empty")
+    missing = [column for column in COLUMNS if column not in rows[0]]
+    if missing:
+        raise SystemExit(f"Turbine table {path} misses the columns {missing}")
+
+    turbines = {column: np.array([row[column].strip() for row in rows]) for column in ["id", "name", "model"]}
+    for column in NUMERIC_COLUMNS:
+        turbines[column] = np.array([float(row[column]) for row in rows])
+    return turbines
+
+def farm_power_curve(turbines):
+    """
+    Power curves of all turbines of the table, so every tick is one vectorized lookup.
+    """
+    return PowerCurve(turbines["model"].tolist(), turbines["rotor_diameter"], turbines["rated_power"],
+                      turbines["upper_cut_out_wind_speed"], turbines["lower_cut_out_wind_speed"])
@@ -0,0 +1,85 @@
+import numpy as np
+
+KMH_IN_MS = 1000/3600
+WATT_IN_KILOWATT = 1000
+
+WINDSPEED_STEP = 0.01 # m/s, resolution of the precomputed power curve
+MAX_WINDSPEED = 60.0 # m/s, the curve is extended with its last value above
+NOISE = 100 # kW, random deviation of the power output of a running turbine
+
+# Turbine model catalog, keyed by POWER_PLANT_<ID>_MODEL.
+# cp: power coefficient at 0, 1, 2, ... m/s (interpolated in between), cut_in: m/s
+MODELS = {
+    "E126": {
+        "cp": [0.0, 0.12,0.29,0.4,0.43,0.46,0.48,0.49,0.5,0.49,0.44,0.39,0.35,0.3,0.26,0.22,0.19,0.16,0.14,0.12,0.1,0.09,0.08,0.07,0.06],
+        "cut_in": 3.0,
+    },
+    "E82": {
+        "cp": [0.0, 0.0, 0.12,0.29,0.4,0.43,0.46,0.48,0.49,0.48,0.45,0.39,0.32,0.27,0.22,0.18,0.15,0.12,0.1,0.09,0.07,0.06,0.05,0.04,0.04,0.03],
+        "cut_in": 2.5,
+    },
+}
+
+def model_curve(model):
+    """
+    Power per rotor area and air density (kW per m² per kg/m³) of the model on the windspeed grid.
+    The power is linear in both, so one curve per model is enough for every turbine size and air density.
+    """
+    if model not in MODELS:
+        raise SystemExit(f"Unknown turbine model {model}, use one of {list(MODELS)}")
+    windspeed = np.arange(0, MAX_WINDSPEED + WINDSPEED_STEP, WINDSPEED_STEP)
+    cp = np.interp(windspeed, np.arange(len(MODELS[model]["cp"])), MODELS[model]["cp"])
+    curve = 0.5*np.power(windspeed, 3)*cp/WATT_IN_KILOWATT
+    curve[windspeed < MODELS[model]["cut_in"]] = 0.0
+    return curve
+
+class PowerCurve:
+    """
+    Precomputed power curves of one or more turbines.
+    A tick is an interpolated table lookup for all turbines at once.
+    Every turbine stops above its upper cut-out windspeed and only starts again
+    once the windspeed dropped below its lower cut-out windspeed (hysteresis).
+    """
+
+    def __init__(self, models, rotor_diameters, rated_powers, upper_cut_out, lower_cut_out):
+        names = sorted(set(models))
+        self.curves = np.stack([model_curve(model) for model in names]) # model x windspeed
+        self.model_index = np.array([names.index(model) for model in models])
+        self.area = np.pi*np.power(np.asarray(rotor_diameters, dtype=np.float64)/2, 2)
+        self.rated_power = np.asarray(rated_powers, dtype=np.float64)
+        self.upper_cut_out = np.asarray(upper_cut_out, dtype=np.float64)
+        self.lower_cut_out = np.asarray(lower_cut_out, dtype=np.float64)
+        self.stopped = np.zeros(len(models), dtype=bool) # turbines shut down by the cut-out
+
+    def lookup(self, windspeed):
+        """Linear interpolation of the curves at windspeed (m/s, one per turbine)."""
+        position = np.clip(windspeed / WINDSPEED_STEP, 0, self.curves.shape[1] - 1)
+        index = np.minimum(position.astype(np.int64), self.curves.shape[1] - 2)
+        fraction = position - index
+        low = self.curves[self.model_index, index]
+        high = self.curves[self.model_index, index + 1]
+        return low + (high - low)*fraction
+
+    def power(self, density, windspeed, rng):
+        """
+        Power output (kW) of every turbine for one tick, windspeed in km/h like the climate data.
+        Running turbines get random noise: up to NOISE more below the rated power, up to NOISE less than
+        the rated power above it. The power is then limited to 0 .. rated power, so small turbines
+        do not get a negative output.
+        """
+        windspeed = np.broadcast_to(np.asarray(windspeed, dtype=np.float64)*KMH_IN_MS, self.stopped.shape)
+        self.stopped = np.where(self.stopped, windspeed >= self.lower_cut_out, windspeed > self.upper_cut_out)
+
+        power = self.area*density*self.lookup(windspeed)
+        running = ~self.stopped & (power > 0)
+        noise = rng.integers(0, NOISE, size=power.shape, endpoint=True)
+        power = np.where(power + noise > self.rated_power, self.rated_power - noise, power + noise)
+        return np.where(running, np.round(np.clip(power, 0, self.rated_power), 2), 0.0)
+
+    def power_window(self, density, windspeed, rng):
+        """
+        Power output of every turbine for a tick window, shape turbine x tick.
+        The ticks are calculated in order, because the cut-out state carries over from tick to tick.
+        """
+        columns = [self.power(d, w, rng) for d, w in zip(density, windspeed)]
+        return np.stack(columns, axis=-1)
@@ -1,10 +1,11 @@
 import sys
-import json
 import logging
 from mqtt.mqtt_wrapper import MQTTWrapper
-import math
+from mqtt.codec import encode
 import os
-from random import seed, randint
+import numpy as np
+from farm import load_turbines, farm_power_curve
+from power_curve import PowerCurve
 
 def getenv_or_exit(env_name, default="default"):
     value = os.getenv(env_name, default)
@@ -13,45 +14,113 @@ def getenv_or_exit(env_name, default="default"):
     return value
 
 ID = getenv_or_exit("ID", "default")
+# "turbine": one power plant per container, "farm": all turbines of a turbine table in one container
+TYPE = getenv_or_exit("POWER_PLANT_" + ID + "_TYPE", "default")
+if TYPE not in ["turbine", "farm"]:
+    raise SystemExit(f"Unknown power plant type {TYPE}, use turbine or farm")
 
-UPPER_CUT_OUT_WIND_SPEED = float(getenv_or_exit("POWER_PLANT_" + ID + "_UPPER_CUT_OUT_WIND_SPEED", "0.0")) 
-LOWER_CUT_OUT_WIND_SPEED = float(getenv_or_exit("POWER_PLANT_" + ID + "_LOWER_CUT_OUT_WIND_SPEED", "0.0"))
+RNG = np.random.default_rng()
 
-KMH_IN_MS = 1000/3600
-WATT_IN_KILOWATT = 1000
-PERCENT = 100
-POW2 = 2
-POW3 = 3
-SEED = 42
-
-CP = [0.0, 0.12,0.29,0.4,0.43,0.46,0.48,0.49,0.5,0.49,0.44,0.39,0.35,0.3,0.26,0.22,0.19,0.16,0.14,0.12,0.1,0.09,0.08,0.07,0.06]
-
-def calc_area(diameter):
-    return math.pi*math.pow(diameter/2,POW2)
-
-def calc_power(area, density, windspeed):
-    global CP
-    cp = 0
-    if windspeed < 26:
-        cp = CP[int(windspeed)%len(CP)]
-    else:
-        cp = 0
-    cp = 0.5
-    return (0.5*area*density*math.pow(windspeed*KMH_IN_MS,POW3)*cp)/WATT_IN_KILOWATT
-
-MODEL = getenv_or_exit("POWER_PLANT_" + ID + "_MODEL", "default")
-ROTOR_DIAMETER = float(getenv_or_exit("POWER_PLANT_" + ID + "_ROTOR_DIAMETER", 0.0)) #meter
-AREA = calc_area(ROTOR_DIAMETER)
-RATED_POWER = float(getenv_or_exit("POWER_PLANT_" + ID + "_RATED_POWER", 0.0)) #kW
 NAME = getenv_or_exit("POWER_PLANT_" + ID + "_NAME", "default")
+if TYPE == "turbine":
+    UPPER_CUT_OUT_WIND_SPEED = float(getenv_or_exit("POWER_PLANT_" + ID + "_UPPER_CUT_OUT_WIND_SPEED", "0.0")) 
+    LOWER_CUT_OUT_WIND_SPEED = float(getenv_or_exit("POWER_PLANT_" + ID + "_LOWER_CUT_OUT_WIND_SPEED", "0.0"))
+    MODEL = getenv_or_exit("POWER_PLANT_" + ID + "_MODEL", "default")
+    ROTOR_DIAMETER = float(getenv_or_exit("POWER_PLANT_" + ID + "_ROTOR_DIAMETER", 0.0)) #meter
+    RATED_POWER = float(getenv_or_exit("POWER_PLANT_" + ID + "_RATED_POWER", 0.0)) #kW
+    # Power curve of the model, precomputed once (see power_curve.py)
+    CURVE = PowerCurve([MODEL], [ROTOR_DIAMETER], [RATED_POWER], [UPPER_CUT_OUT_WIND_SPEED], [LOWER_CUT_OUT_WIND_SPEED])
+else:
+    TURBINES = load_turbines(getenv_or_exit("POWER_PLANT_" + ID + "_TURBINE_TABLE", "default"))
+    CURVE = farm_power_curve(TURBINES)
+    # "per_turbine": one message per turbine on the power topic + turbine id,
+    # "farm": one message with the summed power on the power topic + farm id (counts as one power plant in wind_power_sum)
+    FARM_PUBLISH = getenv_or_exit("POWER_PLANT_" + ID + "_FARM_PUBLISH", "default")
+    if FARM_PUBLISH not in ["per_turbine", "farm"]:
+        raise SystemExit(f"Unknown farm publish mode {FARM_PUBLISH}, use per_turbine or farm")
 
 # MQTT topic for publishing sensor data
-TOPIC_WIND_POWER_DATA = getenv_or_exit("TOPIC_POWER_PLANT_POWER_DATA", "default") + ID # must be followed by the power plant id
+POWER_DATA = getenv_or_exit("TOPIC_POWER_PLANT_POWER_DATA", "default")
+POWER_DATA_WINDOW = getenv_or_exit("TOPIC_POWER_PLANT_POWER_DATA_WINDOW", "default")
+TOPIC_WIND_POWER_DATA = POWER_DATA + ID # must be followed by the power plant id
+TOPIC_WIND_POWER_DATA_WINDOW = POWER_DATA_WINDOW + ID # must be followed by the power plant id
+if TYPE == "farm" and FARM_PUBLISH == "per_turbine":
+    # Every turbine publishes like a single power plant with its id from the turbine table.
+    # The turbine ids take the place of the farm id, so they must not belong to other power plants
+    # and wind_power_sum only reads them if they are below POWER_SUM_COUNT_POWER_GEN.
+    TURBINE_IDS = TURBINES["id"].tolist()
+    COUNT_POWER_GEN = int(getenv_or_exit("POWER_SUM_COUNT_POWER_GEN", -1))
+    taken = [turbine_id for turbine_id in TURBINE_IDS if turbine_id != ID and os.getenv("POWER_PLANT_" + turbine_id + "_TYPE") is not None]
+    if taken:
+        raise SystemExit(f"Turbine ids {taken} are used by other power plants, renumber the turbine table")
+    uncounted = [turbine_id for turbine_id in TURBINE_IDS if not (turbine_id.isdigit() and int(turbine_id) < COUNT_POWER_GEN)]
+    if uncounted:
+        raise SystemExit(f"Turbine ids {uncounted} are not read by wind_power_sum, raise POWER_SUM_COUNT_POWER_GEN ({COUNT_POWER_GEN}) to cover them")
+    TOPIC_TURBINE_POWER_DATA = [POWER_DATA + turbine_id for turbine_id in TURBINE_IDS]
+    TOPIC_TURBINE_POWER_DATA_WINDOW = [POWER_DATA_WINDOW + turbine_id for turbine_id in TURBINE_IDS]
 
 # MQTT topic for receiving tick messages
 CLIMATE_DATA = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA", "default")
+CLIMATE_DATA_WINDOW = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA_WINDOW", "default")
+CLIMATE_DATA_SITES = getenv_or_exit("TOPIC_CLIMATE_GEN_CLIMATE_DATA_SITES", "default")
+
+# Weather station of the plant, only used if the climate generator serves several sites
+NUMBER_OF_SITES = int(getenv_or_exit("CLIMATE_GEN_NUMBER_OF_SITES", -1))
+SITE_PUBLISH = getenv_or_exit("CLIMATE_GEN_SITE_PUBLISH", "default")
+if NUMBER_OF_SITES > 0:
+    SITE = getenv_or_exit("POWER_PLANT_" + ID + "_SITE", "default")
+    CLIMATE_DATA = CLIMATE_DATA + SITE
+    CLIMATE_DATA_WINDOW = CLIMATE_DATA_WINDOW + SITE
 
-def on_message_weather(client, userdata, msg):
+def calc_power_output(density, windspeed):
+    """
+    Power output of the plant with random noise, limited to the rated power.
+    """
+    return float(CURVE.power(density, windspeed, RNG)[0])
+
+def publish_farm_power(client, power, timestamp):
+    """
+    Publishes the power of all turbines of the farm for one tick.
+    """
+    if FARM_PUBLISH == "per_turbine":
+        for turbine_id, topic, turbine_power in zip(TURBINES["id"].tolist(), TOPIC_TURBINE_POWER_DATA, power.tolist()):
+            client.publish(topic, encode({"id": turbine_id, "power": turbine_power, "timestamp": timestamp}))
+    else:
+        data = {"id": ID, "power": round(float(power.sum()), 2), "turbines": len(power), "timestamp": timestamp}
+        client.publish(TOPIC_WIND_POWER_DATA, encode(data))
+
+def publish_farm_power_window(client, power, timestamps):
+    """
+    Publishes the power of all turbines of the farm for a tick window (power: turbine x tick).
+    """
+    if FARM_PUBLISH == "per_turbine":
+        for turbine_id, topic, turbine_power in zip(TURBINES["id"].tolist(), TOPIC_TURBINE_POWER_DATA_WINDOW, power.tolist()):
+            client.publish(topic, encode({"id": turbine_id, "power": turbine_power, "timestamps": timestamps}))
+    else:
+        data = {"id": ID, "power": np.round(power.sum(axis=0), 2).tolist(), "turbines": len(power), "timestamps": timestamps}
+        client.publish(TOPIC_WIND_POWER_DATA_WINDOW, encode(data))
+
+def calc_plant_power(density, windspeed):
+    """
+    Power output of the plant, an array over all turbines in farm mode.
+    """
+    if TYPE == "farm":
+        # All turbines in one vectorized call
+        return CURVE.power(density, windspeed, RNG)
+    return calc_power_output(density, windspeed)
+
+def publish_power(client, power, timestamp):
+    """
+    Publishes the power output of one tick.
+    """
+    if TYPE == "farm":
+        publish_farm_power(client, power, timestamp)
+        return
+    data = {"id": ID, "power": power, "timestamp": timestamp}
+    # Publish the data to the chaos sensor topic in JSON format
+    client.publish(TOPIC_WIND_POWER_DATA, encode(data))
+
+def on_message_weather(client, userdata, msg, payload):
     """
     Callback function that processes messages from the tick generator topic.
     It generates a random sensor value and publishes it along with the tick's timestamp.
@@ -62,11 +131,9 @@ def on_message_weather(client, userdata, msg):
     msg (MQTTMessage): The message containing the tick timestamp
     """
     global TOPIC_WIND_POWER_DATA
-    global AREA
-    global RATED_POWER
+    global CURVE
     global ID
     
-    payload = json.loads(msg.payload) 
     timestamp = payload["timestamp"]
     density = payload["density"]
     temperature = payload["temperature"]
@@ -75,13 +142,29 @@ def on_message_weather(client, userdata, msg):
     # Important: Always send your data with the timestamp from the Tick message.
     # Node Red is designed for real-time or historical messages, so discrepancies 
     # in timestamps can cause errors in the display.
-    power = round(calc_power(AREA, density, windspeed),2)+randint(0, 100)
-    if power > RATED_POWER:
-        print(f"Actual power output {power} exceeds rated power output {RATED_POWER}")
-        power = RATED_POWER-randint(0, 100)
-    data = {"id": ID, "power": power, "timestamp": timestamp}
-    # Publish the data to the chaos sensor topic in JSON format
-    client.publish(TOPIC_WIND_POWER_DATA, json.dumps(data))
+    power = calc_plant_power(density, windspeed)
+    publish_power(client, power, timestamp)
+
+def on_message_weather_sites(client, userdata, msg, payload):
+    """
+    Callback function that processes the batched climate data of all sites and picks the site of the plant.
+    """
+    site = payload["sites"].index(SITE)
+    power = calc_plant_power(payload["density"][site], payload["windspeed"][site])
+    publish_power(client, power, payload["timestamp"])
+
+def on_message_weather_window(client, userdata, msg, payload):
+    """
+    Callback function that processes the climate data of a whole tick window.
+    Publishes the power output for all timestamps of the window in one message.
+    """
+    if TYPE == "farm":
+        power = CURVE.power_window(payload["density"], payload["windspeed"], RNG)
+        publish_farm_power_window(client, power, payload["timestamps"])
+        return
+    power = [calc_power_output(density, windspeed) for density, windspeed in zip(payload["density"], payload["windspeed"])]
+    data = {"id": ID, "power": power, "timestamps": payload["timestamps"]}
+    client.publish(TOPIC_WIND_POWER_DATA_WINDOW, encode(data))
 
 def main():
     """
@@ -92,10 +175,17 @@ def main():
     # Initialize the MQTT client and connect to the broker
     mqtt = MQTTWrapper('mqttbroker', 1883, name='wind_power_plant_' + ID)
     
-    # Subscribe to the tick topic
-    mqtt.subscribe(CLIMATE_DATA)
-    # Subscribe with a callback function to handle incoming tick messages
-    mqtt.subscribe_with_callback(CLIMATE_DATA, on_message_weather)
+    if NUMBER_OF_SITES > 0 and SITE_PUBLISH == "batched":
+        # One message holds the climate data of all sites
+        mqtt.subscribe(CLIMATE_DATA_SITES)
+        mqtt.subscribe_with_callback(CLIMATE_DATA_SITES, on_message_weather_sites, decode=True)
+    else:
+        # Subscribe to the tick topic
+        mqtt.subscribe(CLIMATE_DATA)
+        # Subscribe with a callback function to handle incoming tick messages
+        mqtt.subscribe_with_callback(CLIMATE_DATA, on_message_weather, decode=True)
+    mqtt.subscribe(CLIMATE_DATA_WINDOW)
+    mqtt.subscribe_with_callback(CLIMATE_DATA_WINDOW, on_message_weather_window, decode=True)
     
     try:
         # Start the MQTT loop to process incoming and outgoing messages
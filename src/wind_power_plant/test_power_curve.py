@@ -0,0 +1,48 @@
+import numpy as np
+
+from power_curve import KMH_IN_MS, NOISE, PowerCurve
+
+def curve(rated, count=1000):
+    return PowerCurve(["E126"] * count, np.full(count, 127.0), np.full(count, rated), np.full(count, 28.0), np.full(count, 22.0))
+
+def windspeed(ms):
+    return ms / KMH_IN_MS # km/h like the climate data
+
+def test_power_within_rated_power():
+    rng = np.random.default_rng(0)
+    turbines = curve(7580.0)
+    for ms in [1, 4, 8, 12, 16, 20, 25]:
+        power = turbines.power(1.225, windspeed(ms), rng)
+        assert np.all(power >= 0)
+        assert np.all(power <= 7580.0)
+
+def test_noise_below_rated_power():
+    rng = np.random.default_rng(0)
+    turbines = curve(7580.0)
+    clean = 1.225 * turbines.area * turbines.lookup(np.full(1000, 6.0))
+    power = turbines.power(1.225, windspeed(6), rng)
+    assert np.all(power >= np.round(clean, 2))
+    assert np.all(power <= np.round(clean + NOISE, 2))
+
+def test_noise_at_rated_power():
+    # like the old plant, above the rated power the output is the rated power minus the noise
+    rng = np.random.default_rng(0)
+    power = curve(3000.0).power(1.225, windspeed(20), rng)
+    assert np.all(power <= 3000.0)
+    assert np.all(power >= 3000.0 - NOISE)
+    assert len(np.unique(power)) > 1
+
+def test_small_turbine_is_not_negative():
+    rng = np.random.default_rng(0)
+    power = curve(40.0).power(1.225, windspeed(20), rng)
+    assert np.all(power >= 0)
+    assert np.all(power <= 40.0)
+    assert np.any(power == 0)
+
+def test_cut_out_hysteresis():
+    rng = np.random.default_rng(0)
+    turbines = curve(7580.0, 1)
+    assert turbines.power(1.225, windspeed(20), rng)[0] > 0
+    assert turbines.power(1.225, windspeed(30), rng)[0] == 0 # above the upper cut-out
+    assert turbines.power(1.225, windspeed(25), rng)[0] == 0 # still stopped above the lower cut-out
+    assert turbines.power(1.225, windspeed(20), rng)[0] > 0
@@ -0,0 +1,38 @@
+COMPLETE = "complete"
+PENDING = "pending"
+DUPLICATE = "duplicate"
+LATE = "late"
+
+class RequestLedger:
+    """
+    Tracks which plants sent their request for the current tick.
+    Every request is O(1): a counter of outstanding requests and a set of the plants that reported.
+    Ticks are ordered by their ISO timestamps, a request for an older tick is rejected as late.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected # number of plants that send a request each tick
+        self.timestamp = None # tick that is collected at the moment
+        self.reported = set()
+        self.outstanding = expected
+
+    def add(self, timestamp, plant_id):
+        """
+        Records the request of the plant and returns COMPLETE, PENDING, DUPLICATE or LATE.
+        """
+        if self.timestamp is not None and timestamp < self.timestamp:
+            return LATE
+        if timestamp != self.timestamp:
+            # first request of a new tick, the requests still missing for the previous tick are dropped
+            self.timestamp = timestamp
+            self.reported = set()
+            self.outstanding = self.expected
+        if plant_id in self.reported:
+            return DUPLICATE
+        self.reported.add(plant_id)
+        self.outstanding -= 1
+        return COMPLETE if self.outstanding == 0 else PENDING
+
+    def missing(self):
+        """Number of requests still missing for the current tick."""
+        return self.outstanding
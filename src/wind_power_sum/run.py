@@ -1,9 +1,11 @@
 import sys
-import json
 import logging
 from random import seed, randint
 from mqtt.mqtt_wrapper import MQTTWrapper
+from mqtt.codec import encode
 import os
+from rolling_stats import parse_windows
+from statemanager import StateManager, FILTER_PLANT, HYDROGEN_PLANT
 
 TEST = False
 TEST_DATA = {"payload": "THIS IS A BASE TEST!"}
@@ -16,12 +18,6 @@ def getenv_or_exit(env_name, default="default"):
         raise SystemExit(f"Environment variable {env_name} not set")
     return value
 
-PLANT_DATA = {}
-FILTER_PLANT = "filter_plant"
-HYDROGEN_PLANT = "hydrogen_plant"
-PLANT_DATA[FILTER_PLANT] = {}
-PLANT_DATA[HYDROGEN_PLANT] = {}
-
 COUNT_POWER_GEN = int(getenv_or_exit("POWER_SUM_COUNT_POWER_GEN", 0))
 COUNT_FILTER_PLANT = int(getenv_or_exit("NUMBER_OF_FILTER_PLANTS", 0))
 COUNT_HYDROGEN_PLANT = int(getenv_or_exit("NUMBER_OF_HYDROGEN_PLANTS", 0))
@@ -30,15 +26,28 @@ TICK = getenv_or_exit('TOPIC_TICK_GEN_TICK', 'default')
 TOPIC_ADAPTIVE_MODE = getenv_or_exit('TOPIC_ADAPTIVE_MODE', 'default')
 WIND_POWER_SUM_DATA = getenv_or_exit("TOPIC_POWER_SUM_POWER_SUM_DATA", "default")
 WIND_POWER_DATA = getenv_or_exit("TOPIC_POWER_PLANT_POWER_DATA", "default")
+WIND_POWER_SUM_DATA_WINDOW = getenv_or_exit("TOPIC_POWER_SUM_POWER_SUM_DATA_WINDOW", "default")
+WIND_POWER_DATA_WINDOW = getenv_or_exit("TOPIC_POWER_PLANT_POWER_DATA_WINDOW", "default")
+WINDOW_SIZE = int(getenv_or_exit("TICK_GEN_WINDOW_SIZE", -1))
 TOPIC_FILTER_REQUEST = getenv_or_exit("TOPIC_POWER_FILTER_POWER_DATA", "default")
 TOPIC_HYDROGEN_REQUEST = getenv_or_exit("TOPIC_POWER_HYDROGEN_POWER_DATA", "default")
 TOPIC_FILTER_KPIS = getenv_or_exit("TOPIC_FILTER_KPIS", "default")
 TOPIC_HYDROGEN_KPIS = getenv_or_exit("TOPIC_FILTER_KPIS", "default")
+STATS_WINDOWS = parse_windows(getenv_or_exit("ROLLING_STATS_WINDOWS", "default")) # name:ticks, the first window gives the mean
+DISPATCH_POLICY = getenv_or_exit("POWER_SUM_DISPATCH_POLICY", "default") # greedy, proportional or maxmin (adaptive mode always uses greedy by priority)
+DISPATCH_MIN_LOAD = float(getenv_or_exit("POWER_SUM_DISPATCH_MIN_LOAD", -1.0)) # share of its request a plant needs at least, otherwise it gets nothing
+JOIN_TIMEOUT = float(getenv_or_exit("POWER_SUM_JOIN_TIMEOUT", -1.0)) # seconds to wait for missing power plants of a tick
+JOIN_MAX_WINDOWS = int(getenv_or_exit("POWER_SUM_JOIN_MAX_WINDOWS", -1)) # ticks collected at the same time
+TOPIC_TICK_ACK = getenv_or_exit('TOPIC_TICK_GEN_ACK', 'default') # Topic to acknowledge the completion of a tick
+LOCKSTEP = getenv_or_exit('TICK_GEN_MODE', 'default') == "lockstep"
+SERVICE_NAME = "power_system"
 
 WIND_POWER_TOPIC_LIST = []
+WIND_POWER_WINDOW_TOPIC_LIST = []
 for j in range(COUNT_POWER_GEN):
     i = str(j)
     WIND_POWER_TOPIC_LIST.append(WIND_POWER_DATA+i)
+    WIND_POWER_WINDOW_TOPIC_LIST.append(WIND_POWER_DATA_WINDOW+i)
     
 FILTER_PLANT_TOPIC_LIST = []
 FILTER_KPIS_TOPIC_LIST = []
@@ -46,18 +55,6 @@ for j in range(COUNT_FILTER_PLANT):
     i = str(j)
     FILTER_PLANT_TOPIC_LIST.append(TOPIC_FILTER_REQUEST+i)
     FILTER_KPIS_TOPIC_LIST.append(TOPIC_FILTER_KPIS+i)
-    PLANT_DATA[FILTER_PLANT][i] = {}
-    PLANT_DATA[FILTER_PLANT][i]["reply_topic"] = ""
-    PLANT_DATA[FILTER_PLANT][i]["amount"] = 0
-    PLANT_DATA[FILTER_PLANT][i]["timestamp"] = i
-    PLANT_DATA[FILTER_PLANT][i]["status"] = "offline"
-    PLANT_DATA[FILTER_PLANT][i]["eff"] = 0.5
-    PLANT_DATA[FILTER_PLANT][i]["prod"] = 0.5
-    PLANT_DATA[FILTER_PLANT][i]["cper"] = 0.5
-    PLANT_DATA[FILTER_PLANT][i]["powersupply"] = 0
-    PLANT_DATA[FILTER_PLANT][i]["priority"] = 0
-    PLANT_DATA[FILTER_PLANT][i]["npower"] = 0
-    PLANT_DATA[FILTER_PLANT][i]["namount"] = 0
     
 HYDROGEN_PLANT_TOPIC_LIST = []
 HYDROGEN_KPIS_TOPIC_LIST = []
@@ -65,36 +62,22 @@ for j in range(COUNT_HYDROGEN_PLANT):
     i = str(j)
     HYDROGEN_PLANT_TOPIC_LIST.append(TOPIC_HYDROGEN_REQUEST+i)
     HYDROGEN_KPIS_TOPIC_LIST.append(TOPIC_FILTER_KPIS+i)
-    PLANT_DATA[HYDROGEN_PLANT][i] = {}
-    PLANT_DATA[HYDROGEN_PLANT][i]["reply_topic"] = ""
-    PLANT_DATA[HYDROGEN_PLANT][i]["amount"] = 0
-    PLANT_DATA[HYDROGEN_PLANT][i]["timestamp"] = i
-    PLANT_DATA[HYDROGEN_PLANT][i]["status"] = "offline"
-    PLANT_DATA[HYDROGEN_PLANT][i]["eff"] = 0.5
-    PLANT_DATA[HYDROGEN_PLANT][i]["prod"] = 0.5
-    PLANT_DATA[HYDROGEN_PLANT][i]["cper"] = 0.5
-    PLANT_DATA[HYDROGEN_PLANT][i]["powersupply"] = 0
-    PLANT_DATA[HYDROGEN_PLANT][i]["priority"] = 0
-    PLANT_DATA[HYDROGEN_PLANT][i]["npower"] = 0
-    PLANT_DATA[HYDROGEN_PLANT][i]["namount"] = 0
 
-SUM_POWER = 0
-POWER_COLLECTED = False
 WEIGHTS = [2/5,2/5,1/5]
-COUNT = 0
-MEAN_POWER = 0
-POWER_LIST = []
-COUNT_TICKS_MAX = 24*4
-COUNT_TICKS = 0
-for i in range(COUNT_TICKS_MAX):
-    POWER_LIST.append(0)
-ADAPTIVE = False
-FILTER_RATIO = 0.3 #FILTER_SUM_AMOUNT/(FILTER_SUM_AMOUNT+HYDROGEN_SUM_AMOUNT)
-HYDROGEN_RATIO = 1-FILTER_RATIO #HYDROGEN_SUM_AMOUNT/(FILTER_SUM_AMOUNT+HYDROGEN_SUM_AMOUNT)
-FILTER_SUM_AMOUNT = 0
-HYDROGEN_SUM_AMOUNT = 0
-FILTER_AVAILABLE_POWER = SUM_POWER*FILTER_RATIO
-HYDROGEN_AVAILABLE_POWER = SUM_POWER*HYDROGEN_RATIO
+# Holds the whole tick state, the callbacks below only parse the messages and publish the results
+STATE = StateManager(
+    COUNT_POWER_GEN,
+    {FILTER_PLANT: COUNT_FILTER_PLANT, HYDROGEN_PLANT: COUNT_HYDROGEN_PLANT},
+    STATS_WINDOWS, JOIN_TIMEOUT, JOIN_MAX_WINDOWS, DISPATCH_POLICY, DISPATCH_MIN_LOAD,
+    {"power_sum": WIND_POWER_SUM_DATA, "power_sum_window": WIND_POWER_SUM_DATA_WINDOW, "ack": TOPIC_TICK_ACK, "test": TETS_TOPIC},
+    SERVICE_NAME, LOCKSTEP)
+
+def publish_all(client, messages):
+    """
+    Publishes the messages returned by the state manager.
+    """
+    for topic, data in messages:
+        client.publish(topic, encode(data))
 
 def on_message_debug_mode(client, userdata, msg):
     global TEST
@@ -103,190 +86,83 @@ def on_message_debug_mode(client, userdata, msg):
         TEST = True
     else:
         TEST = False
+    STATE.set_debug(TEST)
 
 #MAIN
 def main():
     mqtt = MQTTWrapper('mqttbroker', 1883, name='wind_power_sum')   
+    # the join deadlines publish the power sums of ticks with missing power plants
+    STATE.set_publisher(lambda messages: publish_all(mqtt.client, messages))
     mqtt.subscribe(TOPIC_ADAPTIVE_MODE)
     mqtt.subscribe_with_callback(TOPIC_ADAPTIVE_MODE, on_message_adaptive_mode)
     mqtt.subscribe(TOPIC_DEBUG)
     mqtt.subscribe_with_callback(TOPIC_DEBUG, on_message_debug_mode)
     for topic in WIND_POWER_TOPIC_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_power)
+        mqtt.subscribe_with_callback(topic, on_message_power, decode=True)
+    if WINDOW_SIZE > 1:
+        # The power of each tick is taken from the summed up tick windows
+        mqtt.subscribe(TICK)
+        mqtt.subscribe_with_callback(TICK, on_message_tick)
+        for topic in WIND_POWER_WINDOW_TOPIC_LIST:
+            mqtt.subscribe(topic)
+            mqtt.subscribe_with_callback(topic, on_message_power_window, decode=True)
     for topic in FILTER_PLANT_TOPIC_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_request)
+        mqtt.subscribe_with_callback(topic, on_message_request, decode=True)
     for topic in HYDROGEN_PLANT_TOPIC_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_request)
+        mqtt.subscribe_with_callback(topic, on_message_request, decode=True)
     for topic in FILTER_KPIS_TOPIC_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_filter_kpi)
+        mqtt.subscribe_with_callback(topic, on_message_filter_kpi, decode=True)
     for topic in HYDROGEN_KPIS_TOPIC_LIST:
         mqtt.subscribe(topic)
-        mqtt.subscribe_with_callback(topic, on_message_hydrogen_kpi)
+        mqtt.subscribe_with_callback(topic, on_message_hydrogen_kpi, decode=True)
     
     try:
         mqtt.loop_forever()
     except (KeyboardInterrupt, SystemExit):
         mqtt.stop()
         sys.exit("KeyboardInterrupt -- shutdown gracefully.")
-
-def calc_mean():
-    global SUM_POWER, MEAN_POWER, POWER_LIST
-    summe = 0
-    count = 0
-    for i in range(COUNT_TICKS_MAX):
-        if POWER_LIST[i] > 0:
-            summe += POWER_LIST[i]
-            count += 1
-    if count > 0:
-        MEAN_POWER = round(summe / count, 2)
-    else:
-        MEAN_POWER = 0
-
-def get_prio(liste):
-    return liste[0]
-
-def calculate_supply(typ, sortByPrio = False):
-    global PLANT_DATA
-    global HYDROGEN_PLANT, HYDROGEN_AVAILABLE_POWER, HYDROGEN_SUM_AMOUNT, HYDROGEN_RATIO
-    global FILTER_PLANT, FILTER_AVAILABLE_POWER, FILTER_SUM_AMOUNT, FILTER_RATIO
-    result_list = []
-    for id in PLANT_DATA[typ].keys():
-        result_list.append([PLANT_DATA[typ][id]["priority"],typ,id,PLANT_DATA[typ][id]["amount"],PLANT_DATA[typ][id]["reply_topic"]])
-    if sortByPrio:
-        result_list.sort(key=get_prio,reverse=True)
-    if typ == FILTER_PLANT:
-        for e in result_list:
-            FILTER_SUM_AMOUNT += e[3]
-            if FILTER_AVAILABLE_POWER - e[3] >= 0:
-                FILTER_AVAILABLE_POWER = FILTER_AVAILABLE_POWER - e[3]
-            else:
-                e[3] = FILTER_AVAILABLE_POWER
-                FILTER_AVAILABLE_POWER = 0 
-        if FILTER_SUM_AMOUNT+HYDROGEN_SUM_AMOUNT > 0:
-            FILTER_RATIO = FILTER_SUM_AMOUNT/(FILTER_SUM_AMOUNT+HYDROGEN_SUM_AMOUNT)
-            HYDROGEN_RATIO = HYDROGEN_SUM_AMOUNT/(FILTER_SUM_AMOUNT+HYDROGEN_SUM_AMOUNT)
-    if typ == HYDROGEN_PLANT:
-        for e in result_list:
-            HYDROGEN_SUM_AMOUNT += e[3]
-            if HYDROGEN_AVAILABLE_POWER - e[3] >= 0:
-                HYDROGEN_AVAILABLE_POWER = HYDROGEN_AVAILABLE_POWER - e[3]
-            else:
-                e[3] = HYDROGEN_AVAILABLE_POWER
-                HYDROGEN_AVAILABLE_POWER = 0
-    return result_list
     
 def on_message_adaptive_mode(client, userdata, msg):
-    global ADAPTIVE
     boolean = msg.payload.decode("utf-8")
     if boolean == "true" or boolean == "1" or boolean == "I love Python" or boolean == "True":
-        ADAPTIVE = True
+        STATE.set_adaptive(True)
     else:
-        ADAPTIVE = False
+        STATE.set_adaptive(False)
     
+def on_message_power(client, userdata, msg, payload):
+    publish_all(client, STATE.add_power(payload["timestamp"], payload["id"], payload["power"]))
+
+def on_message_tick(client, userdata, msg):
+    """
+    Callback function that processes tick messages in tick window mode.
+    """
+    timestamp = msg.payload.decode("utf-8")
+    publish_all(client, STATE.add_tick(timestamp))
+
+def on_message_power_window(client, userdata, msg, payload):
+    """
+    Callback function that sums up the power of all power plants for a whole tick window.
+    """
+    publish_all(client, STATE.add_window_power(payload["timestamps"], payload["id"], payload["power"]))
+
+def on_message_filter_kpi(client, userdata, msg, payload):
+    STATE.update_kpi(FILTER_PLANT, payload)
     
-def on_message_power(client, userdata, msg):
-    global WIND_POWER_SUM_DATA
-    global COUNT, COUNT_TICKS_MAX, COUNT_TICKS
-    global SUM_POWER, MEAN_POWER, POWER_LIST, FILTER_AVAILABLE_POWER, HYDROGEN_AVAILABLE_POWER, POWER_COLLECTED
-    global COUNT_POWER_GEN
-
-    payload = json.loads(msg.payload) 
-    power = payload["power"]
-    timestamp = payload["timestamp"]
-    
-    if COUNT % COUNT_POWER_GEN == 0:
-        SUM_POWER = power
-        POWER_COLLECTED = False
-    else:
-        SUM_POWER += power
-        POWER_LIST[COUNT_TICKS] = SUM_POWER
-        COUNT_TICKS = (COUNT_TICKS + 1) % COUNT_TICKS_MAX
-    if COUNT == COUNT_POWER_GEN-1:
-        calc_mean()
-        # Extract the timestamp from the tick message and decode it from UTF-8
-        data = {"power": round(SUM_POWER,2), "mean_power": MEAN_POWER, "timestamp": timestamp}
-        # Publish the data to the chaos sensor topic in JSON format
-        client.publish(WIND_POWER_SUM_DATA, json.dumps(data))
-        FILTER_AVAILABLE_POWER = SUM_POWER*FILTER_RATIO
-        HYDROGEN_AVAILABLE_POWER = SUM_POWER*HYDROGEN_RATIO
-        POWER_COLLECTED = True
-        if TEST:
-            client.publish(TETS_TOPIC, json.dumps({"FILTER_AVAILABLE_POWER": FILTER_AVAILABLE_POWER,"HYDROGEN_AVAILABLE_POWER": HYDROGEN_AVAILABLE_POWER}))
-            client.publish(TETS_TOPIC, json.dumps({"FILTER_RATIO": FILTER_RATIO,"HYDROGEN_RATIO": HYDROGEN_RATIO}))
-    COUNT = (COUNT + 1) % COUNT_POWER_GEN
-
-def on_message_filter_kpi(client, userdata, msg):
-    global PLANT_DATA
-    payload = json.loads(msg.payload)
-    plant_id = payload["plant_id"]
-    if not plant_id in PLANT_DATA[FILTER_PLANT].keys():
-        PLANT_DATA[FILTER_PLANT][plant_id] = {}
-    PLANT_DATA[FILTER_PLANT][plant_id]["status"] = payload["status"]
-    PLANT_DATA[FILTER_PLANT][plant_id]["eff"] = payload["eff"]
-    PLANT_DATA[FILTER_PLANT][plant_id]["prod"] = payload["prod"]
-    PLANT_DATA[FILTER_PLANT][plant_id]["cper"] = payload["cper"]
-    #TODO if implementet, if "namount" in payload and "npower" in payload: can be removed
-    if "namount" in payload and "npower" in payload:
-        PLANT_DATA[FILTER_PLANT][plant_id]["namount"] = payload["namount"]
-        PLANT_DATA[FILTER_PLANT][plant_id]["npower"] = payload["npower"]
-        if payload["npower"] > 0:
-            PLANT_DATA[FILTER_PLANT][plant_id]["priority"] = payload["namount"]/payload["npower"]
-    
-def on_message_hydrogen_kpi(client, userdata, msg):
-    global PLANT_DATA
-    payload = json.loads(msg.payload)
-    plant_id = payload["plant_id"]
-    if not plant_id in PLANT_DATA[FILTER_PLANT].keys():
-        PLANT_DATA[HYDROGEN_PLANT][plant_id] = {}
-    PLANT_DATA[HYDROGEN_PLANT][plant_id]["status"] = payload["status"]
-    PLANT_DATA[HYDROGEN_PLANT][plant_id]["eff"] = payload["eff"]
-    PLANT_DATA[HYDROGEN_PLANT][plant_id]["prod"] = payload["prod"]
-    PLANT_DATA[HYDROGEN_PLANT][plant_id]["cper"] = payload["cper"]
-    #TODO if implementet, if "namount" in payload and "npower" in payload: can be removed
-    if "namount" in payload and "npower" in payload:
-        PLANT_DATA[HYDROGEN_PLANT][plant_id]["namount"] = payload["namount"]
-        PLANT_DATA[HYDROGEN_PLANT][plant_id]["npower"] = payload["npower"]
-        if payload["npower"] > 0:
-            PLANT_DATA[HYDROGEN_PLANT][plant_id]["priority"] = payload["namount"]/payload["npower"]
+def on_message_hydrogen_kpi(client, userdata, msg, payload):
+    STATE.update_kpi(HYDROGEN_PLANT, payload)
  
-def on_message_request(client, userdata, msg):
-    global PLANT_DATA, ADAPTIVE, FILTER_PLANT, HYDROGEN_PLANT
+def on_message_request(client, userdata, msg, payload):
     #extracting the timestamp and other data
-    payload = json.loads(msg.payload)
-    plant_id = payload["plant_id"]
     plant_typ = FILTER_PLANT
     if payload["reply_topic"].split("/")[3] == HYDROGEN_PLANT:
         plant_typ = HYDROGEN_PLANT
-    if not plant_id in PLANT_DATA[plant_typ].keys():
-        PLANT_DATA[plant_typ][plant_id] = {}
-    PLANT_DATA[plant_typ][plant_id]["reply_topic"] = payload["reply_topic"]
-    PLANT_DATA[plant_typ][plant_id]["amount"] = payload["amount"]
-    PLANT_DATA[plant_typ][plant_id]["timestamp"] = payload["timestamp"]
-    PLANT_DATA[plant_typ][plant_id]["powersupply"] = 0
-    all_request_receiced = True
-    for id in PLANT_DATA[plant_typ].keys():
-        all_request_receiced = all_request_receiced and (payload["timestamp"] == PLANT_DATA[plant_typ][id]["timestamp"])
-    if all_request_receiced:
-        result_list = calculate_supply(plant_typ, sortByPrio=ADAPTIVE)
-        send_supply_msg(client, result_list, payload["timestamp"])
-        if TEST:
-            client.publish(TETS_TOPIC, json.dumps({"SUPPLY_LIST": result_list}))
-
-def send_supply_msg(client, result_list, timestamp):
-    global PLANT_DATA, FILTER_SUM_AMOUNT, FILTER_PLANT
-    for e in result_list:
-        if e[4] != "":
-            data = {
-                "timestamp": timestamp,
-                "amount": e[3]
-            }
-            client.publish(e[4], json.dumps(data))
-            PLANT_DATA[e[1]][e[2]]["timestamp"] = 0
+    messages = STATE.add_request(plant_typ, payload["plant_id"], payload["reply_topic"], payload["amount"], payload["timestamp"])
+    publish_all(client, messages)
 
 if __name__ == '__main__':
     # Entry point for the script
-    main()
\ No newline at end of file
+    main()
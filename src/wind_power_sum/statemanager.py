@@ -1,44 +1,282 @@
+import time
 import threading
+import logging
+import numpy as np
+from stream_join import WindowedJoin
+from rolling_stats import RollingStats
+from request_ledger import RequestLedger, COMPLETE, DUPLICATE, LATE
+from dispatch import allocate, split
+
+FILTER_PLANT = "filter_plant"
+HYDROGEN_PLANT = "hydrogen_plant"
 
 class StateManager:
+    """
+    Per-tick state engine of the power system.
+
+    Every tick runs through WAITING_FOR_RESSOURCES (the power of the tick is still being summed up)
+    and PROCESSING_REQUESTS (the power is known, every plant type is supplied as soon as all its
+    requests arrived). Requests that complete while waiting are supplied once the power arrives.
+    A message of a newer tick starts the next tick, pending requests of the old tick are then
+    supplied with the last known power.
+
+    All state lives here and every method holds the lock, so the MQTT callbacks only parse the
+    payload, call the manager and publish the returned (topic, data) messages outside the lock.
+    The deadlines of the power joins fire in timer threads, their messages go to the publisher
+    set with set_publisher.
+    """
     STATES = ['WAITING_FOR_RESSOURCES', 'PROCESSING_REQUESTS']
 
-    def __init__(self, count_gen):
-        self.lock = threading.Lock()
+    def __init__(self, count_gen, count_plants, stats_windows, join_timeout, join_max_windows,
+                 dispatch_policy, dispatch_min_load, topics, service_name, lockstep=False):
+        self.lock = threading.RLock()
         self.count_gen = count_gen # number of ressources generators
+        self.topics = topics # "power_sum", "power_sum_window", "ack" and "test"
+        self.service_name = service_name
+        self.lockstep = lockstep
+        self.dispatch_policy = dispatch_policy
+        self.dispatch_min_load = dispatch_min_load
+        self.adaptive = False
+        self.debug = False
+
+        self.timestamp = None # current tick
+        self.state = 'WAITING_FOR_RESSOURCES'
+        self.available_ressources = 0 # summed power of the last tick with known power
+        self.mean_power = 0
+        self.power_stats = RollingStats(stats_windows)
+        self.mean_window = next(iter(stats_windows))
+        # Sums up the power of all power plants per tick, independent of the order the messages arrive in
+        self.power_join = WindowedJoin(count_gen, join_timeout, join_max_windows)
+        # Same for tick windows, keyed by the timestamps of the window
+        self.window_join = WindowedJoin(count_gen, join_timeout, join_max_windows)
+        self.window_power = {} # timestamp -> summed power of a completed tick window
+        self.publisher = None # publishes the messages of the join deadlines
 
-        self.count = 0
-        self.available_ressources = 0
-        self.requests = [] # Request queue
+        self.plant_data = {}
+        self.ledgers = {} # requests of the current tick per plant type
+        for typ, count in count_plants.items():
+            self.plant_data[typ] = {str(i): self.default_plant() for i in range(count)}
+            self.ledgers[typ] = RequestLedger(count)
+        self.ready_types = [] # plant types with all requests of the tick, waiting for the power
+        self.supplied_types = set() # plant types that already received their supply in the current tick
+        self.filter_ratio = 0.3 # share of the filter plants in the demand of the last tick
+        self.tick_demand = {typ: None for typ in count_plants} # requested power per plant type (None before the first request)
+        self.tick_allocated = {typ: 0 for typ in count_plants} # power handed out per plant type in the current tick
 
-    def reset_tick(self):
-        """Resets available power and prepares for a new tick."""
+    @staticmethod
+    def default_plant():
+        return {"reply_topic": "", "amount": 0, "timestamp": 0, "status": "offline", "eff": 0.5, "prod": 0.5,
+                "cper": 0.5, "powersupply": 0, "priority": 0, "npower": 0, "namount": 0}
+
+    def set_adaptive(self, adaptive):
         with self.lock:
-            self.available_ressources = 0
-            self.count = 0
-            self.requests = []
+            self.adaptive = adaptive
 
-    def add_power(self, ressources_to_add):
-        """Adds power to the current tick and updates statistics."""
+    def set_debug(self, debug):
         with self.lock:
-            if self.count % self.count_gen == 0:
-                self.available_ressources = ressources_to_add
-            else:
-                self.available_ressources += ressources_to_add
-            self.count += 1
+            self.debug = debug
 
-    def add_request(self, topic, demand, timestamp):
-        """Queues a power request."""
+    def set_publisher(self, publisher):
         with self.lock:
-            self.requests.append((topic, demand, timestamp))
+            self.publisher = publisher
+
+    def start_tick(self, timestamp, messages):
+        """Transition to the next tick. Requests of the old tick that still wait for the power are supplied first."""
+        for typ in self.ready_types:
+            logging.warning(f"No power summed up for tick {self.timestamp}, supplying {typ} with the last known power")
+            self.supply(typ, messages)
+        self.timestamp = timestamp
+        self.state = 'WAITING_FOR_RESSOURCES'
+        self.ready_types = []
+        self.supplied_types = set()
+        self.tick_allocated = {typ: 0 for typ in self.tick_allocated}
 
-    def process_requests(self, mqtt_client):
-        """Handles all pending requests after collecting power for the tick."""
+    def observe(self, timestamp, messages):
+        """Starts the next tick if the message belongs to a newer one. Returns False for messages of older ticks."""
+        if self.timestamp is None or timestamp > self.timestamp:
+            self.start_tick(timestamp, messages)
+        return timestamp == self.timestamp
+
+    def add_power(self, timestamp, plant_id, power):
+        """Adds the power of a power plant to its tick."""
         with self.lock:
-            # Process queued requests
-            for topic, demand, timestamp in self.requests:
-                ressources_supplied = min(demand, self.available_ressources)
-                self.available_ressources -= ressources_supplied
+            messages = []
+            new = self.is_new(self.power_join, timestamp)
+            for result in self.power_join.add(timestamp, plant_id, power):
+                self.power_joined(*result, messages)
+            if new:
+                self.arm_deadline(self.power_join, timestamp, self.power_joined)
+            return messages
+
+    def add_window_power(self, timestamps, plant_id, power):
+        """Adds the power of a power plant to its tick window."""
+        with self.lock:
+            messages = []
+            window = tuple(timestamps)
+            new = self.is_new(self.window_join, window)
+            for result in self.window_join.add(window, plant_id, np.array(power)):
+                self.window_joined(*result, messages)
+            if new:
+                self.arm_deadline(self.window_join, window, self.window_joined)
+            return messages
+
+    @staticmethod
+    def is_new(join, key):
+        return key not in join.windows and key not in join.emitted
+
+    def arm_deadline(self, join, key, joined):
+        """
+        Arms the deadline of a new window, so a window with missing power plants is summed up
+        when its deadline passes and not only when the next power message arrives.
+        """
+        window = join.windows.get(key)
+        if window is None:
+            return # already complete
+        deadline = window[0]
+        timer = threading.Timer(max(deadline - time.monotonic(), 0), self.expire_join, args=(join, deadline, joined))
+        timer.daemon = True
+        timer.start()
+
+    def expire_join(self, join, deadline, joined):
+        """Sums up the windows whose deadline passed and publishes the result."""
+        with self.lock:
+            messages = []
+            for result in join.expire(max(time.monotonic(), deadline)):
+                joined(*result, messages)
+            publisher = self.publisher
+        if messages and publisher is not None:
+            publisher(messages)
+
+    def power_joined(self, timestamp, power, plants, complete, messages):
+        if not complete:
+            logging.warning(f"Power of tick {timestamp} summed up from {plants} of {self.count_gen} power plants")
+        self.power_summed(timestamp, power, messages)
+
+    def window_joined(self, window, power, plants, complete, messages):
+        if not complete:
+            logging.warning(f"Power of tick window {window[0]} summed up from {plants} of {self.count_gen} power plants")
+        power = np.round(power, 2).tolist()
+        messages.append((self.topics["power_sum_window"], {"power": power, "timestamps": list(window)}))
+        self.window_power.update(zip(window, power))
+        # the current tick gets its power now, the ticks of the window that are already over are dropped
+        for timestamp in window:
+            if self.timestamp is None or timestamp > self.timestamp:
+                continue
+            power = self.window_power.pop(timestamp)
+            if timestamp == self.timestamp:
+                self.power_summed(timestamp, power, messages)
+
+    def add_tick(self, timestamp):
+        """Starts a tick in tick window mode, its power is taken from the summed up window."""
+        with self.lock:
+            messages = []
+            if self.observe(timestamp, messages) and timestamp in self.window_power:
+                self.power_summed(timestamp, self.window_power.pop(timestamp), messages)
+            return messages
+
+    def power_summed(self, timestamp, power, messages):
+        """
+        The power of a tick is complete: publish it and supply the requests waiting for it.
+        The power of an older tick (e.g. a window that expired after the next tick completed) is dropped,
+        so it neither replaces the power of the current tick nor enters the statistics.
+        """
+        if not self.observe(timestamp, messages):
+            logging.warning(f"Dropped power of tick {timestamp}, current tick is {self.timestamp}")
+            return
+        self.available_ressources = power
+        self.power_stats.update(power)
+        # like the old calc_mean, ticks without power do not pull the mean down
+        self.mean_power = self.power_stats.mean(self.mean_window, 2, positive=True)
+        data = {"power": round(power, 2), "mean_power": self.mean_power, "stats": self.power_stats.stats(2), "timestamp": timestamp}
+        messages.append((self.topics["power_sum"], data))
+        if self.debug:
+            messages.append((self.topics["test"], {"FILTER_RATIO": self.filter_ratio, "HYDROGEN_RATIO": 1 - self.filter_ratio}))
+
+        self.state = 'PROCESSING_REQUESTS'
+        for typ in self.ready_types:
+            self.supply(typ, messages)
+        self.ready_types = []
+
+    def update_kpi(self, typ, payload):
+        with self.lock:
+            plant = self.plant_data[typ].setdefault(payload["plant_id"], self.default_plant())
+            plant["status"] = payload["status"]
+            plant["eff"] = payload["eff"]
+            plant["prod"] = payload["prod"]
+            plant["cper"] = payload["cper"]
+            #TODO if implementet, if "namount" in payload and "npower" in payload: can be removed
+            if "namount" in payload and "npower" in payload:
+                plant["namount"] = payload["namount"]
+                plant["npower"] = payload["npower"]
+                if payload["npower"] > 0:
+                    plant["priority"] = payload["namount"]/payload["npower"]
+
+    def add_request(self, typ, plant_id, reply_topic, amount, timestamp):
+        """Records the power request of a plant, the plant type is supplied once all its requests arrived."""
+        with self.lock:
+            messages = []
+            status = self.ledgers[typ].add(timestamp, plant_id)
+            if status == LATE or not self.observe(timestamp, messages):
+                logging.warning(f"Rejected late request of {typ} {plant_id} for tick {timestamp}, current tick is {self.timestamp}")
+                return messages
+            if status == DUPLICATE:
+                return messages
+            plant = self.plant_data[typ].setdefault(plant_id, self.default_plant())
+            plant["reply_topic"] = reply_topic
+            plant["amount"] = amount
+            plant["timestamp"] = timestamp
+            plant["powersupply"] = 0
+            if status == COMPLETE:
+                if self.state == 'PROCESSING_REQUESTS':
+                    self.supply(typ, messages)
+                else:
+                    self.ready_types.append(typ)
+            return messages
+
+    def supply(self, typ, messages):
+        """Distributes the power share of the plant type and acknowledges the tick once all types are supplied."""
+        result_list = self.calculate_supply(typ)
+        for _, _, plant_id, amount, reply_topic in result_list:
+            if reply_topic != "":
+                messages.append((reply_topic, {"timestamp": self.timestamp, "amount": amount}))
+                self.plant_data[typ][plant_id]["timestamp"] = 0
+        if self.debug:
+            messages.append((self.topics["test"], {"SUPPLY_LIST": result_list}))
+
+        self.supplied_types.add(typ)
+        if self.lockstep and len(self.supplied_types) == len(self.plant_data):
+            messages.append((self.topics["ack"], {"service": self.service_name, "timestamp": self.timestamp}))
+
+    def calculate_supply(self, typ):
+        """
+        Distributes the power share of the plant type among its plants (see dispatch.py).
+        The share follows the demand of both plant types in the current tick. If the other type was
+        already served in this tick, the type gets the power that is left.
+        """
+        plants = self.plant_data[typ]
+        ids = list(plants.keys())
+        demand = np.array([plants[id]["amount"] for id in ids], dtype=np.float64)
+        other = HYDROGEN_PLANT if typ == FILTER_PLANT else FILTER_PLANT
+        ratio = self.filter_ratio if typ == FILTER_PLANT else 1 - self.filter_ratio
+
+        self.tick_demand[typ] = float(demand.sum())
+        if other in self.supplied_types:
+            available = max(self.available_ressources - self.tick_allocated[other], 0)
+        elif self.tick_demand[other] is None:
+            # no demand of the other type known yet, use the default ratio
+            available = self.available_ressources * ratio
+        else:
+            # the demand of the other type is known from the last tick
+            available = split(self.available_ressources, self.tick_demand[typ], self.tick_demand[other])
+
+        if self.adaptive:
+            priority = np.array([plants[id]["priority"] for id in ids], dtype=np.float64)
+            allocation = allocate(available, demand, priority, demand*self.dispatch_min_load, "greedy")
+        else:
+            allocation = allocate(available, demand, None, demand*self.dispatch_min_load, self.dispatch_policy)
+        self.tick_allocated[typ] = float(allocation.sum())
+
+        if self.tick_demand[other] is not None and self.tick_demand[FILTER_PLANT] + self.tick_demand[HYDROGEN_PLANT] > 0:
+            self.filter_ratio = split(1, self.tick_demand[FILTER_PLANT], self.tick_demand[HYDROGEN_PLANT])
 
-                response = {"powersupply": ressources_supplied, "timestamp": timestamp}
-                #mqtt_client.publish(topic, json.dumps(response))
\ No newline at end of file
+        return [[plants[id]["priority"], typ, id, round(float(amount), 4), plants[id]["reply_topic"]] for id, amount in zip(ids, allocation)]
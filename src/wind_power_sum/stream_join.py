@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+
+class WindowedJoin:
+    """
+    Joins the messages of several sources per key, e.g. the power of all power plants per tick timestamp.
+    A window is emitted as soon as every expected source reported, or incomplete once its deadline passed.
+    Messages may arrive in any order, duplicates and late messages of an emitted window are dropped.
+
+    Every message costs O(1) (amortized): the windows are kept in arrival order, so the expired ones are
+    always at the front. At most max_windows windows are open at once, the oldest one is emitted
+    incomplete if a new window does not fit anymore.
+    The deadlines are checked in add and expire, so a window whose sources stay silent is only
+    emitted on time if the owner calls expire when the deadline passes (e.g. from a timer).
+    """
+
+    def __init__(self, expected_sources, timeout, max_windows):
+        self.expected_sources = expected_sources
+        self.timeout = timeout # seconds from the first message of a window to its deadline
+        self.max_windows = max_windows
+        self.windows = OrderedDict() # key -> [deadline, sources, joined value], oldest first
+        self.emitted = OrderedDict() # recently emitted keys, to drop late messages
+
+    def add(self, key, source, value, now=None):
+        """
+        Adds the value of a source to the window of the key.
+        Returns the windows emitted by this message as (key, value, number of sources, complete).
+        """
+        now = time.monotonic() if now is None else now
+        results = self.expire(now)
+        if key in self.emitted:
+            return results
+
+        window = self.windows.get(key)
+        if window is None:
+            if len(self.windows) >= self.max_windows:
+                results.append(self.emit(next(iter(self.windows)), False))
+            window = self.windows[key] = [now + self.timeout, set(), None]
+        if source in window[1]:
+            return results
+        window[1].add(source)
+        window[2] = value if window[2] is None else window[2] + value
+
+        if len(window[1]) == self.expected_sources:
+            results.append(self.emit(key, True))
+        return results
+
+    def expire(self, now=None):
+        """Emits every window whose deadline passed."""
+        now = time.monotonic() if now is None else now
+        results = []
+        while self.windows:
+            key, window = next(iter(self.windows.items()))
+            if window[0] > now:
+                break
+            results.append(self.emit(key, False))
+        return results
+
+    def emit(self, key, complete):
+        _, sources, value = self.windows.pop(key)
+        self.emitted[key] = True
+        if len(self.emitted) > self.max_windows:
+            self.emitted.popitem(last=False)
+        return key, value, len(sources), complete
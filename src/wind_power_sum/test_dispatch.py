@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from dispatch import POLICIES, allocate, split
+
+def consumers(seed, count=50):
+    rng = np.random.default_rng(seed)
+    demand = rng.uniform(0, 800, count)
+    demand[rng.random(count) < 0.1] = 0 # consumers without demand
+    return demand, rng.uniform(0, 1, count)
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("share", [0, 0.3, 0.9, 1.5])
+def test_conservation(policy, seed, share):
+    demand, priority = consumers(seed)
+    available = demand.sum() * share
+    allocation = allocate(available, demand, priority, policy=policy)
+    assert np.all(allocation >= 0)
+    assert np.all(allocation <= demand + 1e-9)
+    # without minimum loads the power is used up or every demand is served
+    assert allocation.sum() == pytest.approx(min(available, demand.sum()))
+
+@pytest.mark.parametrize("policy", POLICIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_min_load(policy, seed):
+    demand, priority = consumers(seed)
+    min_load = demand * 0.5
+    available = demand.sum() * 0.4
+    allocation = allocate(available, demand, priority, min_load, policy)
+    assert allocation.sum() <= available + 1e-6
+    served = allocation > 0
+    assert np.all(allocation[served] >= min_load[served])
+    assert np.all(allocation <= demand + 1e-9)
+
+def test_greedy_serves_by_priority():
+    demand = np.array([100.0, 100.0, 100.0])
+    priority = np.array([0.1, 0.9, 0.5])
+    assert allocate(150, demand, priority, policy="greedy").tolist() == [0, 100, 50]
+
+def test_greedy_drops_consumers_below_min_load():
+    demand = np.array([100.0, 100.0, 100.0])
+    priority = np.array([0.1, 0.9, 0.5])
+    min_load = np.array([10.0, 10.0, 60.0])
+    # the second consumer in line would get 50 < 60, it is dropped and the next one is served
+    assert allocate(150, demand, priority, min_load, "greedy").tolist() == [50, 100, 0]
+
+def test_proportional_same_share():
+    demand = np.array([100.0, 300.0, 0.0, 600.0])
+    allocation = allocate(500, demand, policy="proportional")
+    assert allocation.tolist() == [50, 150, 0, 300]
+
+def test_maxmin_levels():
+    demand = np.array([50.0, 400.0, 100.0, 300.0])
+    allocation = allocate(450, demand, policy="maxmin")
+    # the small demands are served, the others share the rest equally
+    assert allocation.tolist() == [50, 150, 100, 150]
+
+def test_negative_available():
+    demand, priority = consumers(0)
+    for policy in POLICIES:
+        assert allocate(-10, demand, priority, policy=policy).sum() == 0
+
+def test_unknown_policy():
+    with pytest.raises(SystemExit):
+        allocate(100, [10, 20], policy="random")
+
+def test_split():
+    assert split(900, 100, 200) == 300
+    assert split(900, 0, 0) == 0
@@ -0,0 +1,29 @@
+from request_ledger import COMPLETE, DUPLICATE, LATE, PENDING, RequestLedger
+
+def test_complete_tick():
+    ledger = RequestLedger(3)
+    assert ledger.add("2024-01-01T00:00", 0) == PENDING
+    assert ledger.add("2024-01-01T00:00", 2) == PENDING
+    assert ledger.missing() == 1
+    assert ledger.add("2024-01-01T00:00", 1) == COMPLETE
+    assert ledger.missing() == 0
+
+def test_duplicate_request():
+    ledger = RequestLedger(2)
+    ledger.add("2024-01-01T00:00", 0)
+    assert ledger.add("2024-01-01T00:00", 0) == DUPLICATE
+    assert ledger.missing() == 1
+
+def test_new_tick_drops_missing_requests():
+    ledger = RequestLedger(2)
+    ledger.add("2024-01-01T00:00", 0)
+    assert ledger.add("2024-01-01T00:15", 0) == PENDING
+    assert ledger.missing() == 1
+    assert ledger.add("2024-01-01T00:15", 1) == COMPLETE
+
+def test_late_request():
+    ledger = RequestLedger(2)
+    ledger.add("2024-01-01T00:15", 0)
+    assert ledger.add("2024-01-01T00:00", 1) == LATE
+    assert ledger.timestamp == "2024-01-01T00:15"
+    assert ledger.missing() == 1
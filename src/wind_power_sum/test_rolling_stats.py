@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from rolling_stats import RollingStats, RollingWindow, parse_windows
+
+def series(seed, length=500):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(100, 40, length)
+    values[rng.random(length) < 0.2] = 0 # ticks without power
+    return values
+
+def test_parse_windows():
+    assert parse_windows("day:96, week:672") == {"day": 96, "week": 672}
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("size", [1, 7, 96])
+def test_window_matches_numpy(seed, size):
+    values = series(seed)
+    window = RollingWindow(size)
+    for i, value in enumerate(values):
+        window.update(value)
+        expected = values[max(i - size + 1, 0):i + 1]
+        assert window.count == len(expected)
+        assert window.mean == pytest.approx(expected.mean(), abs=1e-9)
+        assert window.sum() == pytest.approx(expected.sum(), abs=1e-6)
+        assert window.variance() == pytest.approx(expected.var(), abs=1e-6)
+        assert window.minimum[0][1] == expected.min()
+        assert window.maximum[0][1] == expected.max()
+        positive = expected[expected > 0]
+        assert window.positive_count == len(positive)
+        assert window.positive_mean() == pytest.approx(positive.mean() if len(positive) else 0, abs=1e-9)
+
+def test_stats_are_rounded():
+    values = series(4, 200)
+    stats = RollingStats({"day": 96, "week": 672})
+    for value in values:
+        stats.update(value)
+    day = values[-96:]
+    assert stats.stats(2)["day"] == {
+        "mean": round(day.mean(), 2),
+        "min": round(day.min(), 2),
+        "max": round(day.max(), 2),
+        "std": round(day.std(), 2),
+        "count": 96,
+    }
+    assert stats.stats()["week"]["count"] == 200
+    assert stats.mean("day", 2) == round(day.mean(), 2)
+
+def test_positive_mean_skips_empty_ticks():
+    # the old calc_mean of the summed power only counted the ticks with power
+    stats = RollingStats({"day": 4})
+    for value in [0, 10, 0, 20, 0, 0]:
+        stats.update(value)
+    assert stats.mean("day") == 5
+    assert stats.mean("day", positive=True) == 20
+    stats.update(0)
+    stats.update(0)
+    assert stats.mean("day", positive=True) == 0
+
+def test_empty_window():
+    assert RollingWindow(3).stats() == {"mean": 0, "min": 0, "max": 0, "std": 0, "count": 0}
@@ -0,0 +1,79 @@
+import pytest
+from statemanager import StateManager, FILTER_PLANT, HYDROGEN_PLANT
+
+TOPICS = {"power_sum": "power_sum", "power_sum_window": "power_sum_window", "ack": "ack", "test": "test"}
+T1 = "2018-01-01T00:00:00"
+T2 = "2018-01-01T00:15:00"
+T3 = "2018-01-01T00:30:00"
+
+def manager(count_gen=2, lockstep=False):
+    return StateManager(count_gen, {FILTER_PLANT: 1, HYDROGEN_PLANT: 1}, {"day": 96}, 60.0, 64,
+                        "greedy", 0.0, TOPICS, "power_system", lockstep)
+
+def expire_all(state):
+    """Lets every open window pass its deadline, like the join timers do."""
+    state.expire_join(state.power_join, float("inf"), state.power_joined)
+
+def topics(messages):
+    return [topic for topic, _ in messages]
+
+def test_complete_tick_publishes_the_summed_power():
+    state = manager()
+    assert state.add_power(T1, "0", 400.0) == []
+    messages = state.add_power(T1, "1", 600.0)
+    assert messages[0][0] == "power_sum"
+    assert messages[0][1]["power"] == 1000.0 and messages[0][1]["timestamp"] == T1
+    assert state.available_ressources == 1000.0
+    assert state.state == 'PROCESSING_REQUESTS'
+
+def test_expired_window_publishes_the_partial_sum():
+    published = []
+    state = manager()
+    state.set_publisher(published.extend)
+    state.add_power(T1, "0", 400.0)
+    expire_all(state)
+    assert topics(published) == ["power_sum"]
+    assert published[0][1]["power"] == 400.0
+
+def test_late_partial_window_of_an_older_tick_keeps_the_current_power():
+    published = []
+    state = manager()
+    state.set_publisher(published.extend)
+    state.add_power(T1, "0", 1000.0) # plant 1 never reports for T1
+    state.add_power(T2, "0", 4000.0)
+    state.add_power(T2, "1", 6000.0)
+    assert state.available_ressources == 10000.0
+
+    expire_all(state) # the window of T1 expires after T2 completed
+    assert state.available_ressources == 10000.0
+    assert "power_sum" not in topics(published)
+    assert state.power_stats.windows["day"].count == 1
+
+    # the requests of T2 are supplied from the power of T2
+    messages = state.add_request(FILTER_PLANT, "0", "reply/filter", 3000.0, T2)
+    messages += state.add_request(HYDROGEN_PLANT, "0", "reply/hydrogen", 7000.0, T2)
+    supplied = {topic: data["amount"] for topic, data in messages}
+    assert supplied == {"reply/filter": pytest.approx(3000.0), "reply/hydrogen": pytest.approx(7000.0)}
+
+def test_late_message_of_an_emitted_window_is_dropped():
+    state = manager()
+    state.add_power(T1, "0", 400.0)
+    state.add_power(T1, "1", 600.0)
+    assert state.add_power(T1, "1", 600.0) == []
+
+def test_window_power_skips_ticks_that_are_over():
+    state = manager(count_gen=1)
+    state.add_tick(T2)
+    messages = state.add_window_power([T1, T2, T3], "0", [1.0, 2.0, 3.0])
+    sums = [data for topic, data in messages if topic == "power_sum"]
+    assert [data["timestamp"] for data in sums] == [T2]
+    assert state.available_ressources == 2.0
+    assert T1 not in state.window_power and T3 in state.window_power
+
+def test_lockstep_acknowledges_once_every_type_is_supplied():
+    state = manager(lockstep=True)
+    state.add_power(T1, "0", 500.0)
+    state.add_power(T1, "1", 500.0)
+    state.add_request(FILTER_PLANT, "0", "reply/filter", 300.0, T1)
+    messages = state.add_request(HYDROGEN_PLANT, "0", "reply/hydrogen", 700.0, T1)
+    assert topics(messages)[-1] == "ack"
@@ -0,0 +1,63 @@
+import pytest
+
+from stream_join import WindowedJoin
+
+def test_complete_window():
+    join = WindowedJoin(3, 10, 4)
+    assert join.add("t0", "a", 1.0, now=0) == []
+    assert join.add("t0", "b", 2.0, now=1) == []
+    assert join.add("t0", "c", 4.0, now=2) == [("t0", 7.0, 3, True)]
+    assert not join.windows
+
+def test_any_order_across_windows():
+    join = WindowedJoin(2, 10, 4)
+    join.add("t0", "a", 1.0, now=0)
+    join.add("t1", "b", 10.0, now=0)
+    assert join.add("t1", "a", 20.0, now=1) == [("t1", 30.0, 2, True)]
+    assert join.add("t0", "b", 2.0, now=1) == [("t0", 3.0, 2, True)]
+
+def test_expiry_at_deadline():
+    join = WindowedJoin(3, 10, 4)
+    join.add("t0", "a", 1.0, now=0)
+    join.add("t1", "a", 5.0, now=4)
+    # the deadline counts from the first message of a window
+    assert join.expire(now=9.9) == []
+    assert join.expire(now=10) == [("t0", 1.0, 1, False)]
+    assert join.expire(now=14) == [("t1", 5.0, 1, False)]
+    assert join.expire(now=100) == []
+
+def test_expiry_on_add():
+    join = WindowedJoin(2, 10, 4)
+    join.add("t0", "a", 1.0, now=0)
+    assert join.add("t1", "a", 5.0, now=11) == [("t0", 1.0, 1, False)]
+
+def test_late_and_duplicate_messages_are_dropped():
+    join = WindowedJoin(2, 10, 4)
+    join.add("t0", "a", 1.0, now=0)
+    assert join.add("t0", "a", 1.0, now=1) == [] # duplicate
+    join.expire(now=10)
+    assert join.add("t0", "b", 2.0, now=11) == [] # late, the window was emitted
+    assert "t0" not in join.windows
+
+def test_max_windows():
+    join = WindowedJoin(2, 10, 2)
+    join.add("t0", "a", 1.0, now=0)
+    join.add("t1", "a", 2.0, now=0)
+    # a third window does not fit, the oldest one is emitted incomplete
+    assert join.add("t2", "a", 3.0, now=0) == [("t0", 1.0, 1, False)]
+    assert list(join.windows) == ["t1", "t2"]
+
+def test_emitted_keys_are_bounded():
+    join = WindowedJoin(1, 10, 3)
+    for tick in range(10):
+        assert join.add(tick, "a", float(tick), now=tick) == [(tick, float(tick), 1, True)]
+    assert len(join.emitted) == 3
+
+@pytest.mark.parametrize("sources", [1, 5, 50])
+def test_window_sums_every_source_once(sources):
+    join = WindowedJoin(sources, 10, 4)
+    results = []
+    for source in range(sources):
+        results += join.add("t0", source, float(source), now=0)
+        results += join.add("t0", source, 100.0, now=0) # duplicate with another value
+    assert results == [("t0", float(sum(range(sources))), sources, True)]